@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+"""
+Loader benchmarks
+
+Drive the read, write and erase operations of the loader, and the write and
+verify flow of the cli, against the simulated bootloader
+(stmloader.simulator) for several image sizes and device profiles. Two
+figures are recorded for each run:
+
+- host: wall-clock time spent by the host, protocol code and simulator, the
+  best of the repeats. This is the figure to track between releases.
+- modelled: time the job would take on the wire and on the device, as
+  modelled by the simulator. It only changes with the protocol exchange.
+
+Results are written as JSON. With --compare, the host times are checked
+against a previous result file and the exit code is 1 on a regression.
+
+    python benchmarks/bench_loader.py -o results.json --label v0.1.0
+    python benchmarks/bench_loader.py --compare results.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from unittest import mock
+
+import scaffold
+from typer.testing import CliRunner
+
+from stmloader import bootloader
+from stmloader.boot import boot_app
+from stmloader.bootloader import STM32
+from stmloader.simulator import FLASH_BASE, SimulatedScaffold, SimulatedTarget
+
+SIZES = (4 * 1024, 64 * 1024, 512 * 1024, 2 * 1024 * 1024)
+"""Image sizes, sizes above the flash memory size of a device are left out."""
+DEVICES = (0x460, 0x462, 0x415, 0x451)
+"""Device profiles, from stmloader/data."""
+CASES = ('read', 'write', 'write-pipeline', 'erase', 'erase-legacy', 'cli-write-verify')
+TOLERANCE = 0.2
+"""Host time increase reported as a regression by --compare."""
+
+
+def image(size):
+    """Return a deterministic image of the given size, without blank chunks."""
+    return bytes((index * 7 + 1) & 0xFF or 0x5A for index in range(size))
+
+
+class Bench:
+    """
+    One run of a case: a simulated device connected to a loader, reset in
+    bootloader mode.
+    """
+
+    def __init__(self, device_id, **kwargs):
+        """
+        :param device_id: device profile
+        :param kwargs: simulated target parameters
+        """
+        self.target = SimulatedTarget.from_device_id(device_id, **kwargs)
+        self.board = SimulatedScaffold(self.target)
+        self.patches = [mock.patch.object(bootloader, 'sleep', self.board.sleep),
+                        mock.patch.object(scaffold, 'Scaffold', lambda port: self.board)]
+        for patch in self.patches:
+            patch.start()
+        self.loader = STM32(self.board, verbosity=0)
+        self.loader.reset_from_system_memory(0)
+
+    def close(self):
+        """Restore the patched functions."""
+        for patch in reversed(self.patches):
+            patch.stop()
+
+    def pages(self, size):
+        """Return the indexes of the pages holding an image of the given size."""
+        return list(range(-(-size // self.loader.flash_page_size)))
+
+
+def setup_case(case, device_id, size, folder):
+    """
+    Prepare a case, return the Bench and the operation to time, or None when
+    the case does not apply to the size.
+    :param case: case name
+    :param device_id: device profile
+    :param size: image size
+    :param folder: temporary folder
+    """
+    # pylint: disable=too-many-return-statements
+    bench = Bench(device_id, extended_erase=case != 'erase-legacy')
+    if size > len(bench.target.flash.data):
+        bench.close()
+        return None
+    data = image(size)
+    if case == 'read':
+        bench.target.flash.data[:size] = data
+        return bench, lambda: bench.loader.read_memory_data(FLASH_BASE, size)
+    if case == 'write':
+        return bench, lambda: bench.loader.write_memory_data(FLASH_BASE, data)
+    if case == 'write-pipeline':
+        return bench, lambda: bench.loader.write_memory_data(FLASH_BASE, data, pipeline=True)
+    if case in ('erase', 'erase-legacy'):
+        pages = bench.pages(size)
+        if case == 'erase-legacy' and pages[-1] > 0xFF:
+            # Erase page numbers are single bytes
+            bench.close()
+            return None
+        return bench, lambda: bench.loader.erase_pages(pages)
+    if case == 'cli-write-verify':
+        file = os.path.join(folder, f'image_{size}.bin')
+        with open(file, 'wb') as f:
+            f.write(data)
+        runner = CliRunner()
+        args = ['-v', '0', '--progress', 'none', 'reset', '-t', '0', 'write', '-a', str(FLASH_BASE), '-v', file]
+
+        def flow():
+            result = runner.invoke(boot_app, args)
+            if result.exit_code or 'Verification failed' in result.output:
+                raise RuntimeError(f"cli write failed: {result.output}")
+        return bench, flow
+    raise ValueError(f"Unknown case {case}")
+
+
+def run_case(case, device_id, size, repeat, folder):
+    """
+    Time a case, return its result dictionary or None when it does not
+    apply.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    host = []
+    modelled = 0.0
+    for _ in range(repeat):
+        prepared = setup_case(case, device_id, size, folder)
+        if prepared is None:
+            return None
+        bench, operation = prepared
+        try:
+            clock = bench.board.clock
+            start = time.perf_counter()
+            operation()
+            host.append(time.perf_counter() - start)
+            modelled = bench.board.clock - clock
+        finally:
+            bench.close()
+    return {'case': case, 'device': f'0x{device_id:X}', 'size': size, 'host': min(host), 'modelled': modelled,
+            'host_us_per_kb': min(host) * 1e6 / (size / 1024)}
+
+
+def run(cases=CASES, devices=DEVICES, sizes=SIZES, repeat=3, log=None):
+    """
+    Run the benchmarks, return the results document.
+    :param cases: case names
+    :param devices: device profiles
+    :param sizes: image sizes
+    :param repeat: runs of each case, the fastest is kept
+    :param log: stream the results are printed to as they come, if any
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for case in cases:
+            for device_id in devices:
+                for size in sizes:
+                    result = run_case(case, device_id, size, repeat, folder)
+                    if result is None:
+                        continue
+                    results.append(result)
+                    if log is not None:
+                        print(f"{case:18} {result['device']:6} {size // 1024:6d} KB  host {result['host']:8.3f}s  "
+                              f"modelled {result['modelled']:8.3f}s", file=log)
+    return {'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+
+
+def compare(document, baseline, tolerance=TOLERANCE):
+    """
+    Return the results whose host time grew beyond the tolerance, as
+    (result, baseline result) tuples.
+    :param document: results document
+    :param baseline: previous results document
+    :param tolerance: relative increase allowed
+    """
+    previous = {(result['case'], result['device'], result['size']): result for result in baseline['results']}
+    regressions = []
+    for result in document['results']:
+        reference = previous.get((result['case'], result['device'], result['size']))
+        if reference is not None and result['host'] > reference['host'] * (1 + tolerance):
+            regressions.append((result, reference))
+    return regressions
+
+
+def main():
+    """
+    Run the benchmarks from the command line.
+    """
+    parser = argparse.ArgumentParser(description="stmloader benchmarks against the simulated bootloader")
+    parser.add_argument('-o', '--output', help="JSON result file")
+    parser.add_argument('--label', help="Label of the results, e.g. the release")
+    parser.add_argument('--case', action='append', choices=CASES, help="Case to run, all by default")
+    parser.add_argument('--device', action='append', type=lambda value: int(value, 0),
+                        help="Device ID to run, all by default")
+    parser.add_argument('--size', action='append', type=int, help="Image size in bytes, all by default")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs of each case, the fastest is kept")
+    parser.add_argument('--compare', help="Previous JSON result file to check the host times against")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="Host time increase allowed")
+    args = parser.parse_args()
+    document = run(args.case or CASES, args.device or DEVICES, args.size or SIZES, args.repeat, log=sys.stdout)
+    document['label'] = args.label
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as f:
+            json.dump(document, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r', encoding='UTF-8') as f:
+            regressions = compare(document, json.load(f), args.tolerance)
+        for result, reference in regressions:
+            print(f"Regression: {result['case']} {result['device']} {result['size']} bytes, host "
+                  f"{reference['host']:.3f}s -> {result['host']:.3f}s")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
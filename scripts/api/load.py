@@ -10,6 +10,7 @@ import sys
 from intelhex import IntelHex
 from scaffold import Scaffold
 from stmloader.bootloader import STM32
+from stmloader.image import segments_from_intelhex
 
 
 def main():
@@ -27,9 +28,8 @@ def main():
     ih = IntelHex()
 
     ih.loadhex('test.hex')
-    # write
-    data = ih.tobinarray()
-    loader.write_memory_data(ih.minaddr(), data)
+    # write populated ranges only
+    loader.write_memory_segments(segments_from_intelhex(ih))
 
 
 if __name__ == '__main__':
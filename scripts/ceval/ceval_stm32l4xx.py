@@ -27,7 +27,7 @@ class Ceva:
 
     """
 
-    def __init__(self, timeout, dev) -> None:
+    def __init__(self, timeout, dev, baudrate=115200) -> None:
         self.scaffold = Scaffold(dev)
         self.scaffold.timeout = timeout
         # Reset signal
@@ -40,7 +40,7 @@ class Ceva:
         self.uart.rx << self.scaffold.d1
         self.uart.tx >> self.scaffold.d0
 
-        self.uart.baudrate = 115200
+        self.uart.baudrate = baudrate
         self.uart.flush()
 
     def send(self, data):
@@ -100,6 +100,7 @@ def main():
     parser.add_argument('-d', '--dev', choices=choices, help='scaffold serial device path')
     parser.add_argument('-i', '--iteration', default=1, help='command iteration number')
     parser.add_argument('-w', '--waiting', type=float, default=1, help='uart reception timeout')
+    parser.add_argument('-b', '--baudrate', type=int, default=115200, help='uart baud rate')
     parser.add_argument('-s', '--scenario', default='aes', choices=['aes'], help='ceva command')
     parser.add_argument('-l', '--log', action="store_true", default=False, help='Enable or disable logging in file')
     args = parser.parse_args()
@@ -135,7 +136,7 @@ def main():
 
     try:
         # Connect to Scaffold board
-        ceva = Ceva(timeout=args.waiting, dev=args.dev)
+        ceva = Ceva(timeout=args.waiting, dev=args.dev, baudrate=args.baudrate)
     except Exception as e:
         print(e)
         sys.exit(-1)
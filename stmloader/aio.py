@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+"""
+asyncio front end of the bootloader
+
+The Scaffold link is a blocking serial port: each bootloader transaction
+still runs in a thread of the loop executor, but only for the duration of
+the transaction. Reset waits are awaited on the event loop, so that a single
+process can drive many targets and overlap their waits with other work.
+"""
+import asyncio
+import functools
+from scaffold import TimeoutError as ScaffoldTimeoutError
+from . import log
+from .bootloader import STM32, STM32Error
+
+
+class AsyncSTM32:
+    """
+    Coroutine version of the :class:`STM32` operations. Operations of one
+    target are serialized, operations of several targets run concurrently.
+    """
+
+    # pylint: disable=protected-access
+
+    def __init__(self, scaffold, verbosity=5, baudrate=STM32.BAUDRATE_DEFAULT, executor=None):
+        """
+        :param scaffold: A scaffold object
+        :param verbosity: verbosity level
+        :param baudrate: UART baud rate, or STM32.BAUDRATE_AUTO
+        :param executor: executor of the serial transactions, the loop default
+            executor if None
+        """
+        self.loader = STM32(scaffold, verbosity=verbosity, baudrate=baudrate)
+        self.executor = executor
+        self._lock = None
+
+    async def _run(self, function, *args, **kwargs):
+        """
+        Run a blocking loader call in the executor.
+        :param function: loader method
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    def _locked(self):
+        """Return the lock serializing the operations on the target."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _power_cycle(self, boot0, startup):
+        """
+        Run the power-cycle and reset sequence, awaiting its waits.
+        :param boot0: BOOT0 level, 1 to boot on System Memory
+        :param startup: startup waiting time
+        """
+        steps = self.loader._power_cycle(boot0, startup)
+        while True:
+            delay = await self._run(next, steps, None)
+            if delay is None:
+                return
+            await asyncio.sleep(delay)
+
+    async def _reset_and_synchronize(self, baudrate, startup):
+        await self._power_cycle(1, self.loader.startup_delay)
+        await self._run(self.loader._activate, baudrate, startup)
+
+    async def reset_from_system_memory(self, startup=None):
+        """
+        Reset target device in bootloader mode, see
+        :meth:`STM32.reset_from_system_memory`.
+        :param startup: longest startup waiting time, from the device
+            description if None
+        """
+        if startup is None:
+            startup = self.loader.startup_timeout
+        async with self._locked():
+            if self.loader.baudrate != STM32.BAUDRATE_AUTO:
+                await self._reset_and_synchronize(self.loader.baudrate, startup)
+                return
+            for baudrate in STM32.AUTO_BAUDRATES[:-1]:
+                try:
+                    await self._reset_and_synchronize(baudrate, startup)
+                    return
+                except (ScaffoldTimeoutError, STM32Error, ValueError) as e:
+                    log.transport.info("No bootloader activation at %d bauds (%s) -- stepping down", baudrate, e)
+            await self._reset_and_synchronize(STM32.AUTO_BAUDRATES[-1], startup)
+
+    async def reset_from_flash(self, startup=0.1):
+        """
+        Reset target device to boot from user Flash memory.
+        :param startup: startup waiting time
+        """
+        async with self._locked():
+            await self._power_cycle(0, startup)
+
+    async def get_id(self):
+        """Return the product id, see :meth:`STM32.get_id`."""
+        async with self._locked():
+            return await self._run(self.loader.get_id)
+
+    async def read_memory_data(self, address, length):
+        """
+        Read memory, one Read Memory command per transaction, see
+        :meth:`STM32.iter_memory`.
+        :param address: Memory address to be read.
+        :param length: Number of bytes to be read.
+        """
+        data = bytearray()
+        async with self._locked():
+            chunks = self.loader.iter_memory(address, length)
+            while True:
+                chunk = await self._run(next, chunks, None)
+                if chunk is None:
+                    return data
+                data += chunk[1]
+
+    async def write_memory_data(self, address, data, skip_blank=False):
+        """
+        Write memory, see :meth:`STM32.write_memory_data`.
+        :param address: target address
+        :param data: data to write
+        :param skip_blank: do not write blank chunks
+        """
+        await self.write_memory_segments([(address, data)], skip_blank)
+
+    async def write_memory_segments(self, segments, skip_blank=False):
+        """
+        Write a sparse image, see :meth:`STM32.write_memory_segments`.
+        :param segments: list of (address, data)
+        :param skip_blank: do not write blank chunks
+        """
+        async with self._locked():
+            await self._run(self.loader.write_memory_segments, segments, skip_blank)
+
+    async def erase_pages(self, pages):
+        """
+        Erase flash pages, see :meth:`STM32.erase_pages`.
+        :param pages: iterable of page indexes, zero-based.
+        """
+        async with self._locked():
+            await self._run(self.loader.erase_pages, list(pages))
+
+    async def erase_memory(self, pages=None):
+        """
+        Erase flash memory, see :meth:`STM32.erase_memory`.
+        :param pages: page indexes, None for the full memory
+        """
+        async with self._locked():
+            await self._run(self.loader.erase_memory, pages)
+
+    async def go(self, address):
+        """
+        Execute the Go command.
+        :param address: Jump to address.
+        """
+        # pylint: disable=invalid-name
+        async with self._locked():
+            await self._run(self.loader.go, address)
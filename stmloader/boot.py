@@ -7,19 +7,126 @@
 """
 Bootloader over donjon-scaffold cli application
 """
-from typing import Optional
+import functools
+import glob
+import sys
+import zlib
+from contextlib import ExitStack
+from typing import List, Optional
 from enum import Enum
 from pathlib import Path
 
-import scaffold
+import click
 import typer
 from typing_extensions import Annotated
-from scaffold import Scaffold
-from intelhex import IntelHex
-from serial.serialutil import SerialException
-from .bootloader import STM32, CommandError
+from . import log
+from .image import segments_from_intelhex, BinWriter, HexWriter, SRecWriter, DumpWriter
 
-boot_app = typer.Typer(help="stm32 bootloader cli ", chain=True, )
+# scaffold, intelhex and the bootloader are slow to import: commands load them
+# when they run, so that --help and the devices cli do not pay for them
+# pylint: disable=import-outside-toplevel
+
+
+class BoardContext:
+    """
+    Context of one board of a multi-board job: commands only use its obj
+    dictionary.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, obj):
+        """
+        :param obj: board dictionary
+        """
+        self.obj = obj
+
+
+def _run_on_board(command, board, kwargs):
+    """
+    Run a command on a board, recording its failure.
+    :param command: command function
+    :param board: board dictionary
+    :param kwargs: command parameters
+    """
+    try:
+        command(BoardContext(board), **kwargs)
+    except (typer.Exit, click.exceptions.Exit) as e:
+        # the command ends the job of the board
+        board['running'] = False
+        if e.exit_code and not board['error']:
+            board['error'] = f"exit code {e.exit_code}"
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        board['running'] = False
+        board['error'] = f"{type(e).__name__}: {e}"
+
+
+def per_board(command):
+    """
+    Run a command on every board of a multi-board job (see --ports),
+    concurrently, one thread per board. Boards whose job ended on a previous
+    command are left out.
+    """
+    @functools.wraps(command)
+    def wrapper(ctx, **kwargs):
+        boards = ctx.obj.get('boards') if ctx.obj else None
+        if boards is None:
+            return command(ctx, **kwargs)
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        running = [board for board in boards if board['running'] and not board['error']]
+        if not running:
+            return None
+        with ThreadPoolExecutor(max_workers=len(running)) as pool:
+            futures = {pool.submit(_run_on_board, command, board, kwargs): board for board in running}
+            for done, future in enumerate(as_completed(futures), 1):
+                board = futures[future]
+                status = f"failed ({board['error']})" if board['error'] else "done"
+                print(f"[{done}/{len(running)}] {board['port']}: {command.__name__} {status}", file=sys.stderr)
+        return None
+    return wrapper
+
+
+def end_job(ctx):
+    """
+    End the job of the board: the next commands are not run. The exit code
+    is 1 when a command of the job failed.
+    :param ctx: command context
+    """
+    raise typer.Exit(code=1 if ctx.obj and ctx.obj.get('error') else 0)
+
+
+def report(results, **kwargs):
+    """
+    Print the result of each board of a multi-board job. The exit code is 1
+    when a board failed, or when the command of a single board job failed.
+    """
+    # pylint: disable=unused-argument
+    obj = click.get_current_context().obj
+    boards = obj.get('boards') if obj else None
+    if not boards:
+        if obj and obj.get('error'):
+            raise typer.Exit(code=1)
+        return
+    for board in boards:
+        print(f"{board['port']}: {'FAILED ' + board['error'] if board['error'] else 'OK'}")
+    if any(board['error'] for board in boards):
+        raise typer.Exit(code=1)
+
+
+def expand_ports(value: str):
+    """
+    Return the ports of a comma separated list, glob patterns expanded.
+    :param value: ports list
+    """
+    ports = []
+    for item in value.split(','):
+        item = item.strip()
+        matches = sorted(glob.glob(item)) if glob.has_magic(item) else [item]
+        ports += [port for port in matches if port and port not in ports]
+    return ports
+
+
+boot_app = typer.Typer(help="stm32 bootloader cli ", chain=True, result_callback=report)
 
 
 def auto_int_callback(value: str):
@@ -32,6 +139,23 @@ def auto_int_callback(value: str):
         raise typer.Exit(code=1) from exc
 
 
+def baudrate_callback(value: str):
+    """Convert to a baud rate, 'auto' for automatic negotiation."""
+    from .bootloader import STM32
+    if value.lower() == 'auto':
+        return STM32.BAUDRATE_AUTO
+    return auto_int_callback(value)
+
+
+def log_levels_callback(values: List[str]):
+    """Convert 'subsystem=level' specifications to (subsystem, level)."""
+    try:
+        return [log.parse_level(value) for value in values or []]
+    except ValueError as exc:
+        print(f"{exc} !")
+        raise typer.Exit(code=1) from exc
+
+
 class ResetMode(str, Enum):
     """Reset mode enumerate"""
     SYSTEM = 'system'
@@ -39,14 +163,19 @@ class ResetMode(str, Enum):
 
 
 @boot_app.command()
+@per_board
 def reset(ctx: typer.Context,
           mode: Annotated[
               ResetMode, typer.Option("--mode", "-m", case_sensitive=False, help="Reset mode")] = ResetMode.SYSTEM,
-          timeout: Annotated[float, typer.Option("--timeout", "-t", help="Minimum timeout")] = 0.1,
+          timeout: Annotated[
+              Optional[float], typer.Option("--timeout", "-t",
+                                            help="Longest bootloader startup time, the device one by default. "
+                                                 "Startup time in flash mode, 0.1 by default")] = None,
           ):
     """
     Reset to system/flash  memory command
     """
+    import scaffold
     if ctx.obj is None:
         raise typer.Exit()
     try:
@@ -54,56 +183,191 @@ def reset(ctx: typer.Context,
             ctx.obj['loader'].reset_from_system_memory(timeout)
             ctx.obj['reset'] = True
         else:
-            ctx.obj['loader'].reset_from_flash_memory(timeout)
+            ctx.obj['loader'].reset_from_flash(0.1 if timeout is None else timeout)
             ctx.obj['reset'] = False
     except scaffold.TimeoutError as msg:
         print(f"{msg} Consider to change reset startup time with option --timeout/-t")
+        ctx.obj['error'] = f"reset timeout: {msg}"
+
+
+class ReadFormat(str, Enum):
+    """Read output file format enumerate"""
+    AUTO = 'auto'
+    BIN = 'bin'
+    HEX = 'hex'
+    SREC = 'srec'
+
+
+# output format from the file suffix, Intel hex otherwise
+READ_SUFFIXES = {'.bin': ReadFormat.BIN,
+                 '.srec': ReadFormat.SREC, '.s19': ReadFormat.SREC, '.s28': ReadFormat.SREC,
+                 '.s37': ReadFormat.SREC, '.mot': ReadFormat.SREC}
+
+READ_WRITERS = {ReadFormat.BIN: BinWriter, ReadFormat.HEX: HexWriter, ReadFormat.SREC: SRecWriter}
 
 
 @boot_app.command()
+@per_board
 def read(ctx: typer.Context,
          address: Annotated[
              str, typer.Option("--address", "-a", callback=auto_int_callback, help="Starting address")] = '0x08000000',
          length: Annotated[int, typer.Option("--length", "-l", help="Length to read")] = 0,
-         file: Annotated[Optional[str], typer.Argument(help="Output Intel hex file name")] = None,
+         file: Annotated[Optional[str], typer.Argument(help="Output file name")] = None,
+         fmt: Annotated[
+             ReadFormat, typer.Option("--format", "-f", case_sensitive=False,
+                                      help="Output file format, from the file suffix by default")] = ReadFormat.AUTO,
+         dump: Annotated[
+             Optional[bool], typer.Option("--dump/--no-dump", help="Hex dump on the console, default without file")
+         ] = None,
          ):
     """
     Read memory command
     """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
     if ctx.obj is None or ctx.obj['reset'] is not True:
-        raise typer.Exit()
-    data = ctx.obj['loader'].read_memory_data(address, length)
+        end_job(ctx)
+    with ExitStack() as stack:
+        writers = []
+        if file and 'port' in ctx.obj:
+            # one output file per board
+            path = Path(file)
+            file = str(path.with_name(f"{path.stem}_{Path(ctx.obj['port']).name}{path.suffix}"))
+        if file:
+            if fmt == ReadFormat.AUTO:
+                fmt = READ_SUFFIXES.get(Path(file).suffix.lower(), ReadFormat.HEX)
+            if fmt == ReadFormat.BIN:
+                stream = stack.enter_context(open(file, 'wb'))
+            else:
+                stream = stack.enter_context(open(file, 'w', encoding='ascii'))
+            writers.append(READ_WRITERS[fmt](stream))
+        if dump or (dump is None and not file):
+            writers.append(DumpWriter(sys.stdout, address, length))
+        # chunks go to the outputs as they are received
+        for chunk_address, data in ctx.obj['loader'].iter_memory(address, length):
+            for writer in writers:
+                writer.write(chunk_address, data)
+        for writer in writers:
+            writer.close()
+
+
+def load_segments(file, address):
+    """
+    Return the (address, data) segments of an image file, binary or Intel
+    hex.
+    :param file: image file name
+    :param address: load address of a binary file
+    """
+    from intelhex import IntelHex
     ih = IntelHex()
-    ih.frombytes(data, address)
-    ih.dump()
-    if file:
-        ih.write_hex_file(file)
+    if Path(file).suffix in ['.BIN', '.bin']:
+        ih.loadbin(file, offset=address)
+    elif Path(file).suffix in ['.HEX', '.hex']:
+        ih.loadhex(file)
+    # write populated ranges only
+    return segments_from_intelhex(ih)
+
+
+class ErasePlan(str, Enum):
+    """
+    Erase before write enumerate
+    """
+    NONE = 'none'
+    PAGES = 'pages'
+    AUTO = 'auto'
 
 
 @boot_app.command()
+@per_board
 def write(ctx: typer.Context,
           address: Annotated[
               str, typer.Option("--address", "-a", callback=auto_int_callback, help="Starting address")] = '0x08000000',
           file: Annotated[Optional[str], typer.Argument(help="File to write")] = None,
-          verify: Annotated[bool, typer.Option("--verify", "-v", help="Write verify")] = False):
+          verify: Annotated[bool, typer.Option("--verify", "-v", help="Write verify")] = False,
+          force: Annotated[bool, typer.Option("--force", "-f", help="Write blank (0xFF) chunks too")] = False,
+          diff: Annotated[bool, typer.Option("--diff", "-d", help="Erase and write changed pages only")] = False,
+          crc: Annotated[bool, typer.Option("--crc", "-c", help="Write verify with on-target CRC-32")] = False,
+          stub: Annotated[bool, typer.Option("--stub", "-s", help="Write flash through a RAM flash loader")] = False,
+          pipeline: Annotated[
+              bool, typer.Option("--pipeline", help="Send the frames of a chunk without waiting for each ACK")
+          ] = False,
+          erase_plan: Annotated[
+              ErasePlan, typer.Option("--erase", "-e", case_sensitive=False,
+                                      help="Erase the pages touched by the image first, or whole banks when "
+                                           "mostly covered (auto)")] = ErasePlan.NONE,
+          resume: Annotated[
+              bool, typer.Option("--resume", "-r", help="Keep a journal of the chunks written, and continue the "
+                                                        "write it records")] = False,
+          check_last: Annotated[
+              int, typer.Option("--check-last", help="Chunks of the journal verified before continuing")] = 2,
+          journal_path: Annotated[
+              Optional[str], typer.Option("--journal", help="Journals folder, ~/.cache/stmloader/journal by default")
+          ] = None):
     """
     Write memory command
     """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals,too-many-branches
+    from .bootloader import PageIndexError
     if ctx.obj is None or ctx.obj['reset'] is not True:
-        raise typer.Exit()
-    ih = IntelHex()
-    if Path(file).suffix in ['.BIN', '.bin']:
-        ih.loadbin(file, offset=address)
-    elif Path(file).suffix in ['.HEX', '.hex']:
-        ih.loadhex(file)
-    # write a chunks
-    data = ih.tobinarray()
-    ctx.obj['loader'].write_memory_data(ih.minaddr(), data)
-    if verify:
-        length = ih.maxaddr() - ih.minaddr() + 1
-        offset = ih.minaddr()
-        reload = ctx.obj['loader'].read_memory_data(offset, length)
-        ctx.obj['loader'].debug(0, "Verification successfully" if (data == reload) else "Verification failed")
+        end_job(ctx)
+    segments = load_segments(file, address)
+    if diff:
+        # only the changed pages are erased and written
+        try:
+            ctx.obj['loader'].write_memory_diff(segments)
+        except PageIndexError as e:
+            print(e)
+            raise typer.Exit(code=1)
+    else:
+        journal = open_journal(ctx.obj['loader'], segments, journal_path) if resume and not stub else None
+        erase_first = erase_plan != ErasePlan.NONE and not (journal is not None and journal.erased)
+        try:
+            if journal is not None and journal.written and not erase_first:
+                log.protocol.info("Continuing the write after %d chunks", len(journal.written))
+                ctx.obj['loader'].check_journal(journal, segments, check_last, skip_blank=not force)
+            operations = ctx.obj['loader'].plan_erase(segments, whole_banks=erase_plan == ErasePlan.AUTO) \
+                if erase_first else []
+        except PageIndexError as e:
+            # sectors: nothing is erased nor written
+            print(e)
+            raise typer.Exit(code=1)
+        if erase_first:
+            ctx.obj['loader'].erase_planned(operations)
+            if journal is not None:
+                # the chunks written before are erased too
+                journal.drop(journal.written)
+                journal.record_erase()
+        if stub:
+            ctx.obj['loader'].write_memory_stub(segments, skip_blank=not force)
+        else:
+            ctx.obj['loader'].write_memory_segments(segments, skip_blank=not force, journal=journal, pipeline=pipeline)
+        if journal is not None:
+            journal.remove()
+    if crc or verify:
+        if crc:
+            # only a checksum per segment is read back
+            checksums = ctx.obj['loader'].checksum_memory([(offset, len(data)) for offset, data in segments])
+            success = checksums == [zlib.crc32(data) for _, data in segments]
+        else:
+            success = ctx.obj['loader'].verify_memory_segments(segments)
+        log.protocol.log(log.NOTICE, "Verification successfully" if success else "Verification failed")
+        if not success:
+            ctx.obj['error'] = "verification failed"
+
+
+def open_journal(loader, segments, path):
+    """
+    Return the write journal of an image on the connected device, None when
+    the device UID is unknown.
+    :param loader: STM32 loader
+    :param segments: list of (address, data)
+    :param path: journals folder, the default one if None
+    """
+    from .journal import JOURNAL_PATH, Journal, image_hash
+    uid = loader.get_uid()
+    if uid == loader.UID_ADDRESS_UNKNOWN:
+        log.protocol.log(log.NOTICE, "Device UID unknown, write not journaled")
+        return None
+    return Journal(uid, image_hash(segments), path or JOURNAL_PATH)
 
 
 class EraseMode(str, Enum):
@@ -117,6 +381,7 @@ class EraseMode(str, Enum):
 
 
 @boot_app.command()
+@per_board
 def erase(ctx: typer.Context,
           address: Annotated[
               str, typer.Option("--address", "-a", callback=auto_int_callback, help="Starting address")] = '0x08000000',
@@ -127,21 +392,23 @@ def erase(ctx: typer.Context,
     """
     Erase memory command
     """
+    from .bootloader import CommandError
     if ctx.obj is None or ctx.obj['reset'] is not True:
-        raise typer.Exit()
+        end_job(ctx)
     try:
         if ctx.obj['loader'].extended_erase and mode != EraseMode.NONE:
             ctx.obj['loader'].extended_erase_special(special=mode)
             raise typer.Exit()
         if address and length:
             pages = ctx.obj['loader'].pages_from_range(address, int(address) + length)
-            ctx.obj['loader'].erase_memory(pages=pages)
+            ctx.obj['loader'].erase_pages(pages)
             return
     except CommandError as e:
         # may be caused by readout protection
-        ctx.obj['loader'].debug(0, e)
+        log.protocol.log(log.NOTICE, "%s", e)
+        ctx.obj['error'] = str(e)
         ctx.obj['loader'].reset_from_flash()
-        raise typer.Exit()
+        end_job(ctx)
 
 
 class GetInfo(str, Enum):
@@ -156,14 +423,16 @@ class GetInfo(str, Enum):
 
 
 @boot_app.command()
+@per_board
 def get(ctx: typer.Context,
         info: Annotated[GetInfo, typer.Option("--info", "-i", case_sensitive=False,
                                               help="Get information")] = GetInfo.PROTOCOL_VERSION):
     """
     Get information command
     """
+    from .bootloader import CommandError
     if ctx.obj is None or ctx.obj['reset'] is not True:
-        raise typer.Exit()
+        end_job(ctx)
     try:
         if info == GetInfo.BOOTLOADER_VERSION:
             ctx.obj['loader'].get_bootloader_id()
@@ -177,9 +446,11 @@ def get(ctx: typer.Context,
             ctx.obj['loader'].get_flash_size()
     except CommandError as e:
         print(e)
+        ctx.obj['error'] = str(e)
 
 
 @boot_app.command()
+@per_board
 def go(ctx: typer.Context,
        address: Annotated[
            str, typer.Option("--address", "-a", callback=auto_int_callback, help="Starting address")] = '0x08000000',
@@ -188,7 +459,7 @@ def go(ctx: typer.Context,
     Go command
     """
     if ctx.obj is None or ctx.obj['reset'] is not True:
-        raise typer.Exit()
+        end_job(ctx)
     ctx.obj['loader'].go(address)
 
 
@@ -209,6 +480,7 @@ class ProtecState(str, Enum):
 
 
 @boot_app.command()
+@per_board
 def protect(ctx: typer.Context,
             mode: Annotated[ProtecMode, typer.Option("--mode", "-m", case_sensitive=False,
                                                      help="Protection mode")] = ProtecMode.READ,
@@ -220,25 +492,167 @@ def protect(ctx: typer.Context,
     protection command
     """
     if ctx.obj is None or ctx.obj['reset'] is not True:
-        raise typer.Exit()
+        end_job(ctx)
     if mode == "Read" and state == 'disable':
         ctx.obj['loader'].readout_unprotect()
     elif mode == "Read" and state == 'enable':
         ctx.obj['loader'].readout_protect()
     else:
-        ctx.obj['loader'].debug(0, f"Operation protect {mode} {state} not yet supported !")
+        log.protocol.log(log.NOTICE, "Operation protect %s %s not yet supported !", mode, state)
+
+
+class StatsFormat(str, Enum):
+    """Job metrics output format enumerate"""
+    JSON = 'json'
+    PROMETHEUS = 'prometheus-textfile'
+
+
+class LogFormat(str, Enum):
+    """Log messages output format enumerate"""
+    TEXT = log.TEXT
+    JSON = log.JSON
+
+
+class ProgressFormat(str, Enum):
+    """Transfer progress output enumerate"""
+    BAR = 'bar'
+    JSON = 'json'
+    NONE = 'none'
+
+
+def progress_renderer(fmt, port=None):
+    """
+    Return the progress callback of a loader.
+    :param fmt: progress output format
+    :param port: port of the board, in multi-board jobs
+    """
+    from .progress import BarRenderer, JsonRenderer
+    if fmt == ProgressFormat.JSON:
+        return JsonRenderer(port=port) if port is not None else JsonRenderer()
+    # progress bars of concurrent boards would mix
+    if fmt == ProgressFormat.BAR and port is None:
+        return BarRenderer()
+    return None
+
+
+def emit_stats(ctx, fmt, file, port):
+    """
+    Output the metrics of the loaders of the job, by port.
+    :param ctx: job context
+    :param fmt: output format
+    :param file: output file name, standard output if None
+    :param port: port of the loader, out of a multi-board job
+    """
+    from .metrics import to_json, to_prometheus, write_atomic
+    obj = ctx.obj or {}
+    if obj.get('boards') is not None:
+        loaders = {board['port']: board['loader'] for board in obj['boards'] if 'loader' in board}
+    elif 'loader' in obj:
+        loaders = {port: obj['loader']}
+    else:
+        return
+    metrics = {port: loader.metrics for port, loader in loaders.items()}
+    text = to_json(metrics) + '\n' if fmt == StatsFormat.JSON else to_prometheus(metrics)
+    if file is None:
+        sys.stdout.write(text)
+    else:
+        write_atomic(file, text)
+
+
+def open_traced(ctx, open_board, file, port):
+    """
+    Open a board recording its UART exchange. The trace file is closed with
+    the job.
+    :param ctx: job context
+    :param open_board: board constructor, given the port
+    :param file: trace file name, suffixed with the port name in multi-board
+        jobs
+    :param port: port of the board
+    """
+    from .trace import record
+    board = open_board(port)
+    if ctx.params.get('ports') is not None:
+        path = Path(file)
+        file = str(path.with_name(f"{path.stem}_{Path(port).name}{path.suffix}"))
+    stream = open(file, 'wb')  # pylint: disable=consider-using-with
+    ctx.call_on_close(stream.close)
+    return record(board, stream)
 
 
 @boot_app.callback()
 def main(ctx: typer.Context,
          port: Annotated[str, typer.Option("--port", "-p", help="Scaffold Communication port")] = '/dev/ttyUSB0',
          verbose: Annotated[int, typer.Option("--verbose", "-v", help="Verbosity level")] = 5,
+         # default STM32.BAUDRATE_DEFAULT
+         baudrate: Annotated[
+             str, typer.Option("--baudrate", "-b", callback=baudrate_callback,
+                               help="UART baud rate, or 'auto' for the fastest one")] = '115200',
+         ports: Annotated[
+             Optional[str], typer.Option("--ports", help="Comma separated Scaffold ports or glob patterns, "
+                                                         "the commands run on every board concurrently")] = None,
+         stats: Annotated[
+             Optional[StatsFormat], typer.Option("--stats", case_sensitive=False,
+                                                 help="Output the job metrics at the end of the job")] = None,
+         stats_file: Annotated[
+             Optional[str], typer.Option("--stats-file", help="Metrics output file, standard output by default")
+         ] = None,
+         trace: Annotated[
+             Optional[str], typer.Option("--trace", help="Record the UART exchange into a trace file, one per port "
+                                                         "with --ports")] = None,
+         replay: Annotated[
+             Optional[str], typer.Option("--replay", help="Replay a trace file instead of using a Scaffold board")
+         ] = None,
+         progress: Annotated[
+             ProgressFormat, typer.Option("--progress", case_sensitive=False,
+                                          help="Transfer progress output, on the standard error. Bars are not "
+                                               "drawn with --ports")] = ProgressFormat.BAR,
+         log_levels: Annotated[
+             Optional[List[str]], typer.Option("--log", callback=log_levels_callback,
+                                               help="Log level of a subsystem overriding the verbosity, e.g. "
+                                                    "protocol=debug. Subsystems: protocol, transport, devices")
+         ] = None,
+         log_format: Annotated[
+             LogFormat, typer.Option("--log-format", case_sensitive=False,
+                                     help="Log messages output, on the standard error")] = LogFormat.TEXT,
          ):
     """
     Command callback
     """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    from scaffold import Scaffold
+    from serial.serialutil import SerialException
+    from .bootloader import STM32
+    open_board = Scaffold
+    log.setup(verbose, log_levels, log_format.value)
+    if stats is not None:
+        # also run when a command ends the job early
+        ctx.call_on_close(functools.partial(emit_stats, ctx, stats, stats_file, port))
+    if replay is not None:
+        from .trace import ReplayScaffold
+        open_board = ReplayScaffold.from_file
+        port = replay
+    if trace is not None:
+        open_board = functools.partial(open_traced, ctx, open_board, trace)
+    if ports is not None:
+        # multi-board job: one board dictionary per port
+        if ctx.obj is None:
+            ctx.obj = {}
+        ctx.obj['boards'] = []
+        for name in expand_ports(ports):
+            board = {'port': name, 'reset': False, 'running': True, 'error': None}
+            try:
+                board['loader'] = STM32(open_board(name), verbosity=verbose, baudrate=baudrate)
+                board['loader'].progress = progress_renderer(progress, name)
+            except SerialException as e:
+                board['error'] = str(e)
+            ctx.obj['boards'].append(board)
+        if not ctx.obj['boards']:
+            print(f"No port matching {ports} !")
+            raise typer.Exit(code=1)
+        return
     try:
-        loader = STM32(Scaffold(port), verbosity=verbose)
+        loader = STM32(open_board(port), verbosity=verbose, baudrate=baudrate)
+        loader.progress = progress_renderer(progress)
         # save object into the context
         if ctx.obj is None:
             ctx.obj = {}
@@ -6,16 +6,22 @@
 """
 Bootloader command donjon-scaffold interface
 """
+import collections
+import contextlib
 import dataclasses
-import sys
-import os
 import operator
 import struct
 import math
-from time import sleep
+from time import perf_counter, sleep
 from functools import reduce
-import yaml
-from progressbar import ProgressBar, Percentage, GranularBar, AdaptiveETA
+from scaffold import TimeoutError as ScaffoldTimeoutError
+from . import log
+from .erase import BANK, MASS, PAGES, plan_erase, touched_pages
+from .image import align_segments, stm32_crc
+from .index import device_index
+from .metrics import Metrics
+from .progress import Progress
+from .stubs import Crc32Stub, FlashLoaderStub
 
 
 class STM32Error(Exception):
@@ -75,6 +81,7 @@ class STM32:
         EXTENDED_ERASE = 0x44
         WRITE_PROTECT = 0x63
         WRITE_UNPROTECT = 0x73
+        GET_CHECKSUM = 0xA1
 
         SYNCHRONIZE = 0x7F
 
@@ -96,15 +103,46 @@ class STM32:
     """stmloader does not know the address for flash size."""
     FLASH_PAGE_SIZE_DEFAULT = 1024
     """Default flash page size"""
+    FLASH_BASE = 0x08000000
+    """Main flash memory base address"""
+    FLASH_SIZE_UNKNOWN = 0
+    """Flash memory size not given by the device description."""
+    FLASH_BANKS_DEFAULT = 1
+    FLASH_UNIFORM_DEFAULT = True
+    """Flash memory made of pages of PageSize bytes, not of sectors of several sizes."""
     BOOT_VERSION_ADDRESS_UNKNOWN = -1
     DATA_TRANSFER_SIZE_DEFAULT = 256
+    WRITE_FRAME_OVERHEAD = 9
+    """Command (2), address (5), length (1) and checksum (1) bytes of a Write Memory chunk."""
     SYNCHRONIZE_ATTEMPTS = 2
-
-    def __init__(self, scaffold, verbosity=5):
+    BAUDRATE_DEFAULT = 115200
+    BAUDRATE_AUTO = 0
+    """Find the fastest baud rate the bootloader synchronizes on."""
+    AUTO_BAUDRATES = (921600, 460800, 230400, 115200, 57600)
+    """Baud rates tried in automatic mode, fastest first."""
+    RAM_WINDOW_UNKNOWN = None
+    """stmloader does not know the RAM range left to the user by the bootloader."""
+    CHECKSUM_RATE = 100000
+    """Conservative checksum stub throughput, in bytes per second."""
+    SERIES_UNKNOWN = None
+    USART_ADDRESS_DEFAULT = 0x40013800
+    """USART1, used by the bootloader on PA9/PA10."""
+    STARTUP_DELAY_DEFAULT = 0.05
+    """Time after NRST release before the first 0x7f byte, unless the device description gives one: a byte
+    received while the bootloader sets up its USART may be misread as the autobaud one."""
+    STARTUP_TIMEOUT_DEFAULT = 2.7
+    """Longest wait for the bootloader after NRST release, unless the device description gives one."""
+    SYNC_POLL_INTERVAL = 0.005
+    """First wait for a reply to the 0x7f byte, doubled on each silent attempt."""
+    SYNC_POLL_INTERVAL_MAX = 0.1
+
+    def __init__(self, scaffold, verbosity=5, baudrate=BAUDRATE_DEFAULT):
         """
         Command class constructor
         :param scaffold: A scaffold object
-        :param verbosity: verbosity level
+        :param verbosity: verbosity level, kept for compatibility: messages go
+            to the stmloader loggers, see stmloader.log
+        :param baudrate: UART baud rate, or BAUDRATE_AUTO
         """
         self.scaffold = scaffold
         self.scaffold.timeout = 1
@@ -115,25 +153,75 @@ class STM32:
         # Connect the UART peripheral to D0 and D1.
         var = uart.rx << scaffold.d1
         var = scaffold.d0 << uart.tx
-        uart.baudrate = 115200
+        self.baudrate = baudrate
+        uart.baudrate = self.BAUDRATE_DEFAULT if baudrate == self.BAUDRATE_AUTO else baudrate
 
         self.verbosity = verbosity
         self.extended_erase = False
+        self.commands = None
         self.data_transfer_size = self.DATA_TRANSFER_SIZE_DEFAULT
         self.flash_page_size = self.FLASH_PAGE_SIZE_DEFAULT
+        self.flash_memory_size = self.FLASH_SIZE_UNKNOWN
+        self.flash_banks = self.FLASH_BANKS_DEFAULT
+        self.flash_uniform = self.FLASH_UNIFORM_DEFAULT
         self.uid_address = self.UID_ADDRESS_UNKNOWN
         self.flash_size_address = self.FLASH_SIZE_ADDRESS_UNKNOWN
         self.boot_version_address = self.BOOT_VERSION_ADDRESS_UNKNOWN
+        self.ram_window = self.RAM_WINDOW_UNKNOWN
+        self.series = self.SERIES_UNKNOWN
+        self.usart_address = self.USART_ADDRESS_DEFAULT
+        self.startup_delay = self.STARTUP_DELAY_DEFAULT
+        self.startup_timeout = self.STARTUP_TIMEOUT_DEFAULT
+        self.progress = None
+        self.metrics = Metrics()
+        self._released = None
+
+    def _transmit(self, data):
+        """
+        Transmit bytes on the UART, counting them.
+        :param data: bytes-like object
+        """
+        self.metrics.bytes_sent += len(data)
+        self.uart.transmit(data, False)
+
+    def _receive(self, length):
+        """
+        Receive bytes from the UART, counting them, the ones received before a
+        timeout included.
+        :param length: number of bytes
+        """
+        try:
+            data = self.uart.receive(length)
+        except ScaffoldTimeoutError as exc:
+            self.metrics.bytes_received += len(exc.data or b'')
+            raise
+        self.metrics.bytes_received += len(data)
+        return data
+
+    @classmethod
+    def command_name(cls, command):
+        """
+        Return the name of a command code, e.g. 'GET_ID'.
+        :param command: command code
+        """
+        for name, value in vars(cls.Command).items():
+            if value == command and not name.startswith('_'):
+                return name
+        return f"0x{command:02X}"
 
     def _write(self, *data):
         """
-        Write the given data to the MCU.
-        :param data: data to write
+        Write the given data to the MCU. The parts are gathered into a single
+        transmission: each Scaffold transaction costs a USB round trip.
+        :param data: data to write, bytes-like objects or byte values
         """
+        frame = bytearray()
         for data_bytes in data:
             if isinstance(data_bytes, int):
-                data_bytes = struct.pack("B", data_bytes)
-            self.uart.transmit(data_bytes, False)
+                frame.append(data_bytes)
+            else:
+                frame += data_bytes
+        self._transmit(frame)
 
     def _write_and_ack(self, message, *data):
         """
@@ -146,13 +234,32 @@ class STM32:
         self._write(*data)
         return self._wait_for_ack(message)
 
+    def _write_and_receive(self, message, length, *data):
+        """
+        Write data to the MCU, then read its ACK and the given number of reply
+        bytes following it in a single receive. Return the reply bytes.
+        :param message: info which is set when error are thrown
+        :param length: number of reply bytes following the ACK
+        :param data: data to write
+        """
+        self._write(*data)
+        try:
+            reply = self._receive(length + 1)
+        except ScaffoldTimeoutError as exc:
+            # a NACK comes alone
+            if not exc.data or exc.data[0] == self.Reply.ACK:
+                raise
+            reply = exc.data
+        self._check_ack(reply[0], message)
+        return bytearray(reply[1:])
+
     def _wait_ack(self, info=""):
         """
         Wait for ACK byte.
 
         :param info: info which is set when error are thrown. Useful for error diagnostic.
         """
-        data = self.uart.receive(1)[0]
+        data = self._receive(1)[0]
         if data == self.Reply.NACK:
             raise CommandError("NACK " + info)
         if data != self.Reply.ACK:
@@ -163,116 +270,274 @@ class STM32:
         Search if identifier is a known DeviceId
         :param identifier: Device ID number
         """
-        path = os.path.join(os.path.dirname(__file__), 'data')
-        # create file name to search
-        name = f'{path}/stm32_{hex(identifier)}.yml'
-        if os.path.isfile(name):
-            self.debug(10, f"Device File {name} found !")
-            # Read device description file, and initialize internal variables
-            with open(name, 'r', encoding='UTF-8') as f:
-                desc = yaml.safe_load(f)
-                self.uid_address = desc['UniversalID']['address']
-                self.flash_size_address = desc['FlashSize']['address']
-                self.flash_page_size = desc['Flash']['PageSize']
-                self.boot_version_address = desc['Bootloader']['ID']
+        desc = device_index().get(identifier)
+        if desc is not None:
+            log.devices.debug("Device 0x%X found !", identifier)
+            # initialize internal variables from the device description
+            self.uid_address = desc['UniversalID']['address']
+            self.flash_size_address = desc['FlashSize']['address']
+            self.flash_page_size = desc['Flash']['PageSize']
+            self.flash_memory_size = desc['Flash'].get('Size', self.FLASH_SIZE_UNKNOWN)
+            self.flash_banks = desc['Flash'].get('Banks', self.FLASH_BANKS_DEFAULT)
+            self.flash_uniform = desc['Flash'].get('Uniform', self.FLASH_UNIFORM_DEFAULT)
+            self.boot_version_address = desc['Bootloader']['ID']
+            self.series = desc['Series']
+            self.usart_address = desc['Bootloader'].get('USART', self.USART_ADDRESS_DEFAULT)
+            ram = desc['Bootloader'].get('RAM')
+            if ram is not None:
+                self.ram_window = (ram['min'], ram['max'])
+            # timing hints, used by the next resets
+            startup = desc['Bootloader'].get('Startup', {})
+            self.startup_delay = startup.get('delay', self.STARTUP_DELAY_DEFAULT)
+            self.startup_timeout = startup.get('timeout', self.STARTUP_TIMEOUT_DEFAULT)
 
     def debug(self, level, message):
         """
-        Print the given message if its level is low enough.
-        :param level: level compare to verbose
-        :param message: message to print
+        Log a message on the protocol logger, at the log level of a
+        verbosity level (see log.verbosity_level).
+        :param level: verbosity level of the message
+        :param message: message to log
         """
-        if self.verbosity >= level:
-            print(message, file=sys.stderr)
+        log.protocol.log(log.verbosity_level(level), "%s", message)
 
-    def reset_from_system_memory(self, startup=2.7):
+    def _progress(self, total):
+        """
+        Return the progress of a transfer, reported to the progress callback
+        (see progress.Progress).
+        :param total: number of bytes of the transfer
+        """
+        return Progress(self.progress, total)
+
+    def reset_from_system_memory(self, startup=None):
         """
         Power-cycle and reset target device in bootloader mode (boot on System
         Memory) and initiate serial communication. The byte 0x7f is sent and
         the response byte 0x79 (ACK) is expected. If the device does not
         respond, a Timeout exception is thrown by Scaffold. The device will not
         respond if it is locked in RDP2 state (Readout Protection level 2).
-        statr
+
+        The 0x7f byte is sent again, with a growing interval, until the
+        bootloader replies: the startup time is only an upper bound. The
+        device description can give the bound and a delay before the first
+        byte (Bootloader Startup timeout and delay), used once the device is
+        identified.
+
+        In automatic baud rate mode, the rates of AUTO_BAUDRATES are tried
+        from the fastest one, with a new reset each time, since the bootloader
+        locks its rate on the first 0x7f byte.
+        :param startup: longest startup waiting time, from the device
+            description or STARTUP_TIMEOUT_DEFAULT if None
+        """
+        if startup is None:
+            startup = self.startup_timeout
+        if self.baudrate != self.BAUDRATE_AUTO:
+            self._reset_and_synchronize(self.baudrate, startup)
+            return
+        for baudrate in self.AUTO_BAUDRATES[:-1]:
+            try:
+                self._reset_and_synchronize(baudrate, startup)
+                return
+            except (ScaffoldTimeoutError, STM32Error, ValueError) as e:
+                log.transport.info("No bootloader activation at %d bauds (%s) -- stepping down", baudrate, e)
+        self._reset_and_synchronize(self.AUTO_BAUDRATES[-1], startup)
+
+    def _reset_and_synchronize(self, baudrate, startup):
+        """
+        Reset in bootloader mode and synchronize at the given rate.
+        :param baudrate: UART baud rate
+        :param startup: longest startup waiting time
+        """
+        for delay in self._power_cycle(1, self.startup_delay):
+            sleep(delay)
+        self._activate(baudrate, startup)
+
+    def _power_cycle(self, boot0, startup):
+        """
+        Power-cycle and reset sequence, as a generator yielding the delays to
+        wait between its steps, so that the waits can be done either blocking
+        or asynchronously.
+        :param boot0: BOOT0 level, 1 to boot on System Memory
         :param startup: startup waiting time
         """
         self.scaffold.power.dut = 0
-        var = self.boot0 << 1
+        var = self.boot0 << boot0
         var = self.boot1 << 0
         var = self.nrst << 0
-        sleep(0.1)
+        yield 0.1
         self.scaffold.power.dut = 1
-        sleep(0.1)
+        yield 0.1
         var = self.nrst << 1
-        sleep(startup)
+        self._released = perf_counter()
+        yield startup
 
+    def _activate(self, baudrate, startup):
+        """
+        Synchronize with the bootloader, once reset, and identify the device.
+        :param baudrate: UART baud rate
+        :param startup: longest startup waiting time
+        """
         # Send 0x7f byte for initiating communication
+        self.uart.baudrate = baudrate
         self.uart.flush()
-        for attempt in range(self.SYNCHRONIZE_ATTEMPTS):
-            if attempt:
-                print("Bootloader activation timeout -- retrying", file=sys.stderr)
+        self.poll_synchronize(startup)
+        if self._released is not None:
+            self.metrics.observe('reset_sync', perf_counter() - self._released)
+        # successful. Check if known DeviceId
+        self._search_device(self.get_id())
+        log.transport.debug("Bootloader activated at %d bauds", baudrate)
+
+    def synchronize(self, attempts=SYNCHRONIZE_ATTEMPTS, wait=False):
+        """
+        Send the 0x7f byte until the bootloader replies.
+
+        :param attempts: maximum number of bytes sent
+        :param wait: give a silent target another attempt, as when it still
+            runs code before resetting to the bootloader. Otherwise the
+            Scaffold Timeout exception is raised.
+        """
+        for attempt in range(attempts):
+            if attempt and not wait:
+                log.transport.warning("Bootloader activation timeout -- retrying")
+            self.metrics.count('SYNCHRONIZE')
             self._write(0, self.Command.SYNCHRONIZE)
-            data = bytearray(self.uart.receive(1))
+            try:
+                data = bytearray(self._receive(1))
+            except ScaffoldTimeoutError:
+                if not wait or attempt == attempts - 1:
+                    raise
+                continue
             if data and data[0] in (self.Reply.ACK, self.Reply.NACK):
-                # successful. Check if known DeviceId
-                self._search_device(self.get_id())
                 return
         # not successful
         raise CommandError("Bad reply from bootloader")
 
+    def poll_synchronize(self, timeout):
+        """
+        Send the 0x7f byte until the bootloader replies, waiting
+        SYNC_POLL_INTERVAL for the first reply, then twice as long for each
+        silent attempt up to SYNC_POLL_INTERVAL_MAX. The Scaffold Timeout
+        exception is raised once the waits exceed the timeout. When several
+        bytes were sent, the link is confirmed (see
+        :meth:`_confirm_synchronized`).
+
+        :param timeout: longest total wait, in seconds. One attempt is done
+            anyway.
+        """
+        interval = self.SYNC_POLL_INTERVAL
+        waited = 0.0
+        sent = 0
+        previous_timeout = self.scaffold.timeout
+        try:
+            while True:
+                wait = max(min(interval, timeout - waited), self.SYNC_POLL_INTERVAL)
+                self.scaffold.timeout = wait
+                self.metrics.count('SYNCHRONIZE')
+                self._write(self.Command.SYNCHRONIZE)
+                sent += 1
+                try:
+                    data = self._receive(1)
+                    if data[0] in (self.Reply.ACK, self.Reply.NACK):
+                        log.transport.debug("Bootloader replied after %.3fs polling", waited)
+                        break
+                except ScaffoldTimeoutError:
+                    waited += wait
+                    if waited >= timeout:
+                        raise
+                    interval = min(2 * interval, self.SYNC_POLL_INTERVAL_MAX)
+                    continue
+                # the line is not silent but the reply is not expected
+                waited += wait
+                if waited >= timeout:
+                    raise CommandError("Bad reply from bootloader")
+        finally:
+            self.scaffold.timeout = previous_timeout
+        if sent > 1:
+            self._confirm_synchronized()
+
+    def _confirm_synchronized(self):
+        """
+        Make sure the bootloader waits for a command after replying to one of
+        several 0x7f bytes: the reply may be the late one of an earlier byte,
+        a later 0x7f byte being then taken as the first byte of a command.
+        Late bytes are flushed and a Get Version command is sent. It is
+        refused in that case, and its complement byte left alone is completed
+        (see :meth:`_resynchronize`).
+        """
+        self.uart.flush()
+        self._write(self.Command.GET_VERSION, self.Command.GET_VERSION ^ 0xFF)
+        reply = self._receive(1)[0]
+        if reply == self.Reply.ACK:
+            # version, option bytes and ACK
+            self._receive(4)
+        elif reply == self.Reply.NACK:
+            log.transport.debug("Late synchronization reply, resynchronizing")
+            self._resynchronize(bytes([self.Command.GET_VERSION ^ 0xFF]))
+        else:
+            raise CommandError("Bad reply from bootloader")
+
     def reset_from_flash(self, startup=0.1):
         """
         Power-cycle and reset target device and boot from user Flash memory.
         :param startup: startup waiting time
         """
-        self.scaffold.power.dut = 0
-        var = self.boot0 << 0
-        var = self.boot1 << 0
-        var = self.nrst << 0
-        sleep(0.1)
-        self.scaffold.power.dut = 1
-        sleep(0.1)
-        var = self.nrst << 1
-        sleep(startup)
+        for delay in self._power_cycle(0, startup):
+            sleep(delay)
 
-    def command(self, command, description):
+    def command(self, command, description, length=0):
         """
         Send the given command to the MCU.
 
-        Raise CommandError if there's no ACK replied.
+        Raise CommandError if there's no ACK replied. Return the reply bytes
+        following the ACK, read with it.
         :param command: Command to execute
         :param description: Information description for error
+        :param length: number of reply bytes following the ACK
         """
-        self.debug(10, f"*** Command: {description}")
-        ack_received = self._write_and_ack("Command", command, command ^ 0xFF)
-        if not ack_received:
-            raise CommandError(f"{description} ({command}) failed: no ack")
+        log.protocol.debug("*** Command: %s", description)
+        name = self.command_name(command)
+        self.metrics.count(name)
+        with self.metrics.timer('command_ack', name):
+            return self._write_and_receive("Command", length, command, command ^ 0xFF)
 
     def get(self):
         """
         Execute the Get command of the bootloader, which returns the version
         and the supported commands.
         """
-        self.command(command=self.Command.GET, description="Get")
-        header = self.uart.receive(2)
-        length = header[0]
-        data = self.uart.receive(length)
+        header = self.command(command=self.Command.GET, description="Get", length=2)
+        # the command codes and the final ACK
+        data = self._receive(header[0] + 1)
+        self._check_ack(data[-1], f"{self.Command.GET} end")
+        data = data[:-1]
+        self.commands = set(data)
         if self.Command.EXTENDED_ERASE in data:
             self.extended_erase = True
-        self.debug(5, "Available commands: " + ", ".join(hex(b) for b in data))
-        self._wait_for_ack(f"{self.Command.GET} end")
+        log.protocol.info("Available commands: %s", ", ".join(hex(b) for b in data))
         return data
 
+    def supports(self, command):
+        """
+        Tell if the bootloader advertises the given command. The Get command
+        is executed the first time.
+
+        :param command: command code
+        """
+        if self.commands is None:
+            self.get()
+        return command in self.commands
+
     def get_id(self):
         """
         Execute the Get ID command. The result is interpreted and the class
         will try to find information if the ID matches a known device.
         """
-        self.command(command=self.Command.GET_ID, description="Get ID")
-        length = self.uart.receive(1)[0]
-        data = self.uart.receive(length + 1)
-        self._wait_for_ack(f"{self.Command.GET_ID} end")
+        length = self.command(command=self.Command.GET_ID, description="Get ID", length=1)[0]
+        # the product id and the final ACK
+        data = self._receive(length + 2)
+        self._check_ack(data[-1], f"{self.Command.GET_ID} end")
+        data = data[:-1]
         device_id = reduce(lambda x, y: x * 0x100 + y, data)
-        self.debug(5, f"Chip id: 0x{device_id:X}")
+        log.protocol.info("Chip id: 0x%X", device_id)
         return device_id
 
     def get_uid(self):
@@ -287,7 +552,7 @@ class STM32:
         if self.uid_address == self.UID_ADDRESS_UNKNOWN:
             return self.UID_ADDRESS_UNKNOWN
         uid = self.read_memory(self.uid_address, 12)
-        self.debug(0, f"Device UID: {self.format_uid(uid)}")
+        log.protocol.log(log.NOTICE, "Device UID: %s", self.format_uid(uid))
         return uid
 
     @classmethod
@@ -309,7 +574,7 @@ class STM32:
             return self.FLASH_SIZE_NOT_SUPPORTED
         flash_size_bytes = self.read_memory(self.flash_size_address, 4)
         flash_size = flash_size_bytes[0] + (flash_size_bytes[1] << 8)
-        self.debug(0, f"flash size {flash_size}")
+        log.protocol.log(log.NOTICE, "flash size %s", flash_size)
         return flash_size
 
     def get_protocol_version(self):
@@ -319,12 +584,12 @@ class STM32:
         This command is used to get the protocol version. After receiving the command, the
         bootloader transmits the version, and two bytes (for legacy compatibility, both bytes are 0).
         """
-        self.command(command=self.Command.GET_VERSION, description="Get version")
-        data = self.uart.receive(3)
-        self._wait_for_ack(f"{self.Command.GET_VERSION} end")
-        self.debug(5, "Bootloader protocol version: " + hex(data[0]))
-        self.debug(10, "- Option byte 1: " + hex(data[1]))
-        self.debug(10, "- Option byte 2: " + hex(data[2]))
+        # the version, the option bytes and the final ACK
+        data = self.command(command=self.Command.GET_VERSION, description="Get version", length=4)
+        self._check_ack(data[3], f"{self.Command.GET_VERSION} end")
+        log.protocol.info("Bootloader protocol version: 0x%x", data[0])
+        log.protocol.debug("- Option byte 1: 0x%x", data[1])
+        log.protocol.debug("- Option byte 2: 0x%x", data[2])
         return data[1]
 
     def get_bootloader_id(self):
@@ -339,7 +604,7 @@ class STM32:
         if self.boot_version_address == self.BOOT_VERSION_ADDRESS_UNKNOWN:
             return self.BOOT_VERSION_ADDRESS_UNKNOWN
         boot_id = hex(self.read_memory(self.boot_version_address, 1)[0])
-        self.debug(0, f"Bootloader version (Id) : {boot_id}")
+        log.protocol.log(log.NOTICE, "Bootloader version (Id) : %s", boot_id)
         return boot_id
 
     def read_memory(self, address, length) -> bytearray:
@@ -358,34 +623,53 @@ class STM32:
         self._write_and_ack("0x11 address failed", self._encode_address(address))
         nr_of_bytes = (length - 1) & 0xFF
         checksum = nr_of_bytes ^ 0xFF
-        self._write_and_ack("0x11 length failed", nr_of_bytes, checksum)
-        return bytearray(self.uart.receive(length))
+        # the data follows the ACK
+        return self._write_and_receive("0x11 length failed", length, nr_of_bytes, checksum)
 
-    def read_memory_data(self, address, length):
+    def read_memory_data(self, address, length, operation='read'):
         """
         Tries to read some memory from the device. If requested size is larger
         than 256 bytes, many Read Memory commands are sent.
 
+        The result buffer is allocated once and filled in place.
+
+        :param address: Memory address to be read.
+        :param length: Number of bytes to be read.
+        :param operation: transfer the reads are recorded for in the metrics,
+            None when the caller records them
+        """
+        data = bytearray(length)
+        view = memoryview(data)
+        offset = 0
+        for _, chunk in self.iter_memory(address, length, operation):
+            view[offset: offset + len(chunk)] = chunk
+            offset += len(chunk)
+        return data
+
+    def iter_memory(self, address, length, operation='read'):
+        """
+        Read memory chunk by chunk, yielding (address, data) tuples as they
+        are received, so that callers can process or store large dumps without
+        holding them in memory.
+
         :param address: Memory address to be read.
         :param length: Number of bytes to be read.
+        :param operation: transfer the reads are recorded for in the metrics,
+            None when the caller records them
         """
-        data = bytearray()
         chunk_count = int(math.ceil(length / float(self.data_transfer_size)))
-        self.debug(10, f"Read {length:d} bytes in {chunk_count:d} chunks at address 0x{address:X}...")
-        widgets = [
-            ' ', Percentage(),
-            ' ', GranularBar(),
-            ' ', AdaptiveETA(),
-        ]
-        with ProgressBar(widgets=widgets, max_value=chunk_count) as progress:
+        log.protocol.debug("Read %d bytes in %d chunks at address 0x%X...", length, chunk_count, address)
+        with self._progress(length) as progress:
             while length:
                 read_length = min(length, self.data_transfer_size)
-                self.debug(10, f"Read {read_length:d} bytes at {address:X}")
-                data = data + self.read_memory(address, read_length)
+                log.protocol.debug("Read %d bytes at %X", read_length, address)
+                # only the exchange is timed, not the consumer of the chunks
+                with self.metrics.transfer(operation, read_length) if operation else contextlib.nullcontext():
+                    data = self.read_memory(address, read_length)
+                yield address, data
                 length = length - read_length
                 address = address + read_length
-                progress.next()
-            return data
+                progress.update(read_length)
 
     def write_memory(self, address, data):
         """
@@ -412,46 +696,330 @@ class STM32:
             data = bytearray(data)
             data.extend([0xFF] * padding_bytes)
 
-        self.debug(10, f"    [{nr_of_bytes}] bytes to write")
+        log.protocol.debug("    [%d] bytes to write", nr_of_bytes)
         checksum = reduce(operator.xor, data, nr_of_bytes - 1)
         self._write_and_ack("0x31 programming failed", nr_of_bytes - 1, data, checksum)
-        self.debug(10, "    Write memory done")
+        log.protocol.debug("    Write memory done")
 
-    def write_memory_data(self, address, data):
+    def write_memory_data(self, address, data, skip_blank=False, pipeline=False):
         """
         Write the given data to flash.
         Data length may be more than 256 bytes
 
         :param address: target address
         :param data: data to write
+        :param skip_blank: do not write blank chunks
+        :param pipeline: send the frames of a chunk without waiting for their
+            ACK, see :meth:`write_memory_segments`
         """
-        length = len(data)
-        chunk_count = int(math.ceil(length / float(self.data_transfer_size)))
-        offset = 0
-        self.debug(10, f"Write {length:d} bytes in {chunk_count}d chunks at address 0x{address:X}...")
-        widgets = [
-            ' ', Percentage(),
-            ' ', GranularBar(),
-            ' ', AdaptiveETA(),
-        ]
-        with ProgressBar(widgets=widgets, max_value=chunk_count) as progress:
-            while length:
-                write_length = min(length, self.data_transfer_size)
-                self.debug(
-                    10,
-                    "Write %(len)d bytes at 0x%(address)X"
-                    % {"address": address, "len": write_length},
-                )
-                self.write_memory(address, data[offset: offset + write_length])
-                length -= write_length
-                offset += write_length
-                address += write_length
-                progress.next()
+        self.write_memory_segments([(address, data)], skip_blank, pipeline=pipeline)
+
+    def write_memory_segments(self, segments, skip_blank=False, journal=None, pipeline=False):
+        """
+        Write a sparse image, given as a list of (address, data) segments (see
+        ``IntelHex.segments()``). Only the populated ranges are sent: segment
+        boundaries are aligned on 4 bytes, and chunks never cross a 256 bytes
+        boundary.
+
+        The Write Memory frames of the whole image are encoded up front into a
+        single buffer. As AN3155 describes, the command, address and data
+        frames of each chunk are sent one at a time, each after the ACK of the
+        previous one.
+
+        With pipeline, the three frames of a chunk are sent in one transmission
+        and their three ACK bytes read at once: the only wait left per chunk is
+        the flash programming one. The bootloader then receives the address and
+        data frames while it handles the command one, which relies on its
+        USART not losing them. At most one chunk (263 bytes) is in flight: the
+        next chunk is sent once the previous one is acknowledged.
+
+        With skip_blank, chunks of flash memory made only of 0xFF bytes are not
+        sent: programming 0xFF leaves erased flash unchanged.
+
+        With a journal (see journal.Journal), the chunks it records as written
+        are not sent again, and each chunk acknowledged is recorded.
+
+        :param segments: list of (address, data)
+        :param skip_blank: do not write blank chunks
+        :param journal: write journal, if any
+        :param pipeline: send the frames of a chunk without waiting for their
+            ACK
+        """
+        segments = align_segments(segments)
+        length = sum(len(data) for _, data in segments)
+        log.protocol.debug("Write %d bytes in %d segments...", length, len(segments))
+        written = set(journal.written) if journal is not None else set()
+        stream, frames = self._encode_write_stream(segments, skip_blank, written)
+        total = sum(end - start - self.WRITE_FRAME_OVERHEAD for _, start, end in frames)
+        with self._progress(total) as progress, self.metrics.transfer('write', length):
+            view = memoryview(stream)
+            for chunk_address, start, end in frames:
+                log.protocol.debug("Write %d bytes at 0x%X", end - start - self.WRITE_FRAME_OVERHEAD, chunk_address)
+                # each frame holds a Write Memory command, acknowledged once programmed
+                self.metrics.count('WRITE_MEMORY')
+                with self.metrics.timer('command_ack', 'WRITE_MEMORY'):
+                    self._write_chunk(view[start:end], f"0x31 write at 0x{chunk_address:08X} failed", pipeline)
+                if journal is not None:
+                    journal.confirm(chunk_address)
+                progress.update(end - start - self.WRITE_FRAME_OVERHEAD)
+
+    def _write_chunk(self, frame, info, pipeline):
+        """
+        Send the Write Memory frames of a chunk and wait for their ACK.
+        :param frame: encoded frames of the chunk
+        :param info: information description for error
+        :param pipeline: send the frames at once, then read the three ACK
+        """
+        # command, address and data frames
+        phases = (frame[:2], frame[2:7], frame[7:])
+        if pipeline:
+            self._transmit(frame)
+            self._wait_for_acks(phases, info)
+        else:
+            self._write_phases(phases, info)
+
+    def check_journal(self, journal, segments, count, skip_blank=False):
+        """
+        Verify the last chunks a write journal records before the write is
+        continued, and that the next chunk is still blank: the write may have
+        stopped in the middle of a chunk, and flash memory with ECC cannot be
+        programmed twice. The pages of a chunk that does not match are erased
+        again, and their chunks dropped from the journal to be written again.
+
+        :param journal: write journal
+        :param segments: list of (address, data) of the image
+        :param count: number of written chunks to verify
+        :param skip_blank: the write leaves out blank chunks, see
+            :meth:`write_memory_segments`
+        """
+        if not count or not journal.written:
+            return
+        chunks = {address: bytes(chunk) for address, chunk in self._chunks(align_segments(segments))}
+        written = set(journal.written)
+        checks = [(address, chunks[address]) for address in journal.written[-count:] if address in chunks]
+        # the next chunk the write sends
+        pending = next((address for address, chunk in chunks.items()
+                        if address not in written and not (skip_blank and self._blank_chunk(address, chunk))), None)
+        if pending is not None and self.is_flash(pending):
+            checks.append((pending, b'\xff' * len(chunks[pending])))
+        bad = [address for address, data in checks if not self.verify_memory_segments([(address, data)])]
+        if not bad:
+            return
+        self._check_uniform("erasing the pages of a chunk not written")
+        pages = touched_pages([(address, chunks[address]) for address in bad], self.flash_page_size, self.FLASH_BASE)
+        log.protocol.info("Journal: chunk 0x%08X not written, erasing %d pages again", bad[0], len(pages))
+        self.erase_pages(pages)
+        dropped = [address for address in journal.written
+                   if (address - self.FLASH_BASE) // self.flash_page_size in pages]
+        journal.drop(dropped)
+
+    def has_flash_loader(self):
+        """Tell if the flash loader stub can be used on the device."""
+        return (FlashLoaderStub.supports(self.series) and self.usart_address == FlashLoaderStub.USART1
+                and self.ram_window is not self.RAM_WINDOW_UNKNOWN)
+
+    def write_memory_stub(self, segments, skip_blank=False):
+        """
+        Write a sparse image through the flash loader stub run from the
+        bootloader RAM window (see stubs.FLASH_LOADER_CODE). Blocks of
+        FlashLoaderStub.BLOCK_SIZE bytes are sent with their CRC-32, ahead of
+        the acknowledgements as long as the ring buffer of the stub can hold
+        the blocks not yet acknowledged. The stub ends with a system reset, the
+        bootloader is synchronized again.
+
+        Segments outside the flash memory, and every segment on devices
+        without flash loader, are written with the Write Memory command.
+
+        :param segments: list of (address, data)
+        :param skip_blank: do not write blank blocks
+        """
+        if not self.has_flash_loader():
+            self.write_memory_segments(segments, skip_blank)
+            return
+        flash = [(address, data) for address, data in segments if self.is_flash(address)]
+        others = [(address, data) for address, data in segments if not self.is_flash(address)]
+        stub = FlashLoaderStub(self.series, *self.ram_window, self.usart_address, self.uart.baudrate)
+        blocks = list(stub.blocks(align_segments(flash, stub.ALIGNMENT), skip_blank))
+        self.write_memory_data(stub.address, stub.image())
+        self.go(stub.address)
+        try:
+            self._wait_for_ack("Flash loader start")
+        except ScaffoldTimeoutError as exc:
+            # the stub runs without a working USART, a reset is needed
+            raise CommandError("Flash loader start timeout") from exc
+        refused = self._feed_flash_loader(stub, blocks)
+        self._transmit(stub.frame(0, b''))
+        self._wait_for_ack("Flash loader end")
+        self.synchronize(wait=True)
+        if refused:
+            raise CommandError(f"Flash loader write at 0x{refused[0]:08X} failed")
+        if others:
+            self.write_memory_segments(others, skip_blank)
+
+    def _feed_flash_loader(self, stub, blocks):
+        """
+        Send the block frames to the flash loader, ahead of the replies as
+        long as its ring buffer can hold the blocks not acknowledged yet.
+        Return the addresses of the blocks refused.
+        :param stub: flash loader stub running on the target
+        :param blocks: list of (address, data)
+        """
+        pending = collections.deque()
+        refused = []
+        length = sum(len(data) for _, data in blocks)
+        overhead = len(stub.frame(0, b''))
+        with self._progress(length) as progress, self.metrics.transfer('write', length):
+            for address, data in blocks:
+                frame = stub.frame(address, data)
+                # blocks not acknowledged yet must fit in the ring buffer
+                while pending and sum(size for _, size in pending) + len(frame) > stub.ring_size:
+                    progress.update(pending[0][1] - overhead)
+                    refused += self._flash_loader_reply(pending)
+                log.protocol.debug("Write %d bytes at 0x%X", len(data), address)
+                self._transmit(frame)
+                pending.append((address, len(frame)))
+            while pending:
+                progress.update(pending[0][1] - overhead)
+                refused += self._flash_loader_reply(pending)
+        return refused
+
+    def _flash_loader_reply(self, pending):
+        """
+        Read the reply to the oldest block sent to the flash loader. Return
+        the block address in a list if it is refused, an empty list otherwise.
+        :param pending: (address, frame size) of the blocks not acknowledged
+        """
+        address, _ = pending.popleft()
+        reply = self._receive(1)[0]
+        return [] if reply == self.Reply.ACK else [address]
+
+    def _chunks(self, segments):
+        """
+        Split segments into (address, data) chunks that do not cross a
+        transfer size boundary.
+        :param segments: list of (address, data)
+        """
+        for address, data in segments:
+            view = memoryview(data)
+            offset = 0
+            while offset < len(view):
+                chunk_address = address + offset
+                size = self.data_transfer_size - chunk_address % self.data_transfer_size
+                chunk = view[offset: offset + size]
+                offset += len(chunk)
+                yield chunk_address, chunk
+
+    def _blank_chunk(self, address, chunk):
+        """
+        Tell if a chunk is made only of 0xFF bytes, in flash memory: erased
+        flash is left unchanged by writing it.
+        :param address: chunk address
+        :param chunk: chunk data
+        """
+        return chunk == b'\xff' * len(chunk) and self.is_flash(address)
+
+    def _encode_write_stream(self, segments, skip_blank=False, written=()):
+        """
+        Encode the Write Memory frames needed to write the aligned segments.
+
+        Return the encoded bytes and a list of (address, start, end) tuples
+        locating the frames of each chunk in the buffer.
+
+        :param segments: list of (address, data) aligned on 4 bytes
+        :param skip_blank: leave out flash chunks made only of 0xFF bytes
+        :param written: addresses of the chunks to leave out, already written
+        """
+        stream = bytearray()
+        frames = []
+        chunk_count = 0
+        command = bytes([self.Command.WRITE_MEMORY, self.Command.WRITE_MEMORY ^ 0xFF])
+        for address, chunk in self._chunks(segments):
+            chunk_count += 1
+            if address in written or (skip_blank and self._blank_chunk(address, chunk)):
+                continue
+            # pad data length to multiple of 4 bytes with 0xFF: flash memory value after erase
+            padding = -len(chunk) % 4
+            start = len(stream)
+            stream += command
+            stream += self._encode_address(address)
+            stream.append(len(chunk) + padding - 1)
+            stream += chunk
+            stream += b'\xff' * padding
+            # checksum covers the length byte, the data and the padding
+            stream.append(reduce(operator.xor, stream[start + 7:], 0))
+            frames.append((address, start, len(stream)))
+        log.protocol.debug("    [%d] bytes encoded for %d/%d chunks", len(stream), len(frames), chunk_count)
+        return stream, frames
+
+    def get_checksum(self, address, length):
+        """
+        Execute the Get Checksum command: the bootloader computes the CRC of
+        a memory range with the CRC peripheral in its reset configuration
+        (see image.stm32_crc).
+
+        The start address and the length in bytes are each sent as a 4 bytes
+        frame followed by their XOR checksum, and acknowledged. The CRC comes
+        back as 4 bytes, most significant first, followed by their XOR
+        checksum.
+
+        :param address: start address, multiple of 4
+        :param length: length in bytes, multiple of 4
+        """
+        if address % 4 or length % 4:
+            raise DataLengthError(f"Checksum range 0x{address:08X}+{length} is not word aligned.")
+        self.command(self.Command.GET_CHECKSUM, "Get checksum")
+        self._write_and_ack("0xA1 address failed", self._encode_address(address))
+        reply = self._write_and_receive("0xA1 length failed", 5, self._encode_address(length))
+        if reduce(operator.xor, reply, 0) != 0:
+            raise CommandError("0xA1 bad checksum reply")
+        return struct.unpack(">I", reply[:4])[0]
+
+    def verify_memory_segments(self, segments):
+        """
+        Tell if the memory holds the given (address, data) segments. The Get
+        Checksum command is used when the bootloader supports it, the memory
+        is read back otherwise.
+
+        :param segments: list of (address, data)
+        """
+        checksum = self.supports(self.Command.GET_CHECKSUM)
+        with self.metrics.transfer('verify', sum(len(data) for _, data in segments)):
+            return self._verify_segments(segments, checksum)
+
+    def _verify_segments(self, segments, checksum):
+        """
+        Tell if the memory holds the given segments.
+        :param segments: list of (address, data)
+        :param checksum: use the Get Checksum command
+        """
+        for address, data in segments:
+            if checksum:
+                # word aligned part checked on target, unaligned ends read back
+                head = min(-address % 4, len(data))
+                tail = (len(data) - head) % 4
+                middle = data[head: len(data) - tail]
+                if middle and self.get_checksum(address + head, len(middle)) != stm32_crc(middle):
+                    return False
+                ends = [(address, data[:head]), (address + len(data) - tail, data[len(data) - tail:])]
+            else:
+                ends = [(address, data)]
+            if any(part and self.read_memory_data(start, len(part), None) != part for start, part in ends):
+                return False
+        return True
+
+    def is_flash(self, address):
+        """
+        Return True if address is in the main flash memory.
+        When the flash size is unknown, the whole flash memory area is assumed.
+        :param address: address to check
+        """
+        size = self.flash_memory_size or self.FLASH_BASE
+        return self.FLASH_BASE <= address < self.FLASH_BASE + size
 
     def readout_protect(self):
         """Enable readout protection of the flash memory."""
         self.command(self.Command.READOUT_PROTECT, "Readout protect")
-        self.debug(10, "    Read protect done")
+        log.protocol.debug("    Read protect done")
 
     def readout_unprotect(self):
         """
@@ -459,16 +1027,17 @@ class STM32:
         perform mass flash erase, which can be very long.
         """
         self.command(self.Command.READOUT_UNPROTECT, "Readout unprotect")
-        self.debug(10, "    Mass erase -- this may take a while")
+        log.protocol.debug("    Mass erase -- this may take a while")
         previous_timeout = self.scaffold.timeout
         self.scaffold.timeout = 30
         try:
-            self._wait_ack()
+            with self.metrics.timer('erase', 'READOUT_UNPROTECT'):
+                self._wait_ack()
         finally:
             # Restore timeout setting, even if something bad happened!
             self.scaffold.timeout = previous_timeout
-        self.debug(10, "    Unprotect / mass erase done")
-        self.debug(10, "    Reset after automatic chip reset due to readout unprotect")
+        log.protocol.debug("    Unprotect / mass erase done")
+        log.protocol.debug("    Reset after automatic chip reset due to readout unprotect")
         self.reset_from_system_memory()
 
     def write_protect(self, pages):
@@ -482,13 +1051,13 @@ class STM32:
         page_numbers = bytearray(pages)
         checksum = reduce(operator.xor, page_numbers, nr_of_pages)
         self._write_and_ack("0x63 write protect failed", nr_of_pages, page_numbers, checksum)
-        self.debug(10, "    Write protect done")
+        log.protocol.debug("    Write protect done")
 
     def write_unprotect(self):
         """Disable write protection of the flash memory."""
         self.command(self.Command.WRITE_UNPROTECT, "Write unprotect")
         self._wait_for_ack("0x73 write unprotect failed")
-        self.debug(10, "    Write Unprotect done")
+        log.protocol.debug("    Write Unprotect done")
 
     def extended_erase_pages(self, pages=None):
         """
@@ -510,15 +1079,16 @@ class STM32:
                 struct.pack_into(">H", page_bytes, i * 2, page)
             checksum = reduce(operator.xor, page_count_bytes)
             checksum = reduce(operator.xor, page_bytes, checksum)
-            self.debug(level=10, message=f"Page erase mode ({page_count} pages)")
+            log.protocol.debug("Page erase mode (%d pages)", page_count)
             self._write(page_count_bytes, page_bytes, checksum)
         previous_timeout = self.scaffold.timeout
         self.scaffold.timeout = 30
         try:
-            self._wait_for_ack("0x44 erasing failed")
+            with self.metrics.timer('erase', 'EXTENDED_ERASE'):
+                self._wait_for_ack("0x44 erasing failed")
         finally:
             self.scaffold.timeout = previous_timeout
-        self.debug(10, "    Extended Erase memory done")
+        log.protocol.debug("    Extended Erase memory done")
 
     def extended_erase_special(self, special=None):
         """
@@ -527,23 +1097,24 @@ class STM32:
         """
         self.command(self.Command.EXTENDED_ERASE, "Extended erase memory")
         if special == 'mass':
-            self.debug(level=10, message="Mass erase mode ")
+            log.protocol.debug("Mass erase mode ")
             self._write(b"\xff\xff\x00")
 
         if special == 'bank1':
-            self.debug(level=10, message="Bank 1 erase mode ")
+            log.protocol.debug("Bank 1 erase mode ")
             self._write(b"\xff\xfe\x01")
 
         if special == 'bank2':
-            self.debug(level=10, message="Bank 2 erase mode ")
+            log.protocol.debug("Bank 2 erase mode ")
             self._write(b"\xff\xfd\x02")
         previous_timeout = self.scaffold.timeout
         self.scaffold.timeout = 30
         try:
-            self._wait_for_ack("0x44 erasing failed")
+            with self.metrics.timer('erase', 'EXTENDED_ERASE'):
+                self._wait_for_ack("0x44 erasing failed")
         finally:
             self.scaffold.timeout = previous_timeout
-        self.debug(10, "Extended Erase memory done")
+        log.protocol.debug("Extended Erase memory done")
 
     def erase_memory(self, pages=None):
         """
@@ -568,8 +1139,183 @@ class STM32:
             # global erase: n=255 (page count)
             self._write(255, 0)
 
-        self._wait_for_ack("0x43 erase failed")
-        self.debug(10, "    Erase memory done")
+        with self.metrics.timer('erase', 'ERASE'):
+            self._wait_for_ack("0x43 erase failed")
+        log.protocol.debug("    Erase memory done")
+
+    def erase_pages(self, pages):
+        """
+        Erase the given flash pages with Erase or Extended Erase, depending on
+        what the bootloader supports (see :meth:`supports`), in batches of at most
+        255 or 65535 pages.
+
+        :param pages: iterable of page indexes, zero-based.
+        """
+        pages = sorted(pages)
+        if self.supports(self.Command.EXTENDED_ERASE):
+            batch, erase = 65535, self.extended_erase_pages
+        else:
+            batch, erase = 255, self.erase_memory
+        for index in range(0, len(pages), batch):
+            erase(pages[index: index + batch])
+
+    def plan_erase(self, segments, whole_banks=False):
+        """
+        Return the erase operations needed before writing the given segments
+        (see erase.plan_erase). Segments outside the flash memory need no
+        erase. Banks are only erased separately with Extended Erase; the
+        legacy Erase command only erases the whole memory.
+
+        Pages are not planned on a flash memory made of sectors of several
+        sizes (see :meth:`_check_uniform`).
+
+        :param segments: list of (address, data)
+        :param whole_banks: allow erasing whole banks, or the whole memory,
+            when the image covers most of them
+        """
+        flash = [(address, data) for address, data in segments if self.is_flash(address)]
+        if flash:
+            self._check_uniform("erase planning")
+        pages = touched_pages(flash, self.flash_page_size, self.FLASH_BASE)
+        extended = self.supports(self.Command.EXTENDED_ERASE)
+        return plan_erase(pages, self.flash_memory_size // self.flash_page_size,
+                          banks=self.flash_banks if extended else 1, batch=65535 if extended else 255,
+                          whole_banks=whole_banks)
+
+    def _check_uniform(self, operation):
+        """
+        Raise PageIndexError on a flash memory made of sectors of several
+        sizes: page indexes computed from PageSize are not those of the erase
+        commands.
+        :param operation: operation needing page indexes, for the message
+        """
+        if not self.flash_uniform:
+            raise PageIndexError(f"{self.series} flash memory is made of sectors, {operation} is not supported.")
+
+    def erase_planned(self, operations):
+        """
+        Execute erase operations, as given by :meth:`plan_erase`.
+        :param operations: list of (kind, argument)
+        """
+        for kind, argument in operations:
+            if kind == PAGES:
+                log.protocol.debug("Erase %d pages from page %d", len(argument), argument[0])
+                self.erase_pages(argument)
+            elif kind == BANK:
+                self.extended_erase_special(f"bank{argument + 1}")
+            elif self.supports(self.Command.EXTENDED_ERASE):
+                self.extended_erase_special(MASS)
+            else:
+                self.erase_memory()
+
+    def write_memory_diff(self, segments):
+        """
+        Differential write of an image given as (address, data) segments.
+
+        Each flash page the image touches is compared with its new content
+        (the current content overlaid with the image). Pages fully covered by
+        the image are compared with the Get Checksum command when the
+        bootloader supports it, other pages are read back. Only the pages
+        that differ are erased and written again; page bytes outside the image
+        are preserved. Segments outside the flash memory are written
+        unconditionally.
+
+        Return the list of rewritten page indexes.
+
+        :param segments: list of (address, data)
+        """
+        page_size = self.flash_page_size
+        flash = [(address, data) for address, data in segments if self.is_flash(address)]
+        others = [(address, data) for address, data in segments if not self.is_flash(address)]
+        if flash:
+            self._check_uniform("differential write")
+        touched = touched_pages(flash, page_size, self.FLASH_BASE)
+        full = []
+        if self.supports(self.Command.GET_CHECKSUM):
+            full = [page for page in touched if self._covered(page, flash) == page_size]
+        diff = [self._diff_page_checksum(page, flash) for page in full]
+        # read back runs of consecutive pages
+        for first, last in self._runs([page for page in touched if page not in full]):
+            diff += self._diff_pages(first, last, flash)
+        diff = sorted(page for page in diff if page is not None)
+        changed = [page for page, _, _ in diff]
+        rewrite = [(address, data) for _, address, data in diff]
+        log.protocol.info("%d/%d pages changed", len(changed), len(touched))
+        if changed:
+            self.erase_pages(changed)
+            self.write_memory_segments(rewrite, skip_blank=True)
+        if others:
+            self.write_memory_segments(others)
+        return changed
+
+    def _diff_pages(self, first, last, segments):
+        """
+        Compare a run of flash pages with the image overlaid on their current
+        content. Return the (page, address, data) of the pages that differ.
+
+        :param first: first page index
+        :param last: last page index
+        :param segments: list of (address, data) in flash memory
+        """
+        page_size = self.flash_page_size
+        base = self.FLASH_BASE + first * page_size
+        current = self.read_memory_data(base, (last - first + 1) * page_size)
+        content = bytearray(current)
+        for address, data in segments:
+            start = max(address, base)
+            end = min(address + len(data), base + len(content))
+            if start < end:
+                content[start - base: end - base] = data[start - address: end - address]
+        pages = []
+        for page in range(first, last + 1):
+            offset = (page - first) * page_size
+            if content[offset: offset + page_size] != current[offset: offset + page_size]:
+                pages.append((page, base + offset, content[offset: offset + page_size]))
+        return pages
+
+    def _covered(self, page, segments):
+        """
+        Return the number of bytes of a flash page given by the segments.
+        :param page: page index
+        :param segments: list of (address, data), not overlapping
+        """
+        base = self.FLASH_BASE + page * self.flash_page_size
+        return sum(max(0, min(address + len(data), base + self.flash_page_size) - max(address, base))
+                   for address, data in segments)
+
+    def _diff_page_checksum(self, page, segments):
+        """
+        Compare a flash page fully covered by the image with the Get Checksum
+        command. Return its (page, address, data) if it differs, None
+        otherwise.
+
+        :param page: page index
+        :param segments: list of (address, data) in flash memory
+        """
+        base = self.FLASH_BASE + page * self.flash_page_size
+        content = bytearray(self.flash_page_size)
+        for address, data in segments:
+            start = max(address, base)
+            end = min(address + len(data), base + len(content))
+            if start < end:
+                content[start - base: end - base] = data[start - address: end - address]
+        if self.get_checksum(base, len(content)) == stm32_crc(content):
+            return None
+        return page, base, content
+
+    @staticmethod
+    def _runs(pages):
+        """
+        Group sorted page indexes into (first, last) runs of consecutive pages.
+        :param pages: sorted page indexes
+        """
+        runs = []
+        for page in pages:
+            if runs and runs[-1][1] == page - 1:
+                runs[-1][1] = page
+            else:
+                runs.append([page, page])
+        return [tuple(run) for run in runs]
 
     def go(self, address):
         """
@@ -581,23 +1327,51 @@ class STM32:
         self.command(self.Command.GO, "Go")
         self._write_and_ack("0x21 go failed", self._encode_address(address))
 
+    def checksum_memory(self, regions):
+        """
+        Return the CRC-32 (as zlib.crc32) of each memory region, computed on
+        the target by a stub run from the bootloader RAM window. Only the
+        checksums are read back. The stub ends with a system reset, the
+        bootloader is synchronized again.
+
+        :param regions: list of (address, length)
+        """
+        if self.ram_window is self.RAM_WINDOW_UNKNOWN:
+            raise CommandError("Bootloader RAM window unknown, checksum stub not available.")
+        stub = Crc32Stub(*self.ram_window)
+        checksums = []
+        for first in range(0, len(regions), stub.capacity):
+            batch = regions[first: first + stub.capacity]
+            self.write_memory_data(stub.address, stub.image(batch))
+            self.go(stub.address)
+            # the target is silent until the stub is done
+            busy = sum(length for _, length in batch) // self.CHECKSUM_RATE
+            self.synchronize(self.SYNCHRONIZE_ATTEMPTS + math.ceil(busy / self.scaffold.timeout), wait=True)
+            try:
+                checksums += stub.results(self.read_memory_data(stub.table_address, stub.table_size(len(batch))))
+            except ValueError as e:
+                raise CommandError(str(e)) from e
+        return checksums
+
     def pages_from_range(self, start, end):
         """
-        Return page indices for the given memory range
+        Return page indices for the given flash memory range, counted from
+        the flash memory base address.
 
         :param start: starting  address
         :param end: ending address
         """
+        if start < self.FLASH_BASE:
+            raise PageIndexError(f"Erase start address should be in flash memory: 0x{start:08X}.")
         if start % self.flash_page_size != 0:
             raise PageIndexError(f"Erase start address should be at a flash page boundary: 0x{start:08X}.")
         if end % self.flash_page_size != 0:
             raise PageIndexError(f"Erase end address should be at a flash page boundary: 0x{end:08X}.")
 
         # Assemble the list of pages to erase.
-        first_page = start // self.flash_page_size
-        last_page = end // self.flash_page_size
-        num_pages = last_page - first_page
-        pages = list(range(num_pages))
+        first_page = (start - self.FLASH_BASE) // self.flash_page_size
+        last_page = (end - self.FLASH_BASE) // self.flash_page_size
+        pages = list(range(first_page, last_page))
 
         return pages
 
@@ -606,15 +1380,91 @@ class STM32:
         Read a byte and raise CommandError if it's not ACK.
         :param info: information description for error
         """
-        reply = self.uart.receive(1)[0]
+        reply = self._receive(1)[0]
         if not reply:
             raise CommandError("Can't read port or timeout")
+        self._check_ack(reply, info)
+        return 1
 
+    def _check_ack(self, reply, info=""):
+        """
+        Raise CommandError if the given reply byte is not ACK.
+        :param reply: reply byte
+        :param info: information description for error
+        """
         if reply == self.Reply.NACK:
             raise CommandError("NACK " + info)
         if reply != self.Reply.ACK:
             raise CommandError("Unknown response. " + info + ": " + hex(reply))
-        return 1
+
+    def _write_phases(self, frames, info=""):
+        """
+        Send several frames one at a time, each after the ACK of the previous
+        one, and raise CommandError if one of them is not ACK.
+        :param frames: frames to send, in order
+        :param info: information description for error
+        """
+        count = len(frames)
+        for index, frame in enumerate(frames):
+            self._transmit(frame)
+            try:
+                reply = self._receive(1)[0]
+            except ScaffoldTimeoutError as exc:
+                # the bootloader state is unknown, what it may still send is discarded
+                self.uart.flush()
+                raise CommandError(f"Can't read port or timeout ({index}/{count} ACK). {info}") from exc
+            if reply == self.Reply.NACK:
+                raise CommandError(f"NACK on frame {index + 1}/{count}. {info}")
+            self._check_ack(reply, info)
+
+    def _wait_for_acks(self, frames, info=""):
+        """
+        Read the replies to several frames sent at once, and raise
+        CommandError if one of them is not ACK. The bootloader reads the
+        frames following a failed one as commands: it is brought back to
+        waiting for a command first (see :meth:`_resynchronize`).
+        :param frames: frames sent, in order
+        :param info: information description for error
+        """
+        count = len(frames)
+        try:
+            replies = self._receive(count)
+        except ScaffoldTimeoutError as exc:
+            # the part received tells which frame failed
+            replies = bytes(exc.data or b'')
+            if all(reply == self.Reply.ACK for reply in replies):
+                # the bootloader state is unknown, what it may still send is discarded
+                self.uart.flush()
+                raise CommandError(f"Can't read port or timeout ({len(replies)}/{count} ACK). {info}") from exc
+        for index, reply in enumerate(replies):
+            if reply != self.Reply.ACK:
+                self._resynchronize(b''.join(frames[index + 1:]), len(replies) - index - 1)
+            if reply == self.Reply.NACK:
+                raise CommandError(f"NACK on frame {index + 1}/{count}. {info}")
+            if reply != self.Reply.ACK:
+                raise CommandError("Unknown response. " + info + ": " + hex(reply))
+        return count
+
+    def _resynchronize(self, left, received=0):
+        """
+        Bring the bootloader back to waiting for a command after a failed
+        frame. It reads the bytes left of the transmission by pairs, as
+        commands, and NACKs each pair: these replies are read. A last byte
+        left alone is completed with a copy of itself, never a valid command.
+        :param left: bytes sent after the failed frame
+        :param received: replies to these bytes already received
+        """
+        expected = len(left) // 2 - received
+        if len(left) % 2:
+            self._transmit(left[-1:])
+            expected += 1
+        try:
+            if expected > 0:
+                self._receive(expected)
+        except ScaffoldTimeoutError:
+            pass
+        # e.g. data bytes taken as a valid command
+        self.uart.flush()
 
     @staticmethod
     def _encode_address(address):
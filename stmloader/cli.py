@@ -15,3 +15,27 @@ from .devices import device_app
 cli = typer.Typer()
 cli.add_typer(device_app, name="devices")
 cli.add_typer(boot_app, name="loader")
+
+
+# the daemon applications are loaded when they run, their arguments are theirs
+PASS_THROUGH = {'allow_extra_args': True, 'ignore_unknown_options': True, 'help_option_names': []}
+
+
+@cli.command(context_settings=PASS_THROUGH)
+def serve(ctx: typer.Context):
+    """
+    Serve the loader jobs of the clients, keeping the boards open
+    """
+    # pylint: disable=import-outside-toplevel
+    from .serve import serve_app
+    serve_app(ctx.args, prog_name=ctx.command_path)
+
+
+@cli.command(context_settings=PASS_THROUGH)
+def client(ctx: typer.Context):
+    """
+    Loader daemon client
+    """
+    # pylint: disable=import-outside-toplevel
+    from .serve import client_app
+    client_app(ctx.args, prog_name=ctx.command_path)
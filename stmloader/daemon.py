@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+"""
+Loader daemon
+
+A long-running process owns the Scaffold boards and their loaders, and runs
+jobs sent by clients over a local Unix socket: the serial ports are opened
+once, and a board stays in bootloader mode from one job to the next, instead
+of being reset by every command line.
+
+Requests and replies are JSON objects, one per line, and a connection may
+carry any number of them. A request names the job, the board port (optional
+with a single board) and the job arguments::
+
+    {"job": "read", "port": "/dev/ttyUSB0", "args": {"address": 134217728, "length": 256}}
+
+The reply holds the job result, or the error which made it fail::
+
+    {"ok": true, "result": "..."}
+    {"ok": false, "error": "CommandError: NACK Read memory"}
+
+Memory data are base64 strings, image segments lists of [address, data].
+Jobs of a board run one at a time, jobs of several boards concurrently. Data
+jobs reset the board in bootloader mode first, when it is not.
+"""
+import base64
+import json
+import os
+import socket
+import socketserver
+import threading
+
+from . import log
+from .bootloader import STM32Error
+
+SOCKET_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'stmloader', 'daemon.sock')
+"""Default socket of the daemon."""
+JOBS = ('reset', 'read', 'write', 'erase', 'verify', 'go')
+"""Jobs run on a board, see the Board methods."""
+
+
+class DaemonError(STM32Error):
+    """
+    Exception: the daemon could not run a job, or could not be reached.
+    """
+
+
+def encode(data):
+    """Return bytes as a base64 string."""
+    return base64.b64encode(bytes(data)).decode('ascii')
+
+
+def decode(text):
+    """Return the bytes of a base64 string."""
+    return base64.b64decode(text)
+
+
+def encode_segments(segments):
+    """Return (address, data) segments as JSON lists."""
+    return [[address, encode(data)] for address, data in segments]
+
+
+def decode_segments(segments):
+    """Return (address, data) segments from JSON lists."""
+    return [(address, decode(data)) for address, data in segments]
+
+
+class Board:
+    """
+    Loader of a board served by the daemon, with the state kept between
+    jobs.
+    """
+
+    def __init__(self, loader, startup=None):
+        """
+        :param loader: STM32 loader
+        :param startup: bootloader startup time of the automatic resets, the
+            device one if None
+        """
+        self.loader = loader
+        self.startup = startup
+        self.lock = threading.Lock()
+        self.bootloader = False
+        """True when the board runs the bootloader."""
+
+    def _activate(self):
+        """Reset the board in bootloader mode, unless it already runs it."""
+        if not self.bootloader:
+            self.reset()
+
+    def reset(self, mode='system', startup=None):
+        """
+        Reset the board.
+        :param mode: 'system' for the bootloader, 'flash' for the application
+        :param startup: startup time, the daemon one if None
+        """
+        startup = self.startup if startup is None else startup
+        self.bootloader = False
+        if mode == 'system':
+            self.loader.reset_from_system_memory(startup)
+            self.bootloader = True
+        elif mode == 'flash':
+            self.loader.reset_from_flash(0.1 if startup is None else startup)
+        else:
+            raise ValueError(f"Unknown reset mode {mode}")
+
+    def read(self, address, length):
+        """
+        Return memory data, base64 encoded.
+        :param address: start address
+        :param length: number of bytes
+        """
+        self._activate()
+        return encode(self.loader.read_memory_data(address, length))
+
+    def write(self, segments, erase='none', force=False, diff=False, verify=False):
+        """
+        Write an image, return the verification result if asked for.
+        :param segments: image segments, see encode_segments()
+        :param erase: 'pages', 'auto' for whole banks when mostly covered, or 'none'
+        :param force: write blank chunks too
+        :param diff: erase and write the changed pages only
+        :param verify: verify the memory after the write
+        """
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self._activate()
+        segments = decode_segments(segments)
+        if diff:
+            self.loader.write_memory_diff(segments)
+        else:
+            if erase != 'none':
+                self.loader.erase_planned(self.loader.plan_erase(segments, whole_banks=erase == 'auto'))
+            self.loader.write_memory_segments(segments, skip_blank=not force)
+        return self.loader.verify_memory_segments(segments) if verify else None
+
+    def erase(self, address=None, length=0, mode=None):
+        """
+        Erase a flash memory range, or the memory with an extended erase mode.
+        :param address: start address
+        :param length: number of bytes
+        :param mode: 'mass', 'bank1' or 'bank2'
+        """
+        self._activate()
+        if mode is not None:
+            self.loader.extended_erase_special(special=mode)
+        elif address is not None and length:
+            self.loader.erase_pages(self.loader.pages_from_range(address, address + length))
+
+    def verify(self, segments):
+        """
+        Tell if the memory holds an image.
+        :param segments: image segments, see encode_segments()
+        """
+        self._activate()
+        return self.loader.verify_memory_segments(decode_segments(segments))
+
+    def go(self, address):
+        """
+        Run the code at an address; the board leaves the bootloader.
+        :param address: start address
+        """
+        self._activate()
+        self.loader.go(address)
+        self.bootloader = False
+
+    def status(self):
+        """Return the state of the board."""
+        return {'bootloader': self.bootloader, 'series': self.loader.series,
+                'metrics': self.loader.metrics.as_dict()}
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """
+    Connection of a client: one reply line per request line.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = {'ok': True, 'result': self.server.run(json.loads(line))}
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                # a failed job does not end the daemon
+                reply = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(reply).encode('UTF-8') + b'\n')
+            self.wfile.flush()
+
+
+class Daemon(socketserver.ThreadingUnixStreamServer):
+    """
+    Server running the jobs of the clients on its boards.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, boards, path=SOCKET_PATH):
+        """
+        :param boards: Board by port name
+        :param path: socket file
+        """
+        self.boards = boards
+        self.path = path
+        if os.path.exists(path):
+            try:
+                Client(path).close()
+            except DaemonError:
+                # left by a daemon which did not stop cleanly
+                os.unlink(path)
+            else:
+                raise DaemonError(f"A daemon already serves {path}.")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # the socket is private to the user
+        umask = os.umask(0o077)
+        try:
+            super().__init__(path, JobHandler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def board(self, port):
+        """
+        Return the board of a port.
+        :param port: port name, may be None when a single board is served
+        """
+        if port is None and len(self.boards) == 1:
+            return next(iter(self.boards.values()))
+        if port not in self.boards:
+            raise DaemonError(f"No board on port {port}, serving {', '.join(self.boards)}.")
+        return self.boards[port]
+
+    def run(self, request):
+        """
+        Run the job of a request, return its result.
+        :param request: request dictionary
+        """
+        job = request.get('job')
+        if job == 'status':
+            return {port: board.status() for port, board in self.boards.items()}
+        if job == 'shutdown':
+            # shutdown() waits for serve_forever(), which runs this request
+            threading.Thread(target=self.shutdown).start()
+            return None
+        if job not in JOBS:
+            raise DaemonError(f"Unknown job {job}.")
+        board = self.board(request.get('port'))
+        with board.lock:
+            log.protocol.debug("Job %s on %s", job, request.get('port'))
+            try:
+                return getattr(board, job)(**request.get('args', {}))
+            except Exception:
+                # the bootloader may be out of sync: the next job resets the board
+                board.bootloader = False
+                raise
+
+
+class Client:
+    """
+    Connection to a daemon.
+    """
+
+    def __init__(self, path=SOCKET_PATH, port=None):
+        """
+        :param path: socket file of the daemon
+        :param port: board port of the jobs, may be None when the daemon
+            serves a single board
+        """
+        self.port = port
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(path)
+        except OSError as exc:
+            self.socket.close()
+            raise DaemonError(f"No daemon on {path}: {exc}") from exc
+        self.stream = self.socket.makefile('rwb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the connection."""
+        self.stream.close()
+        self.socket.close()
+
+    def request(self, job, **args):
+        """
+        Run a job, return its result. DaemonError is raised when it failed.
+        :param job: job name, one of JOBS, 'status' or 'shutdown'
+        :param args: job arguments
+        """
+        self.stream.write(json.dumps({'job': job, 'port': self.port, 'args': args}).encode('UTF-8') + b'\n')
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise DaemonError("Connection closed by the daemon.")
+        reply = json.loads(line)
+        if not reply['ok']:
+            raise DaemonError(reply['error'])
+        return reply['result']
+
+    def read(self, address, length):
+        """Return memory data, see Board.read()."""
+        return decode(self.request('read', address=address, length=length))
+
+    def write(self, segments, **options):
+        """Write an image given as (address, data) segments, see Board.write()."""
+        return self.request('write', segments=encode_segments(segments), **options)
+
+    def verify(self, segments):
+        """Tell if the memory holds an image given as (address, data) segments."""
+        return self.request('verify', segments=encode_segments(segments))
@@ -11,21 +11,13 @@ import os
 import shutil
 from typing import List
 from enum import Enum
-import cerberus.validator
 import typer
-import yaml
 from typing_extensions import Annotated
-from cerberus import Validator
+from .index import DeviceIndex
 from .schema import template
 
-try:
-    import rich
-    from rich.console import Console
-    from rich.table import Table
-
-    console_output = Console()
-except ImportError:  # pragma: nocover
-    rich = None
+# yaml, cerberus and rich are slow to import: commands load what they use
+# pylint: disable=import-outside-toplevel
 
 device_app = typer.Typer(help="Devices management cli")
 
@@ -34,6 +26,8 @@ def auto_desc_callback(files: []):
     """
     Check device description file format
     """
+    import cerberus.validator
+    import yaml
     for file in files:
         try:
             with open(file, 'r', encoding='UTF-8') as stream:
@@ -45,7 +39,7 @@ def auto_desc_callback(files: []):
             print(f"{e}")
             raise typer.Exit(code=-1)
 
-        v = Validator()
+        v = cerberus.Validator()
         try:
             if not v.validate(doc, template):
                 print(f"{v.errors} in file {file}")
@@ -62,26 +56,28 @@ def list(ctx: typer.Context):
     """
     devices = []
 
-    for f in ctx.obj['files']:
-        with open(f, 'r', encoding='UTF-8') as file:
-            elements = []
-            device = yaml.safe_load(file)
-            elements.append(device['DeviceID'])
-            elements.append(device['Name'])
-            elements.append(device['Series'])
-            elements.append(device['CPU'])
-            elements.append(device['Description'])
+    # descriptions from the compiled index, the files are parsed only after a change
+    for device in DeviceIndex(ctx.obj['path']).devices():
+        elements = []
+        elements.append(device['DeviceID'])
+        elements.append(device['Name'])
+        elements.append(device['Series'])
+        elements.append(device['CPU'])
+        elements.append(device['Description'])
         devices.append(elements)
 
-    if rich is None:
+    try:
+        from rich.console import Console
+        from rich.table import Table
+    except ImportError:  # pragma: nocover
         for element in devices:
             print(f"0x{element[0]:X} , {element[1]}, {element[2]}, {element[3]}, {element[4]}")
-    else:
-        table = Table("Id", "Name", "Series", "Cpu", "Description")
-        for device in devices:
-            table.add_row(f"0x{device[0]:X}", f"{device[1]}", f"{device[2]}", f"{device[3]}", f"{device[4]}")
-        console = Console()
-        console.print(table)
+        return
+    table = Table("Id", "Name", "Series", "Cpu", "Description")
+    for device in devices:
+        table.add_row(f"0x{device[0]:X}", f"{device[1]}", f"{device[2]}", f"{device[3]}", f"{device[4]}")
+    console = Console()
+    console.print(table)
 
 
 class AddMode(str, Enum):
@@ -100,6 +96,7 @@ def add(ctx: typer.Context,
     Add device description
     """
     if mode == AddMode.COPY:
+        import yaml
         for file in files:
             with open(file, 'r', encoding='UTF-8') as f:
                 description = yaml.safe_load(f)
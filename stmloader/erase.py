@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+"""
+Erase planning
+
+The erase operations needed before writing an image are derived from the
+flash pages its segments touch. Pages are erased by batches of the erase
+command limit. A whole bank, or the whole memory, erases in about the time of
+a single page: when allowed, a bank is erased at once as soon as the image
+covers most of it, losing the content of the bank outside the image.
+"""
+
+PAGES = 'pages'
+"""Erase of a list of pages."""
+BANK = 'bank'
+"""Erase of a bank, given by its index starting at 0."""
+MASS = 'mass'
+"""Erase of the whole flash memory."""
+BANK_THRESHOLD = 0.5
+"""Fraction of the pages of a bank above which the bank is erased at once."""
+
+
+def touched_pages(segments, page_size, base):
+    """
+    Return the sorted indexes of the flash pages the segments touch.
+    :param segments: list of (address, data) in flash memory
+    :param page_size: flash page size in bytes
+    :param base: flash memory base address
+    """
+    pages = set()
+    for address, data in segments:
+        if data:
+            pages.update(range((address - base) // page_size, (address + len(data) - 1 - base) // page_size + 1))
+    return sorted(pages)
+
+
+def plan_erase(pages, page_count=0, banks=1, batch=255, whole_banks=False, threshold=BANK_THRESHOLD):
+    """
+    Return the smallest list of erase operations covering the given pages,
+    as (kind, argument) tuples: (PAGES, page indexes), (BANK, bank index) or
+    (MASS, None).
+
+    :param pages: page indexes to erase
+    :param page_count: number of pages of the flash memory, 0 if unknown
+    :param banks: number of banks that can be erased separately
+    :param batch: largest number of pages of an erase command
+    :param whole_banks: allow erasing pages outside the given ones, when a
+        bank is covered above the threshold
+    :param threshold: fraction of a bank the pages must cover
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    pages = sorted(set(pages))
+    erased = []
+    if whole_banks and page_count and pages:
+        bank_pages = page_count // banks
+        for bank in range(banks):
+            covered = sum(1 for page in pages if page // bank_pages == bank)
+            if covered > threshold * bank_pages:
+                erased.append(bank)
+        if len(erased) == banks:
+            return [(MASS, None)]
+        pages = [page for page in pages if page // bank_pages not in erased]
+    operations = [(BANK, bank) for bank in erased]
+    operations += [(PAGES, pages[index: index + batch]) for index in range(0, len(pages), batch)]
+    return operations
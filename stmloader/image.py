@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+"""
+Firmware image helpers
+
+An image is handled as a list of (address, data) segments holding only the
+populated memory ranges, as given by ``IntelHex.segments()``.
+"""
+
+
+def segments_from_intelhex(ih):
+    """
+    Return the populated ranges of an IntelHex object as (address, data) segments.
+    :param ih: IntelHex object
+    """
+    return [(start, ih.tobinarray(start=start, size=end - start).tobytes()) for start, end in ih.segments()]
+
+
+def align_segments(segments, alignment=4, fill=0xFF):
+    """
+    Return the segments sorted, with start address and length rounded to the
+    alignment. Padding uses the fill value, and segments sharing an aligned
+    word are merged.
+
+    :param segments: list of (address, data)
+    :param alignment: address and length alignment in bytes
+    :param fill: padding byte value
+    """
+    merged = []
+    for address, data in sorted(segments, key=lambda segment: segment[0]):
+        if merged:
+            previous_address, previous = merged[-1]
+            end = previous_address + len(previous)
+            if address - address % alignment < end + (-end % alignment):
+                # both segments use the same aligned word
+                if address < end:
+                    raise ValueError(f"Overlapping segments at 0x{address:08X}.")
+                merged[-1] = (previous_address, bytearray(previous) + bytes([fill]) * (address - end) + data)
+                continue
+        merged.append((address, data))
+
+    aligned = []
+    for address, data in merged:
+        head = address % alignment
+        tail = -(address + len(data)) % alignment
+        if head or tail:
+            data = bytes([fill]) * head + bytes(data) + bytes([fill]) * tail
+        aligned.append((address - head, data))
+    return aligned
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 24
+        for _ in range(8):
+            crc = (crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+
+def stm32_crc(data):
+    """
+    Return the CRC of the STM32 CRC peripheral in its reset configuration
+    (CRC-32/MPEG-2 of the little endian 32 bits words), as given by the Get
+    Checksum command.
+    :param data: bytes, length multiple of 4
+    """
+    if len(data) % 4:
+        raise ValueError(f"Data length is not a multiple of 4: {len(data)}.")
+    crc = 0xFFFFFFFF
+    for offset in range(0, len(data), 4):
+        # each word is fed most significant byte first
+        for byte in reversed(data[offset: offset + 4]):
+            crc = ((crc << 8) & 0xFFFFFFFF) ^ CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+class BinWriter:
+    """
+    Raw binary output. Chunks are expected in increasing and contiguous order.
+    """
+
+    def __init__(self, stream):
+        """
+        :param stream: binary file object
+        """
+        self.stream = stream
+
+    def write(self, address, data):
+        """
+        Append a chunk.
+        :param address: chunk address
+        :param data: chunk bytes
+        """
+        # pylint: disable=unused-argument
+        self.stream.write(data)
+
+    def close(self):
+        """Terminate the output. The stream itself is left open."""
+
+
+class HexWriter(BinWriter):
+    """
+    Intel HEX output, with 16 bytes data records and extended linear address
+    records.
+    """
+
+    RECORD_SIZE = 16
+
+    def __init__(self, stream):
+        """
+        :param stream: text file object
+        """
+        super().__init__(stream)
+        self.upper = None
+
+    def _record(self, kind, offset, data):
+        record = bytes([len(data), offset >> 8, offset & 0xFF, kind]) + bytes(data)
+        self.stream.write(f":{record.hex().upper()}{-sum(record) & 0xFF:02X}\n")
+
+    def write(self, address, data):
+        """
+        Append a chunk.
+        :param address: chunk address
+        :param data: chunk bytes
+        """
+        offset = 0
+        while offset < len(data):
+            current = address + offset
+            if current >> 16 != self.upper:
+                self.upper = current >> 16
+                self._record(0x04, 0, self.upper.to_bytes(2, 'big'))
+            # records do not cross a 64KB boundary
+            size = min(self.RECORD_SIZE, len(data) - offset, 0x10000 - (current & 0xFFFF))
+            self._record(0x00, current & 0xFFFF, data[offset: offset + size])
+            offset += size
+
+    def close(self):
+        """Write the end of file record."""
+        self._record(0x01, 0, b'')
+
+
+class SRecWriter(BinWriter):
+    """
+    Motorola S-record output, with S3 data records (32 bits addresses).
+    """
+
+    RECORD_SIZE = 16
+
+    def __init__(self, stream):
+        """
+        :param stream: text file object
+        """
+        super().__init__(stream)
+        self._record('0', 0, b'', 2)
+
+    def _record(self, kind, address, data, address_size=4):
+        record = bytes([address_size + len(data) + 1]) + address.to_bytes(address_size, 'big') + bytes(data)
+        self.stream.write(f"S{kind}{record.hex().upper()}{~sum(record) & 0xFF:02X}\n")
+
+    def write(self, address, data):
+        """
+        Append a chunk.
+        :param address: chunk address
+        :param data: chunk bytes
+        """
+        for offset in range(0, len(data), self.RECORD_SIZE):
+            self._record('3', address + offset, data[offset: offset + self.RECORD_SIZE])
+
+    def close(self):
+        """Write the termination record."""
+        self._record('7', 0, b'')
+
+
+class DumpWriter(BinWriter):
+    """
+    Hex dump in the ``IntelHex.dump()`` format, written line by line.
+    """
+
+    WIDTH = 16
+
+    def __init__(self, stream, address, length):
+        """
+        :param stream: text file object
+        :param address: first address of the dump
+        :param length: number of bytes of the dump
+        """
+        super().__init__(stream)
+        end = ((address + length - 1) // self.WIDTH + 1) * self.WIDTH
+        self.template = f"%0{max(len(hex(end)) - 2, 4)}X"
+        self.line = None
+        self.cells = []
+
+    def _flush(self):
+        if self.line is None:
+            return
+        cells = self.cells + [None] * (self.WIDTH - len(self.cells))
+        hexa = ''.join(' --' if x is None else f' {x:02X}' for x in cells)
+        text = ''.join(' ' if x is None else (chr(x) if 32 <= x < 127 else '.') for x in cells)
+        self.stream.write(f"{self.template % self.line} {hexa}  |{text}|\n")
+        self.line = None
+        self.cells = []
+
+    def write(self, address, data):
+        """
+        Append a chunk.
+        :param address: chunk address
+        :param data: chunk bytes
+        """
+        for offset, value in enumerate(data):
+            current = address + offset
+            line = current - current % self.WIDTH
+            if line != self.line:
+                self._flush()
+                self.line = line
+                self.cells = [None] * (current - line)
+            self.cells.append(value)
+        if len(self.cells) == self.WIDTH:
+            self._flush()
+
+    def close(self):
+        """Write the last line."""
+        self._flush()
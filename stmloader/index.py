@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+"""
+Device description index
+
+The ``stm32_0x*.yml`` device descriptions are compiled into a single JSON
+file, written next to them, holding every description by DeviceID. The index
+is rebuilt when a description is added, removed or modified (modification
+time or size changed), so that YAML files are only parsed after a change.
+A long running process, such as the daemon, sees the changes made while it
+runs: the index of the package is loaded again when its files changed.
+"""
+import functools
+import glob
+import json
+import os
+import tempfile
+
+from . import log
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), 'data')
+"""Folder of the device descriptions shipped with the package."""
+INDEX_NAME = '.index.json'
+INDEX_VERSION = 1
+
+
+class DeviceIndex:
+    """
+    Device descriptions by DeviceID, loaded from the compiled index.
+    """
+
+    def __init__(self, path=DATA_PATH):
+        """
+        :param path: device descriptions folder
+        """
+        self.path = path
+        self.index = os.path.join(path, INDEX_NAME)
+        self.descriptions = {}
+        self.sources = None
+        """Description files state the descriptions were loaded from, see _sources()."""
+        self.load()
+
+    def _sources(self):
+        """Return the modification time and size of each description file, by file name."""
+        sources = {}
+        for name in sorted(glob.glob(os.path.join(self.path, 'stm32_*.yml'))):
+            stat = os.stat(name)
+            sources[os.path.basename(name)] = [stat.st_mtime_ns, stat.st_size]
+        return sources
+
+    def load(self):
+        """
+        Load the index, rebuilding it from the description files when they
+        changed.
+        """
+        sources = self._sources()
+        try:
+            with open(self.index, 'r', encoding='UTF-8') as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION and index.get('sources') == sources:
+                self.descriptions = {description['DeviceID']: description for description in index['devices']}
+                self.sources = sources
+                return
+        except (OSError, ValueError):
+            pass
+        self.build(sources)
+
+    def build(self, sources=None):
+        """
+        Parse the description files and write the index. The index is only
+        kept in memory when the folder is not writable.
+        :param sources: description files state, as given by _sources()
+        """
+        if sources is None:
+            sources = self._sources()
+        # yaml is slow to import, only needed after a change
+        # pylint: disable=import-outside-toplevel
+        import yaml
+        log.devices.debug("Building the device index of %s from %d description files", self.path, len(sources))
+        devices = []
+        for name in sources:
+            with open(os.path.join(self.path, name), 'r', encoding='UTF-8') as f:
+                devices.append(yaml.safe_load(f))
+        self.descriptions = {description['DeviceID']: description for description in devices}
+        self.sources = sources
+        # written aside then renamed: concurrent readers never see a partial index
+        try:
+            handle, temporary = tempfile.mkstemp(prefix=INDEX_NAME, dir=self.path)
+            with os.fdopen(handle, 'w', encoding='UTF-8') as f:
+                json.dump({'version': INDEX_VERSION, 'sources': sources, 'devices': devices}, f)
+            os.replace(temporary, self.index)
+        except OSError as exc:
+            log.devices.debug("Device index not written, kept in memory: %s", exc)
+
+    def refresh(self):
+        """
+        Load the index again when a description file was added, removed or
+        modified since it was loaded.
+        """
+        if self._sources() != self.sources:
+            self.load()
+
+    def get(self, identifier):
+        """
+        Return the description of a device, None if unknown.
+        :param identifier: Device ID number
+        """
+        return self.descriptions.get(identifier)
+
+    def devices(self):
+        """Return the device descriptions, in file name order."""
+        return list(self.descriptions.values())
+
+
+@functools.lru_cache(maxsize=None)
+def _package_index():
+    """Return the index of the device descriptions shipped with the package."""
+    return DeviceIndex()
+
+
+def device_index():
+    """
+    Return the index of the device descriptions shipped with the package,
+    loaded once per process and refreshed when its files changed.
+    """
+    index = _package_index()
+    index.refresh()
+    return index
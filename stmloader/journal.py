@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+"""
+Write journal
+
+A journal records the progress of an image write on a device: whether the
+flash pages were erased, then the address of each Write Memory chunk once the
+bootloader acknowledged it. It is keyed by the device UID and the image hash,
+so that a failed write can be continued on the same device with the same
+image, instead of being started over.
+
+The journal is a text file, one entry per line, appended and flushed as the
+write goes: a line cut by a crash is ignored.
+"""
+import hashlib
+import os
+import struct
+
+JOURNAL_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'stmloader', 'journal')
+"""Default folder of the journals."""
+ERASED = 'erased'
+
+
+def image_hash(segments):
+    """
+    Return the SHA-256 hex digest of an image.
+    :param segments: list of (address, data)
+    """
+    digest = hashlib.sha256()
+    for address, data in segments:
+        digest.update(struct.pack('>II', address, len(data)))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class Journal:
+    """
+    Journal of the write of an image on a device.
+    """
+
+    def __init__(self, uid, digest, path=JOURNAL_PATH):
+        """
+        :param uid: device UID bytes
+        :param digest: image hash, see image_hash()
+        :param path: journals folder
+        """
+        self.file = os.path.join(path, f"{bytes(uid).hex()}_{digest[:16]}.journal")
+        self.erased = False
+        self.written = []
+        """Addresses of the chunks acknowledged, in write order."""
+        self._stream = None
+        self.load()
+
+    def load(self):
+        """Read the journal file, if any."""
+        self.erased = False
+        self.written = []
+        try:
+            with open(self.file, 'r', encoding='ascii') as f:
+                lines = f.read().split('\n')
+        except FileNotFoundError:
+            return
+        # the last line is empty, or cut
+        for line in lines[:-1]:
+            if line == ERASED:
+                self.erased = True
+            elif line.startswith('0x'):
+                self.written.append(int(line, 16))
+
+    def _append(self, line):
+        """Append an entry, flushed at once."""
+        if self._stream is None:
+            os.makedirs(os.path.dirname(self.file), exist_ok=True)
+            self._stream = open(self.file, 'a', encoding='ascii')  # pylint: disable=consider-using-with
+        self._stream.write(line + '\n')
+        self._stream.flush()
+
+    def record_erase(self):
+        """Record the erase of the image pages."""
+        self.erased = True
+        self._append(ERASED)
+
+    def confirm(self, address):
+        """
+        Record a chunk acknowledged by the bootloader.
+        :param address: chunk address
+        """
+        self.written.append(address)
+        self._append(f"0x{address:08X}")
+
+    def drop(self, addresses):
+        """
+        Forget chunks, to write them again.
+        :param addresses: chunk addresses
+        """
+        addresses = set(addresses)
+        self.close()
+        self.written = [address for address in self.written if address not in addresses]
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        with open(self.file, 'w', encoding='ascii') as f:
+            if self.erased:
+                f.write(ERASED + '\n')
+            f.writelines(f"0x{address:08X}\n" for address in self.written)
+
+    def close(self):
+        """Close the journal file."""
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def remove(self):
+        """Delete the journal, once the write completed."""
+        self.close()
+        try:
+            os.remove(self.file)
+        except FileNotFoundError:
+            pass
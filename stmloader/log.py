@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+"""
+Logging
+
+The loader logs through a logger per subsystem:
+
+- stmloader.protocol: bootloader commands, device information, transfers
+- stmloader.transport: bootloader activation, baud rate and synchronization
+- stmloader.devices: device description index
+
+Messages take their arguments apart, %-style, and are only formatted when a
+handler outputs them: the transfer loops cost a level check per chunk when
+their messages are disabled.
+
+As any library, stmloader adds no handler: applications configure logging as
+they wish. The cli calls setup(), which maps its verbosity to a level, sets
+the levels of the subsystems and outputs the messages as text or JSON lines on
+the standard error.
+"""
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+
+NOTICE = 25
+"""Level of the messages shown by default, between INFO and WARNING."""
+logging.addLevelName(NOTICE, 'NOTICE')
+
+ROOT = 'stmloader'
+SUBSYSTEMS = ('protocol', 'transport', 'devices')
+protocol = logging.getLogger(f'{ROOT}.protocol')
+transport = logging.getLogger(f'{ROOT}.transport')
+devices = logging.getLogger(f'{ROOT}.devices')
+
+TEXT = 'text'
+JSON = 'json'
+
+# attributes of every record, the other ones come from the extra argument
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def verbosity_level(verbosity):
+    """
+    Return the log level of a verbosity: 10 and above shows the debug
+    messages, 5 the info ones, 0 the notices, below only warnings and errors.
+    :param verbosity: verbosity level, as the cli --verbose option
+    """
+    if verbosity >= 10:
+        return logging.DEBUG
+    if verbosity >= 5:
+        return logging.INFO
+    if verbosity >= 0:
+        return NOTICE
+    return logging.WARNING
+
+
+def parse_level(spec):
+    """
+    Return the (subsystem, level) of a 'subsystem=level' specification, e.g.
+    'protocol=debug'.
+    :param spec: specification
+    """
+    subsystem, _, name = spec.partition('=')
+    subsystem = subsystem.strip().lower()
+    if subsystem not in SUBSYSTEMS:
+        raise ValueError(f"Unknown log subsystem '{subsystem}', one of {', '.join(SUBSYSTEMS)}")
+    level = logging.getLevelName(name.strip().upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level '{name}'")
+    return subsystem, level
+
+
+class StderrHandler(logging.StreamHandler):
+    """
+    Handler writing to the standard error of the moment, so that a stream
+    replaced after the setup, e.g. by a test runner, gets the messages.
+    """
+
+    @property
+    def stream(self):
+        """Standard error, looked up on each message."""
+        return sys.stderr
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formatter of records as JSON lines: time, level, logger, message, and the
+    fields given with the extra argument of the logging call.
+    """
+
+    def format(self, record):
+        event = {'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+                 'level': record.levelname, 'logger': record.name, 'message': record.getMessage()}
+        event.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            event['exception'] = self.formatException(record.exc_info)
+        return json.dumps(event, default=str)
+
+
+def setup(verbosity=5, levels=None, fmt=TEXT):
+    """
+    Output the stmloader messages on the standard error. Calling it again
+    replaces the previous setup.
+    :param verbosity: verbosity level, see verbosity_level()
+    :param levels: (subsystem, level) overriding the verbosity, see parse_level()
+    :param fmt: TEXT or JSON
+    """
+    logger = logging.getLogger(ROOT)
+    logger.setLevel(verbosity_level(verbosity))
+    for subsystem in SUBSYSTEMS:
+        logging.getLogger(f'{ROOT}.{subsystem}').setLevel(logging.NOTSET)
+    for subsystem, level in levels or ():
+        logging.getLogger(f'{ROOT}.{subsystem}').setLevel(level)
+    handler = StderrHandler()
+    handler.setFormatter(JsonFormatter() if fmt == JSON else logging.Formatter('%(message)s'))
+    logger.handlers = [handler]
+    logger.propagate = False
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+"""
+Job metrics
+
+The loader records how many commands it sent, how long the bootloader took to
+acknowledge them, to erase and to synchronize after a reset, the bytes
+exchanged on the UART and the effective throughput of the transfers. The
+metrics are exported as JSON, or in the Prometheus text format for the
+node exporter textfile collector.
+"""
+import contextlib
+import json
+import os
+import tempfile
+import time
+
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+"""Upper bounds of the latency histogram buckets, in seconds."""
+PREFIX = 'stmloader'
+"""Prefix of the Prometheus metric names."""
+
+
+class Histogram:
+    """
+    Distribution of durations in cumulative buckets, as Prometheus histograms.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        :param buckets: upper bounds of the buckets, increasing
+        """
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Record a duration.
+        :param value: duration in seconds
+        """
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def cumulative(self):
+        """Return the (upper bound, count of durations below it) of each bucket."""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def as_dict(self):
+        """Return the histogram as a dictionary."""
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': {str(bound): count for bound, count in self.cumulative()}}
+
+
+class Metrics:
+    """
+    Metrics of a loader: command counts, latency histograms, bytes on the
+    wire and transfer throughput.
+    """
+
+    def __init__(self):
+        self.commands = {}
+        """Number of commands sent, by command name."""
+        self.histograms = {}
+        """Histograms by (metric name, label)."""
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.transfers = {}
+        """[bytes, seconds] of the transfers, by operation."""
+
+    def count(self, command):
+        """
+        Count a command sent.
+        :param command: command name
+        """
+        self.commands[command] = self.commands.get(command, 0) + 1
+
+    def observe(self, name, value, label=None):
+        """
+        Record a duration in a histogram.
+        :param name: metric name, e.g. 'command_ack'
+        :param value: duration in seconds
+        :param label: command name the duration is for, if any
+        """
+        key = (name, label)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, label=None):
+        """
+        Context manager recording its duration in a histogram, when its block
+        succeeds.
+        :param name: metric name
+        :param label: command name the duration is for, if any
+        """
+        start = time.perf_counter()
+        yield
+        self.observe(name, time.perf_counter() - start, label)
+
+    @contextlib.contextmanager
+    def transfer(self, operation, length):
+        """
+        Context manager recording a transfer of data, for its throughput.
+        :param operation: 'read', 'write' or 'verify'
+        :param length: number of data bytes transferred
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            totals = self.transfers.setdefault(operation, [0, 0.0])
+            totals[0] += length
+            totals[1] += time.perf_counter() - start
+
+    def sorted_histograms(self):
+        """Return the ((metric name, label), histogram) items, sorted by name and label."""
+        return sorted(self.histograms.items(), key=lambda item: (item[0][0], item[0][1] or ''))
+
+    def as_dict(self):
+        """Return the metrics as a dictionary, ready for JSON."""
+        histograms = {}
+        for (name, label), histogram in self.sorted_histograms():
+            histograms.setdefault(name, {})[label or 'all'] = histogram.as_dict()
+        return {
+            'commands': dict(sorted(self.commands.items())),
+            'latency': histograms,
+            'wire': {'sent': self.bytes_sent, 'received': self.bytes_received},
+            'transfers': {operation: {'bytes': length, 'seconds': seconds,
+                                      'rate': length / seconds if seconds else 0.0}
+                          for operation, (length, seconds) in sorted(self.transfers.items())},
+        }
+
+
+def _escape(value):
+    """Return a Prometheus label value, its backslashes, quotes and newlines escaped."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    """Return Prometheus labels, the ones set to None left out."""
+    text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items() if value is not None)
+    return f'{{{text}}}' if text else ''
+
+
+def _histogram_lines(name, histogram, **labels):
+    """
+    Return the Prometheus samples of a histogram.
+    :param name: metric name
+    :param histogram: Histogram
+    :param labels: labels of the samples
+    """
+    lines = [f'{PREFIX}_{name}_seconds_bucket{_labels(**labels, le=bound)} {count}'
+             for bound, count in histogram.cumulative()]
+    lines.append(f'{PREFIX}_{name}_seconds_bucket{_labels(**labels, le="+Inf")} {histogram.count}')
+    lines.append(f'{PREFIX}_{name}_seconds_sum{_labels(**labels)} {histogram.sum}')
+    lines.append(f'{PREFIX}_{name}_seconds_count{_labels(**labels)} {histogram.count}')
+    return '\n'.join(lines)
+
+
+def to_json(metrics):
+    """
+    Return the metrics of several loaders as JSON.
+    :param metrics: Metrics by port name
+    """
+    return json.dumps({port: metric.as_dict() for port, metric in metrics.items()}, indent=2)
+
+
+def _samples(port, metric):
+    """
+    Yield the (family name, type, samples text) of the metrics of a loader.
+    :param port: port of the loader
+    :param metric: Metrics
+    """
+    for command, count in sorted(metric.commands.items()):
+        yield 'commands_total', 'counter', f'{PREFIX}_commands_total{_labels(port=port, command=command)} {count}'
+    for (name, label), histogram in metric.sorted_histograms():
+        yield f'{name}_seconds', 'histogram', _histogram_lines(name, histogram, port=port, command=label)
+    for direction, length in (('sent', metric.bytes_sent), ('received', metric.bytes_received)):
+        yield 'wire_bytes_total', 'counter', f'{PREFIX}_wire_bytes_total{_labels(port=port, direction=direction)} ' \
+                                             f'{length}'
+    for operation, (length, seconds) in sorted(metric.transfers.items()):
+        labels = _labels(port=port, operation=operation)
+        yield 'transfer_bytes_total', 'counter', f'{PREFIX}_transfer_bytes_total{labels} {length}'
+        yield 'transfer_seconds_total', 'counter', f'{PREFIX}_transfer_seconds_total{labels} {seconds}'
+        yield 'transfer_bytes_per_second', 'gauge', \
+            f'{PREFIX}_transfer_bytes_per_second{labels} {length / seconds if seconds else 0.0}'
+
+
+def to_prometheus(metrics):
+    """
+    Return the metrics of several loaders in the Prometheus text format,
+    labelled by port.
+    :param metrics: Metrics by port name
+    """
+    families = {}
+    for port, metric in metrics.items():
+        for name, kind, text in _samples(port, metric):
+            families.setdefault(name, (kind, []))[1].append(text)
+    lines = []
+    for name, (kind, samples) in families.items():
+        lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+        lines += samples
+    return '\n'.join(lines) + '\n'
+
+
+def write_atomic(path, text):
+    """
+    Write a file aside then rename it, so that a collector never reads a
+    partial file.
+    :param path: file name
+    :param text: file contents
+    """
+    handle, temporary = tempfile.mkstemp(prefix=os.path.basename(path), dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(handle, 'w', encoding='UTF-8') as f:
+            f.write(text)
+        # mkstemp files are private, collectors run as another user
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except OSError:
+        os.unlink(temporary)
+        raise
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+"""
+Transfer progress
+
+The loader reports the progress of its reads and writes to a callback taking
+the bytes done, the total bytes and the rate in bytes per second. Calls are
+throttled: at most one per INTERVAL, plus the first and the last ones of each
+transfer. No callback, the default, costs nothing.
+
+The cli renders the progress as a bar on the console, as JSON lines, or not at
+all.
+"""
+import json
+import sys
+import time
+
+INTERVAL = 0.1
+"""Shortest time between two progress calls of a transfer, in seconds."""
+
+
+class Progress:
+    """
+    Progress of one transfer, reported to a callback.
+    """
+
+    def __init__(self, callback, total, interval=INTERVAL):
+        """
+        :param callback: callable(done, total, rate), None for no report
+        :param total: number of bytes of the transfer
+        :param interval: shortest time between two calls
+        """
+        self.callback = callback
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.start = self.last = time.perf_counter()
+
+    def __enter__(self):
+        if self.callback is not None:
+            self.callback(0, self.total, 0.0)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.callback is not None and exc_type is None:
+            self._report(time.perf_counter())
+
+    def _report(self, now):
+        """Call the callback."""
+        elapsed = now - self.start
+        self.last = now
+        self.callback(self.done, self.total, self.done / elapsed if elapsed > 0 else 0.0)
+
+    def update(self, count):
+        """
+        Count bytes done, and report them if the last report is old enough.
+        :param count: number of bytes
+        """
+        self.done += count
+        if self.callback is None:
+            return
+        now = time.perf_counter()
+        if now - self.last >= self.interval and self.done < self.total:
+            self._report(now)
+
+
+class BarRenderer:
+    """
+    Progress bar on the console, one per transfer.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.progress_bar = None
+
+    def __call__(self, done, total, rate):
+        if not total:
+            return
+        if self.progress_bar is None or done == 0:
+            # progressbar is slow to import, loaded on the first transfer
+            # pylint: disable=import-outside-toplevel
+            from progressbar import ProgressBar, Percentage, GranularBar, AdaptiveETA, AdaptiveTransferSpeed
+            widgets = [' ', Percentage(), ' ', GranularBar(), ' ', AdaptiveTransferSpeed(), ' ', AdaptiveETA()]
+            self.progress_bar = ProgressBar(widgets=widgets, max_value=total).start()
+        self.progress_bar.update(done)
+        if done >= total:
+            self.progress_bar.finish()
+            self.progress_bar = None
+
+
+class JsonRenderer:
+    """
+    Progress as JSON lines, e.g. for station software.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, stream=None, **fields):
+        """
+        :param stream: text stream, standard error if None
+        :param fields: extra fields of every line, e.g. the board port
+        """
+        self.stream = stream
+        self.fields = fields
+
+    def __call__(self, done, total, rate):
+        event = dict(self.fields, event='progress', done=done, total=total, rate=round(rate, 1))
+        stream = self.stream or sys.stderr
+        stream.write(json.dumps(event) + '\n')
+        stream.flush()
@@ -28,13 +28,24 @@ template = {
     'Flash': {
         'type': 'dict',
         'schema': {
-            'PageSize': {'type': 'number', 'required': True}
+            'PageSize': {'type': 'number', 'required': True},
+            'Size': {'type': 'number'},
+            'Banks': {'type': 'integer', 'min': 1},
+            'Uniform': {'type': 'boolean'}
         }
     },
     'Bootloader': {
         'type': 'dict',
         'schema': {
             'ID': {'type': 'number', 'required': True},
+            'USART': {'type': 'number'},
+            'Startup': {
+                'type': 'dict',
+                'schema': {
+                    'delay': {'type': 'number'},
+                    'timeout': {'type': 'number'}
+                },
+            },
             'RAM': {
                 'type': 'dict',
                 'schema': {
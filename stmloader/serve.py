@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Loader daemon cli applications: the daemon, and its client
+"""
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+import typer
+from typing_extensions import Annotated
+from . import log
+from .boot import (READ_SUFFIXES, READ_WRITERS, EraseMode, ErasePlan, LogFormat, ReadFormat, ResetMode,
+                   auto_int_callback, baudrate_callback, expand_ports, load_segments, log_levels_callback)
+from .image import DumpWriter
+
+# scaffold and the bootloader are slow to import: commands load them when they
+# run, so that --help does not pay for them
+# pylint: disable=import-outside-toplevel
+
+SOCKET_HELP = "Unix socket of the daemon, ~/.cache/stmloader/daemon.sock by default"
+
+serve_app = typer.Typer(add_completion=False)
+
+
+@serve_app.command()
+def serve(ports: Annotated[
+              str, typer.Option("--ports", "-p", help="Comma separated Scaffold ports or glob patterns")
+          ] = '/dev/ttyUSB0',
+          path: Annotated[Optional[str], typer.Option("--socket", "-s", help=SOCKET_HELP)] = None,
+          baudrate: Annotated[
+              str, typer.Option("--baudrate", "-b", callback=baudrate_callback,
+                                help="UART baud rate, or 'auto' for the fastest one")] = '115200',
+          timeout: Annotated[
+              Optional[float], typer.Option("--timeout", "-t", help="Longest bootloader startup time, the device "
+                                                                    "one by default")] = None,
+          verbose: Annotated[int, typer.Option("--verbose", "-v", help="Verbosity level")] = 5,
+          log_levels: Annotated[
+              Optional[List[str]], typer.Option("--log", callback=log_levels_callback,
+                                                help="Log level of a subsystem overriding the verbosity, e.g. "
+                                                     "protocol=debug")] = None,
+          log_format: Annotated[
+              LogFormat, typer.Option("--log-format", case_sensitive=False,
+                                      help="Log messages output, on the standard error")] = LogFormat.TEXT,
+          ):
+    """
+    Serve the loader jobs of the clients, keeping the boards open
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    import scaffold
+    from serial.serialutil import SerialException
+    from .bootloader import STM32
+    from .daemon import SOCKET_PATH, Board, Daemon, DaemonError
+    path = path or SOCKET_PATH
+    log.setup(verbose, log_levels, log_format.value)
+    try:
+        boards = {port: Board(STM32(scaffold.Scaffold(port), verbosity=verbose, baudrate=baudrate), timeout)
+                  for port in expand_ports(ports)}
+        daemon = Daemon(boards, path)
+    except (SerialException, DaemonError) as e:
+        print(e)
+        raise typer.Exit(code=1)
+    with daemon:
+        log.protocol.log(log.NOTICE, "Serving %s on %s", ', '.join(boards), path)
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+client_app = typer.Typer(help="Loader daemon client", chain=True, add_completion=False)
+
+
+@client_app.callback()
+def connect(ctx: typer.Context,
+            path: Annotated[Optional[str], typer.Option("--socket", "-s", help=SOCKET_HELP)] = None,
+            port: Annotated[
+                Optional[str], typer.Option("--port", "-p", help="Board port, optional when the daemon serves a "
+                                                                 "single board")] = None,
+            ):
+    """
+    Client callback
+    """
+    from .daemon import SOCKET_PATH, Client, DaemonError
+    try:
+        ctx.obj = Client(path or SOCKET_PATH, port)
+    except DaemonError as e:
+        print(e)
+        raise typer.Exit(code=1)
+    ctx.call_on_close(ctx.obj.close)
+
+
+def run(ctx, job, **args):
+    """
+    Run a job on the daemon, return its result. A failed job ends the client
+    with exit code 1.
+    :param ctx: typer context
+    :param job: job name
+    :param args: job arguments
+    """
+    from .daemon import DaemonError
+    try:
+        return ctx.obj.request(job, **args)
+    except DaemonError as e:
+        print(e)
+        raise typer.Exit(code=1)
+
+
+@client_app.command()
+def status(ctx: typer.Context):
+    """
+    Boards of the daemon
+    """
+    for port, board in run(ctx, 'status').items():
+        state = 'bootloader' if board['bootloader'] else 'application'
+        print(f"{port}: {board['series'] or 'unknown'} device, {state}")
+
+
+@client_app.command()
+def reset(ctx: typer.Context,
+          mode: Annotated[
+              ResetMode, typer.Option("--mode", "-m", case_sensitive=False, help="Reset mode")] = ResetMode.SYSTEM,
+          timeout: Annotated[
+              Optional[float], typer.Option("--timeout", "-t", help="Longest bootloader startup time, startup time "
+                                                                    "in flash mode")] = None,
+          ):
+    """
+    Reset to system/flash memory job
+    """
+    run(ctx, 'reset', mode=mode.value, startup=timeout)
+
+
+@client_app.command()
+def read(ctx: typer.Context,
+         address: Annotated[
+             str, typer.Option("--address", "-a", callback=auto_int_callback, help="Starting address")] = '0x08000000',
+         length: Annotated[int, typer.Option("--length", "-l", help="Length to read")] = 0,
+         file: Annotated[Optional[str], typer.Argument(help="Output file name, hex dump by default")] = None,
+         fmt: Annotated[
+             ReadFormat, typer.Option("--format", "-f", case_sensitive=False,
+                                      help="Output file format, from the file suffix by default")] = ReadFormat.AUTO,
+         ):
+    """
+    Read memory job
+    """
+    from .daemon import decode
+    data = decode(run(ctx, 'read', address=address, length=length))
+    if not file:
+        writer = DumpWriter(sys.stdout, address, length)
+        writer.write(address, data)
+        writer.close()
+        return
+    if fmt == ReadFormat.AUTO:
+        fmt = READ_SUFFIXES.get(Path(file).suffix.lower(), ReadFormat.HEX)
+    with open(file, 'wb') if fmt == ReadFormat.BIN else open(file, 'w', encoding='ascii') as stream:
+        writer = READ_WRITERS[fmt](stream)
+        writer.write(address, data)
+        writer.close()
+
+
+@client_app.command()
+def write(ctx: typer.Context,
+          address: Annotated[
+              str, typer.Option("--address", "-a", callback=auto_int_callback, help="Starting address")] = '0x08000000',
+          file: Annotated[Optional[str], typer.Argument(help="File to write")] = None,
+          verify: Annotated[bool, typer.Option("--verify", "-v", help="Write verify")] = False,
+          force: Annotated[bool, typer.Option("--force", "-f", help="Write blank (0xFF) chunks too")] = False,
+          diff: Annotated[bool, typer.Option("--diff", "-d", help="Erase and write changed pages only")] = False,
+          erase_plan: Annotated[
+              ErasePlan, typer.Option("--erase", "-e", case_sensitive=False,
+                                      help="Erase the pages touched by the image first, or whole banks when "
+                                           "mostly covered (auto)")] = ErasePlan.NONE,
+          ):
+    """
+    Write memory job
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    from .daemon import encode_segments
+    success = run(ctx, 'write', segments=encode_segments(load_segments(file, address)),
+                  erase=erase_plan.value, force=force, diff=diff, verify=verify)
+    if verify:
+        report_verification(success)
+
+
+@client_app.command()
+def erase(ctx: typer.Context,
+          address: Annotated[
+              str, typer.Option("--address", "-a", callback=auto_int_callback, help="Starting address")] = '0x08000000',
+          length: Annotated[int, typer.Option("--length", "-l", help="Length to erase")] = 0,
+          mode: Annotated[EraseMode, typer.Option("--mode", "-m", help='Erase extended mode',
+                                                  case_sensitive=False)] = EraseMode.NONE,
+          ):
+    """
+    Erase memory job
+    """
+    if mode != EraseMode.NONE:
+        run(ctx, 'erase', mode=mode.value)
+    else:
+        run(ctx, 'erase', address=address, length=length)
+
+
+@client_app.command("verify")
+def verify_image(ctx: typer.Context,
+                 address: Annotated[
+                     str, typer.Option("--address", "-a", callback=auto_int_callback, help="Starting address")
+                 ] = '0x08000000',
+                 file: Annotated[Optional[str], typer.Argument(help="File to verify")] = None,
+                 ):
+    """
+    Verify memory job
+    """
+    from .daemon import encode_segments
+    report_verification(run(ctx, 'verify', segments=encode_segments(load_segments(file, address))))
+
+
+@client_app.command()
+def go(ctx: typer.Context,
+       address: Annotated[
+           str, typer.Option("--address", "-a", callback=auto_int_callback, help="Starting address")] = '0x08000000',
+       ):
+    """
+    Go job
+    """
+    run(ctx, 'go', address=address)
+
+
+@client_app.command()
+def shutdown(ctx: typer.Context):
+    """
+    Stop the daemon
+    """
+    run(ctx, 'shutdown')
+
+
+def report_verification(success):
+    """
+    Print a verification result, a failure ends the client with exit code 1.
+    :param success: verification result
+    """
+    print("Verification successfully" if success else "Verification failed")
+    if not success:
+        raise typer.Exit(code=1)
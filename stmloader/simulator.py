@@ -0,0 +1,896 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+"""
+In-process AN3155 bootloader simulator
+
+:class:`SimulatedScaffold` implements the part of the donjon-scaffold API used
+by :class:`stmloader.bootloader.STM32` (``uart0``, ``d0`` to ``d7``, ``power``
+and ``timeout``) and forwards the UART traffic to a :class:`SimulatedTarget`,
+which speaks the ST UART bootloader protocol over a modelled memory map built
+from the ``stm32_0x*.yml`` device descriptions.
+
+Time is not measured, it is modelled: every UART transaction, every byte on
+the wire and every flash operation advances the :attr:`SimulatedTarget.clock`
+by a configurable amount, so a benchmark gives the same figures on every run.
+"""
+import collections
+import dataclasses
+import operator
+import struct
+import zlib
+from functools import reduce
+
+import scaffold
+
+from .bootloader import STM32
+from .image import stm32_crc
+from .index import device_index
+from .stubs import CRC32_CODE, FLASH_LOADER_CODE, Crc32Stub, FlashLoaderStub
+
+FLASH_BASE = 0x08000000
+"""Base address of the main flash memory."""
+RAM_BASE = 0x20000000
+"""Base address of the SRAM."""
+
+
+class Signal:
+    """
+    Scaffold I/O stand-in. Supports the ``<<`` operator used to drive a value
+    or to connect another signal.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, name, on_change=None):
+        """
+        :param name: signal name
+        :param on_change: callable invoked each time a value is driven
+        """
+        self.name = name
+        self.value = 0
+        self.source = None
+        self.on_change = on_change
+
+    def __lshift__(self, other):
+        if isinstance(other, Signal):
+            self.source = other
+        else:
+            self.value = int(other)
+            if self.on_change is not None:
+                self.on_change()
+        return self
+
+
+class Power:
+    """
+    Scaffold power module stand-in. Only the DUT power supply is modelled.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, target):
+        """
+        :param target: the simulated target powered by this module
+        """
+        self.target = target
+        self.platform = 1
+
+    @property
+    def dut(self):
+        """DUT power-supply state"""
+        return int(self.target.powered)
+
+    @dut.setter
+    def dut(self, value):
+        self.target.powered = bool(value)
+        self.target.update()
+
+
+class SimulatedUART:
+    """
+    Scaffold UART stand-in connected to a :class:`SimulatedTarget`.
+    """
+
+    def __init__(self, parent):
+        """
+        :param parent: The :class:`SimulatedScaffold` owning the UART.
+        """
+        self.parent = parent
+        self.rx = Signal("rx")
+        self.tx = Signal("tx")
+        self.baudrate = 9600
+        self.transactions = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def transmit(self, data, trigger=False):
+        """
+        Transmit data to the target.
+
+        :param data: Data to be transmitted.
+        :param trigger: Ignored, kept for API compatibility.
+        """
+        # pylint: disable=unused-argument
+        target = self.parent.target
+        data = bytes(data)
+        self.transactions += 1
+        self.bytes_sent += len(data)
+        target.elapse(self.parent.latency + target.wire_time(len(data), self.baudrate))
+        target.feed(data, self.baudrate)
+
+    def receive(self, n=1):
+        """
+        Receive n bytes from the target. As with the real board, a
+        ``scaffold.TimeoutError`` carrying the partial data is raised when the
+        target does not send enough bytes.
+
+        :param n: number of bytes to receive
+        """
+        target = self.parent.target
+        self.transactions += 1
+        target.elapse(self.parent.latency)
+        data = target.pop_reply(n)
+        self.bytes_received += len(data)
+        if len(data) < n:
+            target.elapse(self.parent.timeout or 0)
+            target.abort()
+            raise scaffold.TimeoutError(data=data)
+        return data
+
+    def flush(self):
+        """Discard all the received bytes."""
+        self.transactions += 1
+        self.parent.target.elapse(self.parent.latency)
+        self.parent.target.pop_reply(None)
+
+
+class SimulatedScaffold:
+    """
+    Drop-in replacement for ``scaffold.Scaffold`` driving a
+    :class:`SimulatedTarget` instead of a board.
+    """
+
+    # pylint: disable=invalid-name,too-many-instance-attributes
+
+    def __init__(self, target, latency=0.001):
+        """
+        :param target: simulated device connected to the board.
+        :param latency: modelled host round trip for each UART call, in seconds.
+        """
+        self.target = target
+        self.latency = latency
+        self.timeout = 1
+        self.power = Power(target)
+        self.d0, self.d1, self.d2, self.d3, self.d4, self.d5, self.d6, self.d7 = (
+            Signal(f"d{index}", target.update) for index in range(8))
+        self.uart0 = SimulatedUART(self)
+        target.attach(nrst=self.d2, boot0=self.d6, boot1=self.d7)
+
+    @property
+    def clock(self):
+        """Modelled time elapsed since the simulation started, in seconds"""
+        return self.target.clock
+
+    def sleep(self, seconds):
+        """
+        Advance the modelled time. Can replace ``time.sleep`` in the loader
+        to keep reset sequences deterministic.
+
+        :param seconds: delay in seconds
+        """
+        self.target.elapse(seconds)
+
+
+@dataclasses.dataclass
+class Fault:
+    """
+    Fault to be injected when the target receives a command.
+    """
+    NACK = 'nack'
+    """Reply NACK instead of ACK to the command."""
+    TIMEOUT = 'timeout'
+    """Silently discard the command and its parameters."""
+    DROP = 'drop'
+    """Lose the first byte sent by the host after the command."""
+
+    kind: str
+    command: int = None
+    skip: int = 0
+    count: int = 1
+
+
+@dataclasses.dataclass
+class Region:
+    """
+    Memory region of the simulated target.
+    """
+    name: str
+    start: int
+    data: bytearray
+    writable: bool = False
+
+    @property
+    def end(self):
+        """First address after the region"""
+        return self.start + len(self.data)
+
+    def contains(self, address, length):
+        """
+        Return True if the given range is fully inside the region.
+        :param address: first address
+        :param length: number of bytes
+        """
+        return self.start <= address and address + length <= self.end
+
+
+class SimulatedTarget:
+    """
+    Model of an STM32 device running its UART system bootloader.
+
+    Timing parameters are in seconds. Faults are injected with :meth:`inject`.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    Command = STM32.Command
+    Reply = STM32.Reply
+    BITS_PER_BYTE = 10
+    """One start bit, eight data bits and one stop bit."""
+    CPU_FREQUENCY = 16000000
+    """Core clock while the bootloader runs, in Hz."""
+    USART_TOLERANCE = 0.03
+    """Baud rate deviation a USART receiver tolerates, 9 bits words."""
+
+    def __init__(self, description, extended_erase=True, version=0x31, max_baudrate=115200,
+                 erase_page_time=0.025, erase_bank_time=0.025, program_time=0.003, uid=None, get_checksum=False,
+                 startup_time=0.0):
+        """
+        :param description: device description, as loaded from a stm32_0x*.yml file.
+        :param extended_erase: True to support Extended Erase (0x44), False for Erase (0x43).
+        :param version: bootloader protocol version.
+        :param max_baudrate: fastest rate the bootloader can synchronise on.
+        :param erase_page_time: latency of a page erase.
+        :param erase_bank_time: latency of a bank or mass erase.
+        :param program_time: latency of a Write Memory command on flash.
+        :param uid: 12 bytes universal ID.
+        :param get_checksum: True to support Get Checksum (0xA1).
+        :param startup_time: delay between a reset and the bootloader listening to the UART.
+        """
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self.description = description
+        self.device_id = description['DeviceID']
+        self.version = version
+        self.max_baudrate = max_baudrate
+        self.erase_page_time = erase_page_time
+        self.erase_bank_time = erase_bank_time
+        self.program_time = program_time
+        self.commands = [self.Command.GET, self.Command.GET_VERSION, self.Command.GET_ID,
+                         self.Command.READ_MEMORY, self.Command.GO, self.Command.WRITE_MEMORY,
+                         self.Command.EXTENDED_ERASE if extended_erase else self.Command.ERASE,
+                         self.Command.WRITE_PROTECT, self.Command.WRITE_UNPROTECT,
+                         self.Command.READOUT_PROTECT, self.Command.READOUT_UNPROTECT]
+        if get_checksum:
+            self.commands.append(self.Command.GET_CHECKSUM)
+
+        flash = description['Flash']
+        self.page_size = flash['PageSize']
+        self.banks = flash.get('Banks', 1)
+        self.flash = Region('flash', FLASH_BASE, bytearray(b'\xff' * flash.get('Size', 0x20000)), True)
+        bootloader = description['Bootloader']
+        ram = bootloader.get('RAM', {'min': RAM_BASE + 0x1000, 'max': RAM_BASE + 0x3FFF})
+        self.ram_min = ram['min']
+        self.ram = Region('ram', RAM_BASE, bytearray(ram['max'] + 1 - RAM_BASE), True)
+        system = bootloader.get('SYS', {'min': bootloader['ID'] & ~0xFFFF, 'max': bootloader['ID']})
+        self.system = Region('system', system['min'], bytearray(system['max'] + 1 - system['min']))
+        self.regions = [self.flash, self.ram, self.system]
+        self._store(bootloader['ID'], bytes([version]))
+        self.uid = bytes(uid) if uid is not None else bytes(range(0x30, 0x3C))
+        self._store(description['UniversalID']['address'], self.uid)
+        self._store(description['FlashSize']['address'], struct.pack("<H", len(self.flash.data) // 1024))
+
+        self.clock = 0.0
+        self.powered = False
+        self.readout_protected = False
+        self.write_protected = set()
+        self.command_counts = collections.Counter()
+        self.faults = []
+        self._pins = {}
+        self._baudrate = None
+        self._line = None
+        self._host = bytearray()
+        self._reply = bytearray()
+        self._reply_at = []
+        self._session = None
+        self._need = 0
+        self._drop = 0
+        self._running = False
+        self._reset_at = None
+        self.startup_time = startup_time
+        self._ready_at = 0.0
+
+    @classmethod
+    def from_device_id(cls, identifier, **kwargs):
+        """
+        Build a target from one of the device descriptions shipped with the package.
+
+        :param identifier: device ID number
+        :param kwargs: extra arguments for the constructor
+        """
+        description = device_index().get(identifier)
+        if description is None:
+            raise ValueError(f"Unknown device 0x{identifier:X}.")
+        return cls(description, **kwargs)
+
+    def _store(self, address, data):
+        """
+        Place read-only data in the memory map, creating an information region
+        when the address is outside any existing one.
+        """
+        for region in self.regions:
+            if region.contains(address, len(data)):
+                region.data[address - region.start: address - region.start + len(data)] = data
+                return
+        # 16 bytes aligned block, so that word reads around the data succeed
+        start = address & ~0xF
+        end = (address + len(data) + 0xF) & ~0xF
+        self.regions.append(Region('info', start, bytearray(end - start)))
+        self._store(address, data)
+
+    def _region(self, address, length):
+        """Return the region holding the given range, or None."""
+        for region in self.regions:
+            if region.contains(address, length):
+                return region
+        return None
+
+    def read(self, address, length):
+        """
+        Read the memory map, bypassing the bootloader.
+        :param address: first address
+        :param length: number of bytes
+        """
+        region = self._region(address, length)
+        if region is None:
+            raise ValueError(f"Address range 0x{address:08X}+{length} is not mapped.")
+        return bytes(region.data[address - region.start: address - region.start + length])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # time model
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def elapse(self, seconds):
+        """
+        Advance the modelled time.
+        :param seconds: delay in seconds
+        """
+        self.clock += seconds
+
+    def wire_time(self, length, baudrate):
+        """
+        Time needed to send bytes on the UART.
+        :param length: number of bytes
+        :param baudrate: line rate
+        """
+        return length * self.BITS_PER_BYTE / baudrate
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # pins and UART
+    # ------------------------------------------------------------------------------------------------------------------
+
+    def attach(self, **pins):
+        """
+        Connect the reset and boot pins of the target.
+        :param pins: nrst, boot0 and boot1 signals
+        """
+        self._pins = pins
+
+    def update(self):
+        """
+        Track power and NRST changes. The bootloader starts when NRST is
+        released with BOOT0 high; otherwise the user application runs and the
+        UART stays silent.
+        """
+        nrst = self._pins.get('nrst')
+        active = self.powered and (nrst is None or nrst.value == 1)
+        if active and not self._running:
+            self._running = True
+            boot0 = self._pins.get('boot0')
+            if boot0 is None or boot0.value == 1:
+                self._boot()
+            else:
+                self._session = None
+        elif not active and self._running:
+            self._running = False
+            self._session = None
+            self._reset_at = None
+
+    def _boot(self):
+        """Start a fresh bootloader session, waiting for the synchronisation byte."""
+        self._baudrate = None
+        self._reset_at = None
+        self._host.clear()
+        self._drop = 0
+        self._ready_at = self.clock + self.startup_time
+        self._session = self._bootloader()
+        self._need = next(self._session)
+
+    def inject(self, kind, command=None, skip=0, count=1):
+        """
+        Arm a fault.
+
+        :param kind: one of Fault.NACK, Fault.TIMEOUT or Fault.DROP.
+        :param command: command code the fault applies to, None for any command.
+        :param skip: number of matching commands to let through first.
+        :param count: number of times the fault is triggered.
+        """
+        self.faults.append(Fault(kind, command, skip, count))
+
+    def _fault(self, command):
+        """Return the kind of fault to apply to the given command, or None."""
+        for fault in self.faults:
+            if fault.command not in (None, command):
+                continue
+            if fault.skip:
+                fault.skip -= 1
+                continue
+            fault.count -= 1
+            if fault.count <= 0:
+                self.faults.remove(fault)
+            return fault.kind
+        return None
+
+    def feed(self, data, baudrate):
+        """
+        Bytes sent by the host.
+        :param data: received bytes
+        :param baudrate: line rate used by the host
+        """
+        if self._reset_at is not None and self.clock >= self._reset_at:
+            self._system_reset()
+        if self._session is None or self.clock < self._ready_at:
+            # bytes sent before the bootloader starts are lost
+            return
+        self._line = baudrate
+        if self._baudrate is None:
+            if baudrate > self.max_baudrate:
+                return
+        elif baudrate != self._baudrate:
+            # framing errors: nothing usable is received
+            return
+        self._host.extend(data)
+        while self._session is not None:
+            if self._drop:
+                dropped = min(self._drop, len(self._host))
+                del self._host[:dropped]
+                self._drop -= dropped
+            if len(self._host) < self._need:
+                break
+            chunk = bytes(self._host[:self._need])
+            del self._host[:self._need]
+            try:
+                self._need = self._session.send(chunk)
+            except StopIteration:
+                self._session = None
+            if self._session is None and self._running:
+                # system reset requested by the command
+                self._system_reset()
+
+    def _system_reset(self):
+        """Software reset: the bootloader starts again if BOOT0 is high."""
+        boot0 = self._pins.get('boot0')
+        if boot0 is None or boot0.value == 1:
+            self._boot()
+        else:
+            self._session = None
+
+    def pop_reply(self, n):
+        """
+        Bytes sent to the host.
+        :param n: maximum number of bytes, None for everything
+        """
+        if n is None:
+            n = len(self._reply)
+        elif self._reply_at[:n]:
+            # wait for the last byte to be sent
+            self.clock = max(self.clock, self._reply_at[:n][-1])
+        data = bytes(self._reply[:n])
+        del self._reply[:n]
+        del self._reply_at[:n]
+        return data
+
+    def abort(self):
+        """
+        The host gave up waiting: discard the partially received frame and
+        wait for a new command.
+        """
+        if self._session is not None and self._baudrate is not None:
+            self._host.clear()
+            self._session = self._commands()
+            self._need = next(self._session)
+
+    def _send(self, *data, at=None):
+        """
+        Queue reply bytes.
+        :param at: time the bytes are sent, when it is later than the current
+            time (code running concurrently with the host). The clock is not
+            advanced then.
+        """
+        for item in data:
+            if isinstance(item, int):
+                item = bytes([item])
+            self._reply.extend(item)
+            if at is None:
+                self.elapse(self.wire_time(len(item), self._baudrate))
+                self._reply_at += [self.clock] * len(item)
+            else:
+                at = max(at, self.clock) + self.wire_time(len(item), self._baudrate)
+                self._reply_at += [at] * len(item)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # bootloader protocol
+    # ------------------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def _valid(frame):
+        """Check the XOR checksum ending a frame."""
+        return reduce(operator.xor, frame, 0) == 0
+
+    def _address(self, frame):
+        """Decode a 4 bytes address followed by its checksum, None if invalid."""
+        if not self._valid(frame):
+            return None
+        return struct.unpack(">I", frame[:4])[0]
+
+    def _bootloader(self):
+        """Bootloader session: wait for the synchronisation byte, then serve commands."""
+        while (yield 1)[0] != self.Command.SYNCHRONIZE:
+            pass
+        # autobaud: the line rate is locked on the synchronisation byte
+        self._baudrate = self._line
+        self._send(self.Reply.ACK)
+        yield from self._commands()
+
+    def _commands(self):
+        """Serve commands until a system reset."""
+        handlers = {
+            self.Command.GET: self._get,
+            self.Command.GET_VERSION: self._get_version,
+            self.Command.GET_ID: self._get_id,
+            self.Command.READ_MEMORY: self._read_memory,
+            self.Command.GO: self._go,
+            self.Command.WRITE_MEMORY: self._write_memory,
+            self.Command.ERASE: self._erase,
+            self.Command.EXTENDED_ERASE: self._extended_erase,
+            self.Command.WRITE_PROTECT: self._write_protect,
+            self.Command.WRITE_UNPROTECT: self._write_unprotect,
+            self.Command.READOUT_PROTECT: self._readout_protect,
+            self.Command.READOUT_UNPROTECT: self._readout_unprotect,
+            self.Command.GET_CHECKSUM: self._get_checksum,
+        }
+        while True:
+            command, complement = yield 2
+            if command ^ complement != 0xFF or command not in self.commands:
+                self._send(self.Reply.NACK)
+                continue
+            self.command_counts[command] += 1
+            fault = self._fault(command)
+            if fault == Fault.NACK:
+                self._send(self.Reply.NACK)
+                continue
+            if fault == Fault.TIMEOUT:
+                # never answer, the frame is discarded when the host times out
+                while True:
+                    yield 1
+            if fault == Fault.DROP:
+                self._drop = 1
+            if self.readout_protected and command in (self.Command.READ_MEMORY, self.Command.WRITE_MEMORY,
+                                                      self.Command.GO, self.Command.WRITE_PROTECT,
+                                                      self.Command.GET_CHECKSUM):
+                self._send(self.Reply.NACK)
+                continue
+            self._send(self.Reply.ACK)
+            if (yield from handlers[command]()):
+                # system reset
+                return
+
+    def _get(self):
+        self._send(len(self.commands), self.version, bytes(self.commands), self.Reply.ACK)
+        yield from ()
+
+    def _get_version(self):
+        self._send(self.version, 0, 0, self.Reply.ACK)
+        yield from ()
+
+    def _get_id(self):
+        self._send(1, struct.pack(">H", self.device_id), self.Reply.ACK)
+        yield from ()
+
+    def _read_memory(self):
+        address = self._address((yield 5))
+        if address is None:
+            self._send(self.Reply.NACK)
+            return False
+        self._send(self.Reply.ACK)
+        count, complement = yield 2
+        region = self._region(address, count + 1)
+        if count ^ complement != 0xFF or region is None:
+            self._send(self.Reply.NACK)
+            return False
+        self._send(self.Reply.ACK, self.read(address, count + 1))
+        return False
+
+    def _get_checksum(self):
+        address = self._address((yield 5))
+        if address is None or address % 4:
+            self._send(self.Reply.NACK)
+            return False
+        self._send(self.Reply.ACK)
+        length = self._address((yield 5))
+        if length is None or length % 4 or self._region(address, length) is None:
+            self._send(self.Reply.NACK)
+            return False
+        self._send(self.Reply.ACK)
+        # CRC peripheral: one word per cycle
+        self.elapse(length / 4 / self.CPU_FREQUENCY)
+        crc = struct.pack(">I", stm32_crc(self.read(address, length)))
+        self._send(crc, reduce(operator.xor, crc, 0))
+        return False
+
+    def _go(self):
+        address = self._address((yield 5))
+        region = self._region(address, 4) if address is not None else None
+        if region is None or not region.writable:
+            self._send(self.Reply.NACK)
+            return False
+        self._send(self.Reply.ACK)
+        session = self.jump(address)
+        if session is not None:
+            return (yield from session)
+        # the bootloader is left: ignore everything until the next reset
+        while True:
+            yield 1
+
+    def _loaded(self, address, code):
+        """Tell if the given code is in memory at the address."""
+        return self._region(address, len(code)) is not None and self.read(address, len(code)) == code
+
+    def jump(self, address):
+        """
+        Model code execution started by the Go command. The bootloader is
+        stopped; the CRC-32 stub and the flash loader are recognised and run,
+        other code is not.
+
+        Return the session of code serving the UART, None otherwise.
+
+        :param address: address sent with the Go command
+        """
+        code = address + Crc32Stub.HEADER_SIZE
+        # Go resets the peripherals used by the bootloader, the USART is off
+        self._baudrate = None
+        if self._loaded(code, FLASH_LOADER_CODE):
+            return self._flash_loader(code + len(FLASH_LOADER_CODE))
+        if self._loaded(code, CRC32_CODE):
+            self._run_crc32(code + len(CRC32_CODE))
+        return None
+
+    def _flash_loader(self, table):
+        """
+        Flash loader model: configure the USART with the register writes of
+        the table, program blocks until the zero length one, then request a
+        system reset.
+        """
+        usart, ring_size, registers = self._flash_loader_table(table)
+        rate = self._usart_rate(usart, registers)
+        if rate is None:
+            # the USART is not clocked or not connected: the stub never answers
+            while True:
+                yield 1
+        # the host line is received as long as the rates are close enough
+        self._baudrate = self._line if abs(rate - self._line) <= self.USART_TOLERANCE * self._line else rate
+        self._send(self.Reply.ACK)
+        # blocks are processed while the next ones are received
+        busy = self.clock
+        while True:
+            address, length, crc, _ = struct.unpack("<IIII", (yield FlashLoaderStub.FRAME_HEADER_SIZE))
+            if not length:
+                self._send(self.Reply.ACK, at=busy)
+                return True
+            data = yield length
+            busy = max(busy, self.clock) + length * Crc32Stub.CYCLES_PER_BYTE / self.CPU_FREQUENCY
+            if FlashLoaderStub.FRAME_HEADER_SIZE + length > ring_size:
+                # the block overwrites itself in the ring buffer
+                self._send(self.Reply.NACK, at=busy)
+                continue
+            if not self._program_block(address, data, crc):
+                self._send(self.Reply.NACK, at=busy)
+                continue
+            busy += self.program_time * length / 256
+            self._send(self.Reply.ACK, at=busy)
+
+    def _flash_loader_table(self, table):
+        """
+        Return the USART, the ring buffer size and the register values set
+        by the register writes of a flash loader parameter table.
+        :param table: table address
+        """
+        usart, _, _, ring_mask, count = struct.unpack("<IIIII", self.read(table, FlashLoaderStub.TABLE_SIZE))
+        registers = collections.defaultdict(int)
+        for index in range(count):
+            entry = table + FlashLoaderStub.TABLE_SIZE + index * FlashLoaderStub.REGISTER_WRITE_SIZE
+            register, clear, value = struct.unpack("<III", self.read(entry, FlashLoaderStub.REGISTER_WRITE_SIZE))
+            registers[register] = registers[register] & ~clear | value
+        return usart, ring_mask + 1, registers
+
+    def _program_block(self, address, data, crc):
+        """
+        Program a flash loader block, tell if it succeeded.
+        :param address: block address
+        :param data: block bytes
+        :param crc: CRC-32 of the block sent by the host
+        """
+        length = len(data)
+        offset = address - FLASH_BASE
+        if zlib.crc32(data) != crc or address % 8 or length % 8 or not self.flash.contains(address, length):
+            return False
+        pages = range(offset // self.page_size, (offset + length - 1) // self.page_size + 1)
+        erased = self.flash.data[offset: offset + length].count(0xFF) == length
+        if self.write_protected.intersection(pages) or not erased:
+            # programming of a protected or not erased double word fails
+            return False
+        self.flash.data[offset: offset + length] = data
+        return True
+
+    def _usart_rate(self, usart, registers):
+        """
+        Return the baud rate of the USART1 configured by the given register
+        values, None when it can not run with the bootloader frame format
+        (8E1) on PA9/PA10.
+        :param usart: USART base address
+        :param registers: register values by address
+        """
+        pins = FlashLoaderStub.USART1_PINS.get(self.description['Series'])
+        if pins is None or usart != FlashLoaderStub.USART1:
+            return None
+        rcc, gpio_enable, usart_enable, clock_select, gpio, function = pins
+        clocked = (registers[rcc] & 1 << 8 and registers[rcc + gpio_enable] & 1 << 0
+                   and registers[rcc + usart_enable] & 1 << 14 and registers[rcc + clock_select] & 0x3 == 0x2)
+        connected = registers[gpio] >> 18 & 0xF == 0xA and registers[gpio + 0x24] >> 4 & 0xFF == function * 0x11
+        # M0 and PCE (8 data bits, even parity), TE, RE and UE; 1 stop bit
+        framed = registers[usart] == 0x140D and registers[usart + 0x04] & 0x3000 == 0
+        brr = registers[usart + 0x0C]
+        if not (clocked and connected and framed and brr >= 16):
+            return None
+        return FlashLoaderStub.USART_CLOCK / brr
+
+    def _run_crc32(self, table):
+        """
+        CRC-32 stub model: fill the table, then request a system reset once
+        the modelled computation time has elapsed.
+        """
+        count = struct.unpack("<I", self.read(table + 4, 4))[0]
+        total = 0
+        for index in range(count):
+            entry = table + Crc32Stub.TABLE_HEADER_SIZE + index * Crc32Stub.ENTRY_SIZE
+            address, length = struct.unpack("<II", self.read(entry, 8))
+            if self._region(address, length) is None:
+                # bus fault: the core locks up, the bootloader never comes back
+                return
+            self._store(entry + 8, struct.pack("<I", zlib.crc32(self.read(address, length))))
+            total += length
+        self._store(table, struct.pack("<I", Crc32Stub.DONE))
+        self._reset_at = self.clock + total * Crc32Stub.CYCLES_PER_BYTE / self.CPU_FREQUENCY
+
+    def _write_memory(self):
+        address = self._address((yield 5))
+        region = self._region(address, 1) if address is not None else None
+        if region is None or not region.writable or address % 4 or \
+                (region is self.ram and address < self.ram_min):
+            self._send(self.Reply.NACK)
+            return False
+        self._send(self.Reply.ACK)
+        count = (yield 1)[0]
+        frame = yield count + 2
+        data = frame[:-1]
+        if not self._valid(bytes([count]) + frame) or not region.contains(address, len(data)):
+            self._send(self.Reply.NACK)
+            return False
+        offset = address - region.start
+        if region is self.flash:
+            pages = range(offset // self.page_size, (offset + len(data) - 1) // self.page_size + 1)
+            if self.write_protected.intersection(pages):
+                self._send(self.Reply.NACK)
+                return False
+            # programming can only clear bits
+            region.data[offset: offset + len(data)] = bytes(
+                a & b for a, b in zip(region.data[offset: offset + len(data)], data))
+            self.elapse(self.program_time)
+        else:
+            region.data[offset: offset + len(data)] = data
+        self._send(self.Reply.ACK)
+        return False
+
+    def erase_pages(self, pages):
+        """
+        Erase flash pages, return False if a page is out of range or protected.
+        :param pages: page indexes
+        """
+        count = len(self.flash.data) // self.page_size
+        if any(page >= count or page in self.write_protected for page in pages):
+            return False
+        for page in pages:
+            self.flash.data[page * self.page_size: (page + 1) * self.page_size] = b'\xff' * self.page_size
+            self.elapse(self.erase_page_time)
+        return True
+
+    def erase_bank(self, bank=None):
+        """
+        Erase one flash bank, or the whole flash memory.
+        :param bank: bank index starting at 0, None for mass erase.
+        """
+        size = len(self.flash.data) // self.banks
+        if bank is None:
+            self.flash.data[:] = b'\xff' * len(self.flash.data)
+        else:
+            self.flash.data[bank * size: (bank + 1) * size] = b'\xff' * size
+        self.elapse(self.erase_bank_time)
+
+    def _erase(self):
+        count = (yield 1)[0]
+        if count == 0xFF:
+            valid = (yield 1)[0] == 0x00
+            if valid:
+                self.erase_bank()
+        else:
+            frame = yield count + 2
+            valid = self._valid(bytes([count]) + frame) and self.erase_pages(frame[:-1])
+        self._send(self.Reply.ACK if valid else self.Reply.NACK)
+        return False
+
+    def _extended_erase(self):
+        header = yield 2
+        count = struct.unpack(">H", header)[0]
+        if count >= 0xFFF0:
+            valid = self._valid(header + (yield 1))
+            banks = {0xFFFF: None, 0xFFFE: 0, 0xFFFD: 1}
+            if count not in banks or (banks[count] or 0) >= self.banks:
+                valid = False
+            if valid:
+                self.erase_bank(banks[count])
+        else:
+            frame = yield 2 * (count + 1) + 1
+            pages = struct.unpack(f">{count + 1}H", frame[:-1])
+            valid = self._valid(header + frame) and self.erase_pages(pages)
+        self._send(self.Reply.ACK if valid else self.Reply.NACK)
+        return False
+
+    def _write_protect(self):
+        count = (yield 1)[0]
+        frame = yield count + 2
+        if not self._valid(bytes([count]) + frame):
+            self._send(self.Reply.NACK)
+            return False
+        self.write_protected.update(frame[:-1])
+        self._send(self.Reply.ACK)
+        return True
+
+    def _write_unprotect(self):
+        self.write_protected.clear()
+        self._send(self.Reply.ACK)
+        yield from ()
+        return True
+
+    def _readout_protect(self):
+        self.readout_protected = True
+        self._send(self.Reply.ACK)
+        yield from ()
+        return True
+
+    def _readout_unprotect(self):
+        self.erase_bank()
+        self.readout_protected = False
+        self._send(self.Reply.ACK)
+        yield from ()
+        return True
@@ -0,0 +1,507 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+"""
+Code run by the target from the bootloader RAM window
+
+A stub is position independent Thumb code limited to the ARMv6-M instruction
+set, so that it runs on every Cortex-M core. It is written in the bootloader
+RAM window and started with the Go command, which loads the stack pointer and
+the entry point from the first two words of the image. A parameter table
+follows the code.
+
+When done, the stub requests a system reset through the AIRCR register: BOOT0
+is still high, so the bootloader starts again, and results left in RAM are
+read back with the Read Memory command.
+"""
+import struct
+import zlib
+
+CRC32_CODE = bytes.fromhex(
+    "17a77e680837124b002e15d039687a688a180020c04308e00c78013160400825"
+    "400800d35840013dfad19142f4d1c043b8600c37013ee7e709a706483860bff3"
+    "4f8f054905480860bff34f8ffee700bf2083b8ed444352430ced00e00400fa05")
+"""
+CRC-32 of memory regions (IEEE 802.3 polynomial, same value as
+``zlib.crc32``), computed bit by bit::
+
+        adr  r7, table          ; status, count, count x (start, length, crc)
+        ldr  r6, [r7, #4]
+        adds r7, #8
+        ldr  r3, poly
+    region:
+        cmp  r6, #0
+        beq  done
+        ldr  r1, [r7, #0]
+        ldr  r2, [r7, #4]
+        adds r2, r1, r2
+        movs r0, #0
+        mvns r0, r0
+        b    test
+    byte:
+        ldrb r4, [r1]
+        adds r1, #1
+        eors r0, r4
+        movs r5, #8
+    bit:
+        lsrs r0, r0, #1
+        bcc  skip
+        eors r0, r3
+    skip:
+        subs r5, #1
+        bne  bit
+    test:
+        cmp  r1, r2
+        bne  byte
+        mvns r0, r0
+        str  r0, [r7, #8]
+        adds r7, #12
+        subs r6, #1
+        b    region
+    done:
+        adr  r7, table
+        ldr  r0, magic
+        str  r0, [r7, #0]
+        dsb  sy
+        ldr  r1, aircr
+        ldr  r0, reset
+        str  r0, [r1, #0]       ; SYSRESETREQ
+        dsb  sy
+    hang:
+        b    hang
+        .align 2
+    poly:  .word 0xEDB88320
+    magic: .word 0x43524344
+    aircr: .word 0xE000ED0C
+    reset: .word 0x05FA0004
+    table:
+"""
+
+
+FLASH_LOADER_CODE = bytes.fromhex(
+    "66a73b691422d219002b06d013ca05688d4325430560013bf6e73e6800250024"
+    "7b685869002803da5648986056489860792000f09cf800f089f8804600f086f8"
+    "814600f083f8824600f080f84846002850d020188346281b484502d200f058f8"
+    "f9e70022d24300234b4510d000f050f8f968e0180840b968085c424040490820"
+    "520800d34a400138fad10133ece7d243524525d17b683d481861586901210843"
+    "58614246f96820460840b968091808681060486850600834083200f029f81869"
+    "c003fad418693249084207d15c45e9d100f00bf8792000f04af8ace700f005f8"
+    "5c461f2000f043f8a5e758690121884358617047792000f03af8f0694006fcd5"
+    "bff34f8f234924480860bff34f8ffee7f069010701d508213162800608d5706a"
+    "04b4f9682a460a40b968885404bc0135704700b5a54202d1fff7eafffae7f968"
+    "22460a40b968885c013400bd00b5fff7f0ff0346fff7edff00020343fff7e9ff"
+    "00040343fff7e5ff0006184300bd00b50246fff7cdfff0690006fad5b26200bd"
+    "2083b8ed23016745ab89efcdfbc30000fac300000ced00e00400fa05")
+"""
+Flash loader for the STM32L4 and STM32G0 flash controllers (double word
+programming). The Go command resets the peripherals used by the bootloader,
+so the stub first configures the USART again from the register writes of its
+parameter table (clocks, pins, baud rate, 8E1 frame format). The USART is then
+polled for the whole run and received bytes are stored in a ring buffer, also
+while the CRC is computed and while the flash is busy, so that the host can
+send several blocks ahead. Each block is a 16 bytes header (address, length,
+CRC-32, reserved, as little endian words) followed by the data; it is
+acknowledged once programmed, or refused when the CRC does not match or the
+flash controller reports an error. A zero length block ends the transfer with
+a system reset::
+
+    entry:
+        adr  r7, table          ; USART, flash controller, ring address, ring mask,
+        ldr  r3, [r7, #16]      ; count, count x (register, clear mask, set mask)
+        movs r2, #20
+        adds r2, r2, r7
+    init:
+        cmp  r3, #0
+        beq  init_done
+        ldm  r2!, {r0, r1, r4}
+        ldr  r5, [r0, #0]
+        bics r5, r1
+        orrs r5, r4
+        str  r5, [r0, #0]
+        subs r3, #1
+        b    init
+    init_done:
+        ldr  r6, [r7, #0]
+        movs r5, #0             ; bytes received
+        movs r4, #0             ; bytes consumed
+        ldr  r3, [r7, #4]
+        ldr  r0, [r3, #0x14]
+        cmp  r0, #0
+        bge  unlocked
+        ldr  r0, key1
+        str  r0, [r3, #8]
+        ldr  r0, key2
+        str  r0, [r3, #8]
+    unlocked:
+        movs r0, #0x79
+        bl   putbyte
+    block:
+        bl   getword
+        mov  r8, r0
+        bl   getword
+        mov  r9, r0
+        bl   getword
+        mov  r10, r0
+        bl   getword
+        mov  r0, r9
+        cmp  r0, #0
+        beq  finish
+        adds r0, r4, r0
+        mov  r11, r0
+    wait_data:
+        subs r0, r5, r4
+        cmp  r0, r9
+        bhs  check
+        bl   service
+        b    wait_data
+    check:
+        movs r2, #0
+        mvns r2, r2
+        movs r3, #0
+    crc_byte:
+        cmp  r3, r9
+        beq  crc_done
+        bl   service
+        ldr  r1, [r7, #12]
+        adds r0, r4, r3
+        ands r0, r1
+        ldr  r1, [r7, #8]
+        ldrb r0, [r1, r0]
+        eors r2, r0
+        ldr  r1, poly
+        movs r0, #8
+    crc_bit:
+        lsrs r2, r2, #1
+        bcc  crc_skip
+        eors r2, r1
+    crc_skip:
+        subs r0, #1
+        bne  crc_bit
+        adds r3, #1
+        b    crc_byte
+    crc_done:
+        mvns r2, r2
+        cmp  r2, r10
+        bne  nack
+        ldr  r3, [r7, #4]
+        ldr  r0, sr_clear
+        str  r0, [r3, #0x10]
+        ldr  r0, [r3, #0x14]
+        movs r1, #1
+        orrs r0, r1
+        str  r0, [r3, #0x14]
+        mov  r2, r8
+    dword:
+        ldr  r1, [r7, #12]
+        mov  r0, r4
+        ands r0, r1
+        ldr  r1, [r7, #8]
+        adds r1, r1, r0
+        ldr  r0, [r1, #0]
+        str  r0, [r2, #0]
+        ldr  r0, [r1, #4]
+        str  r0, [r2, #4]
+        adds r4, #8
+        adds r2, #8
+    wait_bsy:
+        bl   service
+        ldr  r0, [r3, #0x10]
+        lsls r0, r0, #15
+        bmi  wait_bsy
+        ldr  r0, [r3, #0x10]
+        ldr  r1, sr_errors
+        tst  r0, r1
+        bne  program_error
+        cmp  r4, r11
+        bne  dword
+        bl   program_end
+        movs r0, #0x79
+        bl   putbyte
+        b    block
+    program_error:
+        bl   program_end
+    nack:
+        mov  r4, r11
+        movs r0, #0x1F
+        bl   putbyte
+        b    block
+    program_end:
+        ldr  r0, [r3, #0x14]
+        movs r1, #1
+        bics r0, r1
+        str  r0, [r3, #0x14]
+        bx   lr
+    finish:
+        movs r0, #0x79
+        bl   putbyte
+    wait_tc:
+        ldr  r0, [r6, #0x1C]
+        lsls r0, r0, #25
+        bpl  wait_tc
+        dsb  sy
+        ldr  r1, aircr
+        ldr  r0, reset
+        str  r0, [r1, #0]
+        dsb  sy
+    hang:
+        b    hang
+    service:
+        ldr  r0, [r6, #0x1C]
+        lsls r1, r0, #28
+        bpl  service_rx
+        movs r1, #8
+        str  r1, [r6, #0x20]
+    service_rx:
+        lsls r0, r0, #26
+        bpl  service_end
+        ldr  r0, [r6, #0x24]
+        push {r2}
+        ldr  r1, [r7, #12]
+        mov  r2, r5
+        ands r2, r1
+        ldr  r1, [r7, #8]
+        strb r0, [r1, r2]
+        pop  {r2}
+        adds r5, #1
+    service_end:
+        bx   lr
+    getbyte:
+        push {lr}
+    getbyte_wait:
+        cmp  r5, r4
+        bne  getbyte_ready
+        bl   service
+        b    getbyte_wait
+    getbyte_ready:
+        ldr  r1, [r7, #12]
+        mov  r2, r4
+        ands r2, r1
+        ldr  r1, [r7, #8]
+        ldrb r0, [r1, r2]
+        adds r4, #1
+        pop  {pc}
+    getword:
+        push {lr}
+        bl   getbyte
+        mov  r3, r0
+        bl   getbyte
+        lsls r0, r0, #8
+        orrs r3, r0
+        bl   getbyte
+        lsls r0, r0, #16
+        orrs r3, r0
+        bl   getbyte
+        lsls r0, r0, #24
+        orrs r0, r3
+        pop  {pc}
+    putbyte:
+        push {lr}
+        mov  r2, r0
+    putbyte_wait:
+        bl   service
+        ldr  r0, [r6, #0x1C]
+        lsls r0, r0, #24
+        bpl  putbyte_wait
+        str  r2, [r6, #0x28]
+        pop  {pc}
+        .align 2
+    poly:      .word 0xEDB88320
+    key1:      .word 0x45670123
+    key2:      .word 0xCDEF89AB
+    sr_clear:  .word 0x0000C3FB
+    sr_errors: .word 0x0000C3FA
+    aircr:     .word 0xE000ED0C
+    reset:     .word 0x05FA0004
+    table:
+"""
+
+
+class Crc32Stub:
+    """
+    Image of the CRC-32 stub for a RAM window.
+    """
+
+    DONE = 0x43524344
+    """Status word written by the stub once every region is computed."""
+    CYCLES_PER_BYTE = 50
+    """Approximate cost of the bit per bit loop."""
+    HEADER_SIZE = 8
+    """Initial stack pointer and entry point, read by the Go command."""
+    TABLE_HEADER_SIZE = 8
+    """Status and region count."""
+    ENTRY_SIZE = 12
+    """Start address, length and CRC of a region."""
+
+    def __init__(self, start, end):
+        """
+        :param start: first address of the RAM window
+        :param end: last address of the RAM window
+        """
+        self.address = (start + 3) & ~3
+        self.stack = (end + 1) & ~7
+        self.table_address = self.address + self.HEADER_SIZE + len(CRC32_CODE)
+        self.capacity = (self.stack - self.table_address - self.TABLE_HEADER_SIZE) // self.ENTRY_SIZE
+
+    def table_size(self, count):
+        """
+        Size of the parameter table.
+        :param count: number of regions
+        """
+        return self.TABLE_HEADER_SIZE + count * self.ENTRY_SIZE
+
+    def image(self, regions):
+        """
+        Return the stub image to load at :attr:`address`.
+        :param regions: list of (address, length), at most :attr:`capacity`
+        """
+        if len(regions) > self.capacity:
+            raise ValueError(f"Too many regions for the RAM window: {len(regions)} > {self.capacity}.")
+        header = struct.pack("<II", self.stack, self.address + self.HEADER_SIZE + 1)
+        table = struct.pack("<II", 0, len(regions))
+        table += b''.join(struct.pack("<III", address, length, 0) for address, length in regions)
+        return header + CRC32_CODE + table
+
+    def results(self, table):
+        """
+        Return the CRC of each region from the table read back.
+        :param table: parameter table bytes
+        """
+        status, count = struct.unpack_from("<II", table)
+        if status != self.DONE:
+            raise ValueError(f"Checksum stub did not complete (status 0x{status:08X}).")
+        return [struct.unpack_from("<I", table, self.TABLE_HEADER_SIZE + index * self.ENTRY_SIZE + 8)[0]
+                for index in range(count)]
+
+
+class FlashLoaderStub:
+    """
+    Image and block frames of the flash loader for a RAM window.
+    """
+
+    FLASH_CONTROLLERS = {'STM32L4': 0x40022000, 'STM32G0': 0x40022000}
+    """Flash controller base address of the series the flash loader supports."""
+    USART1 = 0x40013800
+    """USART1, on PA9/PA10, the only USART the flash loader configures."""
+    USART1_PINS = {
+        'STM32L4': (0x40021000, 0x4C, 0x60, 0x88, 0x48000000, 7),
+        'STM32G0': (0x40021000, 0x34, 0x40, 0x54, 0x50000000, 1),
+    }
+    """
+    RCC base, GPIO clock enable, USART1 clock enable and kernel clock
+    selection register offsets, GPIOA base and PA9/PA10 alternate function of
+    the series the flash loader supports.
+    """
+    USART_CLOCK = 16000000
+    """HSI16, selected as USART1 kernel clock by the flash loader."""
+    USART_CR1 = 0x140D
+    """9 bits words with even parity (8E1), TE, RE and UE."""
+    HEADER_SIZE = 8
+    """Initial stack pointer and entry point, read by the Go command."""
+    TABLE_SIZE = 20
+    """USART, flash controller, ring buffer address, ring buffer mask and register writes count."""
+    REGISTER_WRITE_SIZE = 12
+    """Register, clear mask and set mask of a register write."""
+    FRAME_HEADER_SIZE = 16
+    """Address, length, CRC-32 and reserved word of a block."""
+    BLOCK_SIZE = 1024
+    """Data bytes per block."""
+    ALIGNMENT = 8
+    """Double word programming."""
+    STACK_SIZE = 256
+    """RAM kept for the stack, at the end of the window."""
+
+    def __init__(self, series, start, end, usart, baudrate):
+        """
+        :param series: device series, one of FLASH_CONTROLLERS
+        :param start: first address of the RAM window
+        :param end: last address of the RAM window
+        :param usart: base address of the USART used by the bootloader, USART1
+        :param baudrate: baud rate negotiated with the bootloader
+        """
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        if usart != self.USART1:
+            raise ValueError(f"The flash loader only configures USART1, not 0x{usart:08X}.")
+        self.flash_controller = self.FLASH_CONTROLLERS[series]
+        self.usart = usart
+        self.registers = self.usart_setup(series, usart, baudrate)
+        self.address = (start + 3) & ~3
+        self.stack = (end + 1) & ~7
+        self.table_address = self.address + self.HEADER_SIZE + len(FLASH_LOADER_CODE)
+        table_size = self.TABLE_SIZE + len(self.registers) * self.REGISTER_WRITE_SIZE
+        self.ring_address = (self.table_address + table_size + 7) & ~7
+        space = self.stack - self.STACK_SIZE - self.ring_address
+        # power of two, for the index mask
+        self.ring_size = 1 << (space.bit_length() - 1) if space > 0 else 0
+        if self.ring_size < self.FRAME_HEADER_SIZE + self.BLOCK_SIZE:
+            raise ValueError(f"RAM window too small for the flash loader: 0x{start:08X}-0x{end:08X}.")
+
+    @classmethod
+    def brr(cls, baudrate):
+        """
+        Return the USART BRR value of a baud rate.
+        :param baudrate: baud rate
+        """
+        return (cls.USART_CLOCK + baudrate // 2) // baudrate
+
+    @classmethod
+    def usart_setup(cls, series, usart, baudrate):
+        """
+        Return the (register, clear mask, set mask) writes configuring the
+        USART as the bootloader did: HSI16 and GPIOA, USART1 clocks, PA9/PA10
+        alternate function, baud rate and 8E1 frame format.
+        :param series: device series, one of USART1_PINS
+        :param usart: USART base address
+        :param baudrate: baud rate
+        """
+        rcc, gpio_enable, usart_enable, clock_select, gpio, function = cls.USART1_PINS[series]
+        return [(rcc, 0, 1 << 8),                                   # RCC_CR: HSION
+                (rcc + gpio_enable, 0, 1 << 0),                     # GPIOAEN
+                (rcc + usart_enable, 0, 1 << 14),                   # USART1EN
+                (rcc + clock_select, 0x3, 0x2),                     # USART1SEL: HSI16
+                (gpio, 0xF << 18, 0xA << 18),                       # MODER: PA9/PA10 alternate function
+                (gpio + 0x24, 0xFF << 4, function * 0x11 << 4),     # AFRH: PA9/PA10
+                (usart, 0xFFFFFFFF, 0),                             # CR1: disabled
+                (usart + 0x04, 0xFFFFFFFF, 0),                      # CR2: 1 stop bit
+                (usart + 0x08, 0xFFFFFFFF, 0),                      # CR3
+                (usart + 0x0C, 0xFFFFFFFF, cls.brr(baudrate)),      # BRR
+                (usart, 0, cls.USART_CR1)]                          # CR1: 8E1, enabled
+
+    @classmethod
+    def supports(cls, series):
+        """
+        Tell if the flash loader can program the given series.
+        :param series: device series
+        """
+        return series in cls.FLASH_CONTROLLERS
+
+    def image(self):
+        """Return the flash loader image to load at :attr:`address`."""
+        header = struct.pack("<II", self.stack, self.address + self.HEADER_SIZE + 1)
+        table = struct.pack("<IIIII", self.usart, self.flash_controller, self.ring_address, self.ring_size - 1,
+                            len(self.registers))
+        table += b''.join(struct.pack("<III", *write) for write in self.registers)
+        return header + FLASH_LOADER_CODE + table
+
+    def blocks(self, segments, skip_blank=False):
+        """
+        Split double word aligned segments into blocks.
+        :param segments: list of (address, data), aligned on ALIGNMENT
+        :param skip_blank: leave out blocks made only of 0xFF bytes
+        """
+        for address, data in segments:
+            for offset in range(0, len(data), self.BLOCK_SIZE):
+                block = data[offset: offset + self.BLOCK_SIZE]
+                if skip_blank and block.count(0xFF) == len(block):
+                    continue
+                yield address + offset, block
+
+    @classmethod
+    def frame(cls, address, data):
+        """
+        Return a block frame, a zero length block ends the transfer.
+        :param address: block address
+        :param data: block bytes
+        """
+        return struct.pack("<IIII", address, len(data), zlib.crc32(data), 0) + bytes(data)
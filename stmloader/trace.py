@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+"""
+UART traces: record the byte exchange with a bootloader, replay it
+
+:class:`RecordingUART` wraps ``scaffold.uart0`` and logs every transmit,
+receive and flush with its time into a binary trace. :class:`ReplayScaffold`
+stands for the board and feeds :class:`stmloader.bootloader.STM32` from such a
+trace, without hardware.
+
+A trace is the ``STMTRACE`` magic and a version byte, followed by records made
+of a kind byte, the time elapsed since the previous record in microseconds
+(4 bytes) and the payload length (4 bytes), little-endian, then the payload.
+
+The replay matches the bytes sent by the loader against the recorded ones, as
+a stream. Each received byte is given back once the loader has sent what had
+been sent before it was received; asking for more raises the Scaffold timeout
+exception, as the silent device did. The loader may thus gather transmissions
+that the recorded run made one by one, not split a recorded transmission
+whose reply it waits for.
+"""
+import struct
+import time
+
+import scaffold
+
+from .bootloader import STM32, STM32Error
+from .simulator import Signal
+
+MAGIC = b'STMTRACE'
+VERSION = 1
+RECORD = struct.Struct('<BII')
+"""Kind, microseconds since the previous record and payload length."""
+TRANSMIT = 1
+RECEIVE = 2
+TIMEOUT = 3
+"""Receive ended by a timeout, the payload holds the bytes received."""
+FLUSH = 4
+BAUDRATE = 5
+"""Baud rate change, the payload holds the rate on 4 bytes."""
+KINDS = {TRANSMIT: 'transmit', RECEIVE: 'receive', TIMEOUT: 'timeout', FLUSH: 'flush', BAUDRATE: 'baudrate'}
+
+
+class TraceError(STM32Error, ValueError):
+    """
+    Exception: invalid trace, or loader diverging from the trace it replays.
+    """
+
+
+class TraceWriter:
+    """
+    Writer of trace records into a binary stream.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, stream):
+        """
+        :param stream: binary stream, e.g. a file open in 'wb' mode
+        """
+        self.stream = stream
+        self.last = time.perf_counter()
+        stream.write(MAGIC + bytes([VERSION]))
+
+    def write(self, kind, payload=b''):
+        """
+        Write a record, timed now.
+        :param kind: record kind, e.g. TRANSMIT
+        :param payload: record bytes
+        """
+        now = time.perf_counter()
+        delta = min(int((now - self.last) * 1e6), 0xFFFFFFFF)
+        self.last = now
+        self.stream.write(RECORD.pack(kind, delta, len(payload)))
+        self.stream.write(payload)
+
+
+def read_trace(stream):
+    """
+    Return the records of a trace as (kind, time in seconds since the
+    start, payload) tuples.
+    :param stream: binary stream
+    """
+    header = stream.read(len(MAGIC) + 1)
+    if header[:len(MAGIC)] != MAGIC:
+        raise TraceError("Not a stmloader trace.")
+    if header[len(MAGIC)] != VERSION:
+        raise TraceError(f"Unsupported trace version {header[len(MAGIC)]}.")
+    records = []
+    clock = 0
+    while True:
+        head = stream.read(RECORD.size)
+        if not head:
+            return records
+        if len(head) < RECORD.size:
+            raise TraceError("Truncated trace record.")
+        kind, delta, length = RECORD.unpack(head)
+        payload = stream.read(length)
+        if len(payload) < length or kind not in KINDS:
+            raise TraceError(f"Invalid trace record at {clock / 1e6:.6f}s.")
+        clock += delta
+        records.append((kind, clock / 1e6, payload))
+
+
+class RecordingUART:
+    """
+    Scaffold UART wrapper recording the exchange into a trace. Other
+    attributes are the ones of the wrapped UART.
+    """
+
+    def __init__(self, uart, stream):
+        """
+        :param uart: Scaffold UART, e.g. ``scaffold.uart0``
+        :param stream: binary stream the trace is written to
+        """
+        self.__dict__['uart'] = uart
+        self.__dict__['writer'] = TraceWriter(stream)
+
+    def __getattr__(self, name):
+        return getattr(self.uart, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.uart, name, value)
+        if name == 'baudrate':
+            self.writer.write(BAUDRATE, struct.pack('<I', value))
+
+    def transmit(self, data, trigger=False):
+        """
+        Transmit data, see ``scaffold.UART.transmit``.
+        :param data: bytes to send
+        :param trigger: enable trigger
+        """
+        self.uart.transmit(data, trigger)
+        self.writer.write(TRANSMIT, bytes(data))
+
+    def receive(self, n=1):
+        """
+        Receive data, see ``scaffold.UART.receive``.
+        :param n: number of bytes to receive
+        """
+        try:
+            data = self.uart.receive(n)
+        except scaffold.TimeoutError as exc:
+            self.writer.write(TIMEOUT, bytes(exc.data or b''))
+            raise
+        self.writer.write(RECEIVE, bytes(data))
+        return data
+
+    def flush(self):
+        """Discard the received bytes, see ``scaffold.UART.flush``."""
+        self.uart.flush()
+        self.writer.write(FLUSH)
+
+
+def record(board, stream):
+    """
+    Make a Scaffold board record its UART exchange. To be called before the
+    loader is created.
+    :param board: Scaffold instance
+    :param stream: binary stream the trace is written to
+    """
+    board.uart0 = RecordingUART(board.uart0, stream)
+    return board
+
+
+class ReplayUART:
+    """
+    Scaffold UART stand-in giving back the bytes of a trace.
+    """
+
+    def __init__(self, parent, records):
+        """
+        :param parent: :class:`ReplayScaffold` owning the UART
+        :param records: trace records, see :func:`read_trace`
+        """
+        self.parent = parent
+        self.rx = Signal("rx")
+        self.tx = Signal("tx")
+        self.baudrate = STM32.BAUDRATE_DEFAULT
+        self.expected = bytearray()
+        """Bytes the loader sent in the recorded run, in order."""
+        self.replies = []
+        """(bytes sent before, byte, time) of each byte received in the recorded run."""
+        self.sent = 0
+        self.received = 0
+        for kind, clock, payload in records:
+            if kind == TRANSMIT:
+                self.expected += payload
+            elif kind in (RECEIVE, TIMEOUT):
+                self.replies += [(len(self.expected), byte, clock) for byte in payload]
+
+    def transmit(self, data, trigger=False):
+        """
+        Match the bytes sent against the trace.
+        :param data: bytes to send
+        :param trigger: ignored
+        """
+        # pylint: disable=unused-argument
+        data = bytes(data)
+        expected = bytes(self.expected[self.sent: self.sent + len(data)])
+        if data != expected:
+            raise TraceError(f"Byte {self.sent} sent differs from the trace: {data.hex()} instead of "
+                             f"{expected.hex() or 'nothing'}.")
+        self.sent += len(data)
+
+    def _available(self):
+        """Return the number of bytes the device had sent at this point of the recorded run."""
+        count = self.received
+        while count < len(self.replies) and self.replies[count][0] <= self.sent:
+            count += 1
+        return count - self.received
+
+    def receive(self, n=1):
+        """
+        Give back the bytes received in the recorded run. The Scaffold
+        timeout exception is raised when the device had sent fewer bytes.
+        :param n: number of bytes to receive
+        """
+        count = min(n, self._available())
+        data = bytes(byte for _, byte, _ in self.replies[self.received: self.received + count])
+        if count:
+            self.parent.clock = max(self.parent.clock, self.replies[self.received + count - 1][2])
+        self.received += count
+        if count < n:
+            raise scaffold.TimeoutError(data=data)
+        return data
+
+    def flush(self):
+        """
+        Nothing to discard: the bytes the recorded run flushed were never
+        received, hence not recorded.
+        """
+
+    @property
+    def done(self):
+        """True when every byte of the trace has been sent and received."""
+        return self.sent == len(self.expected) and self.received == len(self.replies)
+
+
+class _Power:
+    """Scaffold power module stand-in."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.dut = 0
+        self.platform = 1
+
+
+class ReplayScaffold:
+    """
+    Drop-in replacement for ``scaffold.Scaffold`` replaying a trace.
+    """
+
+    # pylint: disable=invalid-name,too-many-instance-attributes,too-few-public-methods
+
+    def __init__(self, records):
+        """
+        :param records: trace records, see :func:`read_trace`
+        """
+        self.timeout = 1
+        self.clock = 0.0
+        """Recorded time of the last byte given back, in seconds."""
+        self.power = _Power()
+        self.d0, self.d1, self.d2, self.d3, self.d4, self.d5, self.d6, self.d7 = (
+            Signal(f"d{index}") for index in range(8))
+        self.uart0 = ReplayUART(self, records)
+
+    @classmethod
+    def from_file(cls, name):
+        """
+        Return a board replaying a trace file.
+        :param name: trace file name
+        """
+        with open(name, 'rb') as stream:
+            return cls(read_trace(stream))
+
+
+def breakdown(records):
+    """
+    Return the time spent waiting for the device, by command, as a
+    dictionary of command name to [count, seconds]. A wait runs from the end
+    of a transmission to the end of the receive following it; it is counted
+    for the last command sent before it.
+    :param records: trace records, see :func:`read_trace`
+    """
+    codes = {value for name, value in vars(STM32.Command).items() if not name.startswith('_')}
+    waits = {}
+    command = None
+    sent = None
+    for kind, clock, payload in records:
+        if kind == TRANSMIT:
+            if len(payload) >= 2 and payload[0] in codes and payload[0] ^ payload[1] == 0xFF:
+                command = STM32.command_name(payload[0])
+            elif payload in (b'\x7f', b'\x00\x7f'):
+                command = 'SYNCHRONIZE'
+            sent = clock
+        elif kind in (RECEIVE, TIMEOUT) and sent is not None:
+            totals = waits.setdefault(command or 'unknown', [0, 0.0])
+            totals[0] += 1
+            totals[1] += clock - sent
+            sent = None
+    return waits
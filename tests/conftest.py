@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Shared fixtures
+"""
+import io
+import os
+import shutil
+import threading
+import pytest
+import scaffold
+from serial.serialutil import SerialException
+from stmloader import bootloader
+from stmloader.bootloader import STM32
+from stmloader.daemon import Board, Daemon
+from stmloader.index import DATA_PATH
+from stmloader.simulator import SimulatedScaffold, SimulatedTarget
+from stmloader.trace import read_trace, record
+
+
+@pytest.fixture
+def connect(monkeypatch):
+    """
+    Return a factory creating a loader connected to a simulated target, reset
+    in bootloader mode. Waits of the loader advance the modelled clock.
+    """
+    def factory(device_id=0x415, baudrate=STM32.BAUDRATE_DEFAULT, **kwargs):
+        target = SimulatedTarget.from_device_id(device_id, **kwargs)
+        board = SimulatedScaffold(target)
+        monkeypatch.setattr(bootloader, "sleep", board.sleep)
+        loader = STM32(board, verbosity=0, baudrate=baudrate)
+        loader.reset_from_system_memory(0)
+        return loader, target
+    return factory
+
+
+@pytest.fixture
+def cli_target(monkeypatch):
+    """
+    Return a factory making the cli open simulated boards instead of scaffold
+    ones. The factory returns the simulated target.
+    """
+    def factory(device_id=0x415, **kwargs):
+        target = SimulatedTarget.from_device_id(device_id, **kwargs)
+        simulated = SimulatedScaffold(target)
+        monkeypatch.setattr(bootloader, "sleep", simulated.sleep)
+        monkeypatch.setattr(scaffold, "Scaffold", lambda port: simulated)
+        return target
+    return factory
+
+
+@pytest.fixture
+def cli_boards(monkeypatch):
+    """
+    Return a factory making the cli open one simulated board per port name.
+    Other ports cannot be opened. The factory returns the simulated targets
+    by port name. Boards run concurrently, the waits of the loader are
+    skipped.
+    """
+    def factory(*ports, device_id=0x415, **kwargs):
+        targets = {port: SimulatedTarget.from_device_id(device_id, **kwargs) for port in ports}
+        boards = {port: SimulatedScaffold(target) for port, target in targets.items()}
+
+        def open_board(port):
+            if port not in boards:
+                raise SerialException(f"could not open port {port}")
+            return boards[port]
+        monkeypatch.setattr(bootloader, "sleep", lambda seconds: None)
+        monkeypatch.setattr(scaffold, "Scaffold", open_board)
+        return targets
+    return factory
+
+
+@pytest.fixture
+def descriptions(tmp_path):
+    """
+    Return a folder holding a copy of two device descriptions
+    """
+    for name in ("stm32_0x415.yml", "stm32_0x460.yml"):
+        shutil.copy(os.path.join(DATA_PATH, name), tmp_path / name)
+    return tmp_path
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    """
+    Return the trace of a session with a simulated 0x460 device, and the
+    device
+    """
+    target = SimulatedTarget.from_device_id(0x460, startup_time=0.1)
+    board = SimulatedScaffold(target)
+    monkeypatch.setattr(bootloader, "sleep", board.sleep)
+    stream = io.BytesIO()
+    loader = STM32(record(board, stream), verbosity=0)
+    loader.reset_from_system_memory(1)
+    loader.erase_pages([0])
+    # one Write Memory command at a time
+    loader.write_memory(0x08000000, bytes(range(256)))
+    loader.write_memory(0x08000100, bytes(range(256)))
+    assert loader.read_memory_data(0x08000000, 512) == bytes(range(256)) * 2
+    stream.seek(0)
+    return read_trace(stream), target
+
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    """
+    Return a factory starting a daemon serving simulated boards, one per port
+    name, in a thread. The factory returns the socket path and the daemon.
+    Waits of the loaders are skipped.
+    """
+    servers = []
+
+    def factory(*ports, device_id=0x415, **kwargs):
+        monkeypatch.setattr(bootloader, "sleep", lambda seconds: None)
+        boards = {port: Board(STM32(SimulatedScaffold(SimulatedTarget.from_device_id(device_id, **kwargs)),
+                                    verbosity=0), 0)
+                  for port in ports}
+        server = Daemon(boards, str(tmp_path / "daemon.sock"))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.path, server
+    yield factory
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -26,7 +26,7 @@ def test_reset_no_args():
     """
     result = runner.invoke(boot_app, ['reset'])
     assert result.exit_code == 0
-    assert "Consider to change reset startup time with option --timeout/-t" in result.stdout
+    assert "Chip id: 0x415" in result.stdout
 
 
 def test_reset_good_timeout():
@@ -44,7 +44,7 @@ def test_reset_system_short_no_args():
     """
     result = runner.invoke(boot_app, ['reset', '-m', 'system'])
     assert result.exit_code == 0
-    assert "Consider to change reset startup time with option --timeout/-t" in result.stdout
+    assert "Chip id: 0x415" in result.stdout
 
 
 def test_reset_system_long_no_args():
@@ -53,7 +53,7 @@ def test_reset_system_long_no_args():
     """
     result = runner.invoke(boot_app, ['reset', '--mode', 'system'])
     assert result.exit_code == 0
-    assert "Consider to change reset startup time with option --timeout/-t" in result.stdout
+    assert "Chip id: 0x415" in result.stdout
 
 
 def test_reset_system_short_good_timeout():
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test the asyncio front end against simulated bootloaders
+"""
+import asyncio
+import os
+import pytest
+from stmloader.aio import AsyncSTM32
+from stmloader.bootloader import CommandError
+from stmloader.simulator import SimulatedScaffold, SimulatedTarget
+
+
+def async_loader(device_id=0x415, **kwargs):
+    """
+    Return an asynchronous loader connected to a simulated target, and the target.
+    """
+    target = SimulatedTarget.from_device_id(device_id, **kwargs)
+    return AsyncSTM32(SimulatedScaffold(target), verbosity=0), target
+
+
+def test_write_read():
+    """
+    reset, write, read back and go on one target
+    """
+    loader, target = async_loader()
+    data = os.urandom(0x300)
+
+    async def job():
+        await loader.reset_from_system_memory(0)
+        await loader.write_memory_data(0x08000000, data)
+        assert await loader.read_memory_data(0x08000000, len(data)) == data
+        assert await loader.get_id() == 0x415
+        await loader.go(0x08000000)
+    asyncio.run(job())
+    assert target.read(0x08000000, len(data)) == data
+
+
+def test_erase():
+    """
+    pages are erased with the command supported by the bootloader
+    """
+    loader, target = async_loader(0x460)
+    target.flash.data[:0x1000] = b'\x00' * 0x1000
+
+    async def job():
+        await loader.reset_from_system_memory(0)
+        await loader.erase_pages([0])
+    asyncio.run(job())
+    assert target.read(0x08000000, 0x1000) == b'\xff' * 0x800 + b'\x00' * 0x800
+
+
+def test_read_instrumented():
+    """
+    reads recorded in the metrics and reported to the progress callback
+    """
+    loader, _ = async_loader()
+    calls = []
+    loader.loader.progress = lambda *args: calls.append(args)
+
+    async def job():
+        await loader.reset_from_system_memory(0)
+        return await loader.read_memory_data(0x08000000, 600)
+    assert asyncio.run(job()) == b'\xff' * 600
+    assert calls[-1][:2] == (600, 600)
+    assert loader.loader.metrics.as_dict()['transfers']['read']['bytes'] == 600
+    assert loader.loader.metrics.commands['READ_MEMORY'] == 3
+
+
+def test_reset_waits_overlap(monkeypatch):
+    """
+    the reset waits of several targets are awaited concurrently
+    """
+    loaders = [async_loader()[0] for _ in range(4)]
+    for loader in loaders:
+        loader.loader.startup_delay = 0.2
+    sleep = asyncio.sleep
+    waiting = []
+    events = {}
+
+    async def startup_sleep(delay):
+        if delay != 0.2:
+            await sleep(0)
+            return
+        # every target enters its startup wait before any of them leaves it
+        waiting.append(delay)
+        if len(waiting) == len(loaders):
+            events['all'].set()
+        await events['all'].wait()
+
+    async def job():
+        events['all'] = asyncio.Event()
+        await asyncio.wait_for(asyncio.gather(*(loader.reset_from_system_memory() for loader in loaders)), 10)
+    monkeypatch.setattr(asyncio, "sleep", startup_sleep)
+    asyncio.run(job())
+    assert len(waiting) == len(loaders)
+    assert all(loader.loader.flash_page_size for loader in loaders)
+
+
+def test_command_error():
+    """
+    bootloader errors are raised by the coroutines
+    """
+    loader, _ = async_loader()
+
+    async def job():
+        await loader.reset_from_system_memory(0)
+        await loader.go(0x00000001)
+    with pytest.raises(CommandError):
+        asyncio.run(job())
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test the benchmark suite on its smallest cases
+"""
+import copy
+from benchmarks.bench_loader import CASES, compare, run
+
+
+def test_run():
+    """
+    every case runs, sizes above the flash size are left out
+    """
+    document = run(CASES, [0x460], [4096, 2 * 1024 * 1024], repeat=1)
+    assert [result['case'] for result in document['results']] == list(CASES)
+    assert all(result['size'] == 4096 and result['modelled'] > 0 for result in document['results'])
+
+
+def test_compare():
+    """
+    host times beyond the tolerance are regressions
+    """
+    document = {'results': [{'case': 'read', 'device': '0x460', 'size': 4096, 'host': 1.0},
+                            {'case': 'write', 'device': '0x460', 'size': 4096, 'host': 1.0}]}
+    baseline = copy.deepcopy(document)
+    baseline['results'][0]['host'] = 0.5
+    baseline['results'][1]['host'] = 0.9
+    assert compare(document, baseline) == [(document['results'][0], baseline['results'][0])]
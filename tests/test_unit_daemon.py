@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test the loader daemon and its client
+"""
+import pytest
+from typer.testing import CliRunner
+from stmloader.cli import cli
+from stmloader.daemon import Client, Daemon, DaemonError
+from stmloader.simulator import Fault
+
+runner = CliRunner()
+
+IMAGE = bytes((index * 7 + 1) & 0xFF for index in range(3000))
+
+
+def test_jobs(daemon):
+    """
+    the board is reset once, then stays in bootloader mode between jobs
+    """
+    path, server = daemon("A")
+    board = server.boards["A"]
+    with Client(path) as client:
+        assert client.write([(0x08000000, IMAGE)], verify=True) is True
+        assert client.read(0x08000000, len(IMAGE)) == IMAGE
+        assert client.verify([(0x08000000, IMAGE)]) is True
+    with Client(path, "A") as client:
+        client.request('erase', address=0x08000000, length=2048)
+        assert client.read(0x08000000, 16) == b'\xff' * 16
+        assert client.verify([(0x08000000, IMAGE)]) is False
+        assert board.loader.metrics.commands['SYNCHRONIZE'] == 1
+        # the application runs, the next job resets the board again
+        client.request('go', address=0x08000000)
+        assert client.request('status')["A"]['bootloader'] is False
+        client.read(0x08000400, 16)
+        assert board.loader.metrics.commands['SYNCHRONIZE'] == 2
+
+
+def test_errors(daemon):
+    """
+    failed jobs are reported, the daemon keeps serving
+    """
+    path, server = daemon("A", "B")
+    with Client(path) as client:
+        # two boards, the port is needed
+        with pytest.raises(DaemonError, match="No board"):
+            client.read(0x08000000, 16)
+    with Client(path, "B") as client:
+        with pytest.raises(DaemonError, match="Unknown job"):
+            client.request('format')
+        with pytest.raises(DaemonError, match="TypeError"):
+            client.request('read', address=0x08000000, size=16)
+        server.boards["B"].loader.scaffold.target.inject(Fault.NACK, 0x11)
+        with pytest.raises(DaemonError, match="CommandError"):
+            client.read(0x08000000, 16)
+        assert client.read(0x08000000, 16) == b'\xff' * 16
+        # a failed job leaves the bootloader out of sync, the next one resets the board
+        server.boards["B"].loader.scaffold.target.inject(Fault.TIMEOUT, 0x31)
+        with pytest.raises(DaemonError, match="CommandError"):
+            client.write([(0x08000000, IMAGE)], erase='none')
+        assert client.request('status')["B"]['bootloader'] is False
+        synchronized = server.boards["B"].loader.metrics.commands['SYNCHRONIZE']
+        assert client.write([(0x08000000, IMAGE)], verify=True) is True
+        assert server.boards["B"].loader.metrics.commands['SYNCHRONIZE'] == synchronized + 1
+    # a second daemon on the same socket
+    with pytest.raises(DaemonError, match="already serves"):
+        Daemon({}, path)
+
+
+def test_stale_socket(tmp_path):
+    """
+    the socket of a dead daemon is replaced, clients report a missing daemon
+    """
+    path = str(tmp_path / "daemon.sock")
+    Daemon({}, path).socket.close()
+    with pytest.raises(DaemonError, match="No daemon"):
+        Client(path)
+    server = Daemon({}, path)
+    server.server_close()
+
+
+def test_cli_client(daemon, tmp_path):
+    """
+    client commands, chained, on a single connection
+    """
+    path, server = daemon("A")
+    image = tmp_path / "image.bin"
+    image.write_bytes(IMAGE)
+    result = runner.invoke(cli, ["client", "-s", path, "write", "-v", str(image), "verify", str(image), "status",
+                                 "read", "-l", "16"])
+    assert result.exit_code == 0
+    assert result.output.count("Verification successfully") == 2
+    assert "A: STM32L4 device, bootloader" in result.output
+    dump = tmp_path / "dump.bin"
+    result = runner.invoke(cli, ["client", "-s", path, "-p", "A", "read", "-l", str(len(IMAGE)), str(dump)])
+    assert result.exit_code == 0
+    assert dump.read_bytes() == IMAGE
+    assert server.boards["A"].loader.metrics.commands['SYNCHRONIZE'] == 1
+    result = runner.invoke(cli, ["client", "-s", path, "-p", "B", "status", "read", "-l", "16"])
+    assert result.exit_code == 1
+    assert "No board on port B" in result.output
+    result = runner.invoke(cli, ["client", "-s", path, "shutdown"])
+    assert result.exit_code == 0
+    result = runner.invoke(cli, ["client", "-s", str(tmp_path / "none.sock"), "status"])
+    assert result.exit_code == 1
+    assert "No daemon" in result.output
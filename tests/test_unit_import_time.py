@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Guard the CLI import time
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('scaffold', 'serial', 'intelhex', 'progressbar', 'yaml', 'cerberus', 'rich', 'concurrent',
+                 'stmloader.bootloader', 'stmloader.serve', 'stmloader.daemon')
+"""Modules loaded by the commands when they run, never by the CLI definition."""
+
+
+def python(*args):
+    """
+    Run python with the package importable, and return the completed process.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable, *args], env=env, check=True, capture_output=True, text=True)
+
+
+def test_lazy_imports():
+    """
+    the CLI definition does not load the dependencies of the commands
+    """
+    result = python("-c", "import sys, stmloader.cli; print(' '.join(sys.modules))")
+    modules = result.stdout.split()
+    assert [name for name in modules if name.split('.')[0] in HEAVY_MODULES or name in HEAVY_MODULES] == []
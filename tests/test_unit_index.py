@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test the compiled device description index
+"""
+import os
+import shutil
+import yaml
+from stmloader.index import DATA_PATH, INDEX_NAME, DeviceIndex, device_index
+
+
+def test_lookup(descriptions):
+    """
+    descriptions by DeviceID, in file name order
+    """
+    devices = DeviceIndex(str(descriptions))
+    assert devices.get(0x460)['Series'] == 'STM32G0'
+    assert devices.get(0x999) is None
+    assert [device['DeviceID'] for device in devices.devices()] == [0x415, 0x460]
+    assert (descriptions / INDEX_NAME).is_file()
+
+
+def test_no_parsing(descriptions, monkeypatch):
+    """
+    an up to date index is loaded without parsing the descriptions
+    """
+    DeviceIndex(str(descriptions))
+
+    def fail(stream):
+        raise AssertionError("description parsed")
+    monkeypatch.setattr(yaml, "safe_load", fail)
+    assert DeviceIndex(str(descriptions)).get(0x415)['Series'] == 'STM32L4'
+
+
+def test_invalidation(descriptions):
+    """
+    a modified, added or removed description rebuilds the index
+    """
+    DeviceIndex(str(descriptions))
+    name = descriptions / "stm32_0x460.yml"
+    name.write_text(name.read_text(encoding='UTF-8').replace("STM32G0", "STM32GX"), encoding='UTF-8')
+    assert DeviceIndex(str(descriptions)).get(0x460)['Series'] == 'STM32GX'
+    shutil.copy(os.path.join(DATA_PATH, "stm32_0x462.yml"), descriptions / "stm32_0x462.yml")
+    assert DeviceIndex(str(descriptions)).get(0x462) is not None
+    os.remove(descriptions / "stm32_0x415.yml")
+    assert DeviceIndex(str(descriptions)).get(0x415) is None
+
+
+def test_refresh(descriptions):
+    """
+    a loaded index sees the descriptions changed since
+    """
+    devices = DeviceIndex(str(descriptions))
+    name = descriptions / "stm32_0x460.yml"
+    name.write_text(name.read_text(encoding='UTF-8').replace("STM32G0", "STM32GX"), encoding='UTF-8')
+    assert devices.get(0x460)['Series'] == 'STM32G0'
+    devices.refresh()
+    assert devices.get(0x460)['Series'] == 'STM32GX'
+    shutil.copy(os.path.join(DATA_PATH, "stm32_0x462.yml"), descriptions / "stm32_0x462.yml")
+    devices.refresh()
+    assert devices.get(0x462) is not None
+
+
+def test_package_index_refreshed(monkeypatch):
+    """
+    the index of the package is kept, and refreshed on each use
+    """
+    refreshed = []
+
+    def refresh(self):
+        refreshed.append(self)
+    monkeypatch.setattr(DeviceIndex, "refresh", refresh)
+    index = device_index()
+    assert device_index() is index
+    assert refreshed == [index, index]
+
+
+def test_corrupted_index(descriptions):
+    """
+    an unreadable index is rebuilt
+    """
+    (descriptions / INDEX_NAME).write_text("{", encoding='UTF-8')
+    assert DeviceIndex(str(descriptions)).get(0x415) is not None
+    assert DeviceIndex(str(descriptions)).get(0x460) is not None
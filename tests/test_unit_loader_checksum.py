@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test the on-target checksum against the simulated bootloader
+"""
+import os
+import struct
+import zlib
+import pytest
+from typer.testing import CliRunner
+from stmloader.boot import boot_app
+from stmloader.bootloader import STM32, CommandError
+from stmloader.image import stm32_crc
+from stmloader.stubs import CRC32_CODE, Crc32Stub
+
+runner = CliRunner()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# stub image
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_stub_image():
+    """
+    stack pointer and thumb entry point come first, the table follows the code
+    """
+    stub = Crc32Stub(0x20002701, 0x20009000)
+    image = stub.image([(0x08000000, 0x100)])
+    assert stub.address == 0x20002704
+    assert struct.unpack_from("<II", image) == (0x20009000, 0x2000270D)
+    assert image[8: 8 + len(CRC32_CODE)] == CRC32_CODE
+    assert stub.table_address == stub.address + 8 + len(CRC32_CODE)
+    assert len(image) == 8 + len(CRC32_CODE) + stub.table_size(1)
+
+
+def test_stub_capacity():
+    """
+    the table must fit in the RAM window
+    """
+    stub = Crc32Stub(0x20002700, 0x20002800)
+    with pytest.raises(ValueError):
+        stub.image([(0x08000000, 4)] * (stub.capacity + 1))
+
+
+def test_stub_not_done():
+    """
+    a table without the done status is rejected
+    """
+    with pytest.raises(ValueError):
+        Crc32Stub(0x20002700, 0x20009000).results(struct.pack("<IIIII", 0, 1, 0x08000000, 4, 0))
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# checksum stub
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_checksum_memory(connect):
+    """
+    only the checksums are read back, the bootloader is available afterwards
+    """
+    loader, target = connect(0x460)
+    data = os.urandom(0x3000)
+    target.flash.data[:len(data)] = data
+    reads = target.command_counts[STM32.Command.READ_MEMORY]
+    checksums = loader.checksum_memory([(0x08000000, 0x3000), (0x08000123, 0x45), (0x08001000, 0)])
+    assert checksums == [zlib.crc32(data), zlib.crc32(data[0x123:0x168]), zlib.crc32(b'')]
+    assert target.command_counts[STM32.Command.READ_MEMORY] - reads == 1
+    assert loader.read_memory(0x08000000, 4) == data[:4]
+
+
+def test_checksum_memory_batches(connect):
+    """
+    regions exceeding the table capacity are computed in several runs
+    """
+    loader, target = connect(0x460)
+    pages = [(0x08000000 + page * 4, 4) for page in range(Crc32Stub(*loader.ram_window).capacity + 3)]
+    assert loader.checksum_memory(pages) == [zlib.crc32(b'\xff' * 4)] * len(pages)
+    assert target.command_counts[STM32.Command.GO] == 2
+
+
+def test_checksum_memory_no_ram_window(connect):
+    """
+    the stub needs the bootloader RAM window
+    """
+    loader, _ = connect()
+    loader.ram_window = STM32.RAM_WINDOW_UNKNOWN
+    with pytest.raises(CommandError):
+        loader.checksum_memory([(0x08000000, 4)])
+
+
+def test_write_command_crc(cli_target, tmp_path):
+    """
+    write verified with the on-target checksum
+    """
+    target = cli_target()
+    image = tmp_path / "image.bin"
+    image.write_bytes(bytes(range(256)) * 4)
+    result = runner.invoke(boot_app, ["-v", "0", "reset", "-t", "0", "write", "--crc", str(image)])
+    assert result.exit_code == 0
+    assert "Verification successfully" in result.output
+    assert target.command_counts[STM32.Command.GO] == 1
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Get Checksum command
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_stm32_crc():
+    """
+    CRC-32/MPEG-2 of the little endian words
+    """
+    assert stm32_crc(b'') == 0xFFFFFFFF
+    assert stm32_crc(bytes([0x04, 0x03, 0x02, 0x01])) == 0x793737CD
+    with pytest.raises(ValueError):
+        stm32_crc(b'\x00')
+
+
+def test_supports(connect):
+    """
+    the command set comes from the Get command, executed once
+    """
+    loader, target = connect(get_checksum=True)
+    assert loader.commands is None
+    assert loader.supports(STM32.Command.GET_CHECKSUM)
+    assert not loader.supports(STM32.Command.ERASE)
+    assert target.command_counts[STM32.Command.GET] == 1
+
+
+def test_get_checksum(connect):
+    """
+    the checksum computed by the bootloader matches stm32_crc
+    """
+    loader, target = connect(get_checksum=True)
+    data = os.urandom(0x400)
+    target.flash.data[:len(data)] = data
+    assert loader.get_checksum(0x08000000, len(data)) == stm32_crc(data)
+
+
+def test_verify_memory_segments_checksum(connect):
+    """
+    aligned part compared with Get Checksum, unaligned ends read back
+    """
+    loader, target = connect(get_checksum=True)
+    data = os.urandom(0x1000)
+    target.flash.data[:len(data)] = data
+    assert loader.verify_memory_segments([(0x08000000, data), (0x08000102, data[0x102:0x205])])
+    assert target.command_counts[STM32.Command.GET_CHECKSUM] == 2
+    assert target.command_counts[STM32.Command.READ_MEMORY] == 2
+    assert not loader.verify_memory_segments([(0x08000000, data[:0x10] + b'\x00' + data[0x11:])])
+
+
+def test_verify_memory_segments_read_back(connect):
+    """
+    without Get Checksum the memory is read back
+    """
+    loader, target = connect()
+    data = os.urandom(0x200)
+    target.flash.data[:len(data)] = data
+    assert loader.verify_memory_segments([(0x08000000, data)])
+    assert target.command_counts[STM32.Command.READ_MEMORY] == 2
+    assert not loader.verify_memory_segments([(0x08000000, b'\x00')])
+
+
+def test_write_memory_diff_checksum(connect):
+    """
+    fully covered pages are compared with Get Checksum, partial pages read back
+    """
+    loader, target = connect(0x460, get_checksum=True)
+    data = os.urandom(0x2000)
+    target.flash.data[:len(data)] = data
+    image = bytearray(data[:0x1800])
+    image[0xA00] ^= 0xFF
+    assert loader.write_memory_diff([(0x08000000, bytes(image))]) == [1]
+    assert target.command_counts[STM32.Command.GET_CHECKSUM] == 3
+    assert target.command_counts[STM32.Command.READ_MEMORY] == 0
+    assert target.read(0x08000000, 0x2000) == bytes(image) + data[0x1800:]
+    assert loader.write_memory_diff([(0x08001800, b'\x00' * 0x10)]) == [3]
+    assert target.command_counts[STM32.Command.READ_MEMORY] == 8
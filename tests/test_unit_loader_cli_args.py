@@ -290,3 +290,43 @@ def test_command_get_help_option():
     # Options
     assert "--info" in result.stdout
     assert "--help" in result.stdout
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# write command parameter test parameters
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_command_write_bad_address_type_option():
+    """
+    write bad address type (long)
+    @return:
+    """
+    result = runner.invoke(boot_app, ["write", "--address", "a"])
+    assert result.exit_code != 0
+    assert "Invalid value (a) !" in result.stdout
+
+
+def test_command_write_help_option():
+    """
+    write help option
+    @return:
+    """
+    result = runner.invoke(boot_app, ["write", "--help"])
+    assert result.exit_code == 0
+    # header
+    assert "  Write memory command" in result.stdout
+    # Options
+    assert "--address" in result.stdout
+    assert "--verify" in result.stdout
+    assert "--force" in result.stdout
+    assert "--diff" in result.stdout
+    assert "--help" in result.stdout
+
+
+def test_main_baudrate_option_bad_value():
+    """
+    main baudrate neither a number nor auto
+    """
+    result = runner.invoke(boot_app, ["--baudrate", "fast"])
+    assert result.exit_code != 0
+    assert "Invalid value (fast) !" in result.stdout
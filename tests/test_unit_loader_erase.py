@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test the erase planner against the simulated bootloader
+"""
+import pytest
+from typer.testing import CliRunner
+from stmloader.boot import boot_app
+from stmloader.bootloader import STM32, PageIndexError
+from stmloader.erase import BANK, MASS, PAGES, plan_erase, touched_pages
+
+runner = CliRunner()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# planner
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_touched_pages():
+    """
+    pages touched by the segments, partially or not
+    """
+    segments = [(0x08000400, b'\x00' * 0x401), (0x08000000, b'\x00'), (0x08001000, b'')]
+    assert touched_pages(segments, 0x400, 0x08000000) == [0, 1, 2]
+
+
+def test_plan_pages():
+    """
+    pages are batched to the erase command limit
+    """
+    assert plan_erase([3, 1, 2, 1], batch=2) == [(PAGES, [1, 2]), (PAGES, [3])]
+    assert not plan_erase([])
+    # whole banks are not allowed, or the flash size is unknown
+    assert plan_erase(range(100), 128) == [(PAGES, list(range(100)))]
+    assert plan_erase(range(100), whole_banks=True) == [(PAGES, list(range(100)))]
+
+
+def test_plan_banks():
+    """
+    banks mostly covered are erased at once, all of them with a mass erase
+    """
+    assert plan_erase(list(range(60)) + [200], 256, banks=2, whole_banks=True) == [(PAGES, list(range(60)) + [200])]
+    assert plan_erase(list(range(100)) + [200], 256, banks=2, whole_banks=True) == [(BANK, 0), (PAGES, [200])]
+    assert plan_erase(list(range(100)) + list(range(128, 250)), 256, banks=2, whole_banks=True) == [(MASS, None)]
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# loader
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_pages_from_range(connect):
+    """
+    page indexes are counted from the flash memory base address
+    """
+    loader, _ = connect(0x460)
+    assert loader.pages_from_range(0x08001000, 0x08002000) == [2, 3]
+    with pytest.raises(PageIndexError):
+        loader.pages_from_range(0x08001001, 0x08002000)
+    with pytest.raises(PageIndexError):
+        loader.pages_from_range(0x07FFF800, 0x08002000)
+
+
+def test_page_index_device(connect):
+    """
+    2 KB pages: the second bank of a STM32L476 starts at page 256
+    """
+    loader, _ = connect(0x415)
+    assert loader.flash_page_size == 2048
+    assert loader.pages_from_range(0x08080000, 0x08081000) == [256, 257]
+    assert touched_pages([(0x080FF800, b'\x00')], loader.flash_page_size, loader.FLASH_BASE) == [511]
+
+
+def test_plan_erase_device(connect):
+    """
+    bank erase with Extended Erase, mass erase only with Erase
+    """
+    loader, _ = connect(0x415)
+    image = [(0x08080000, b'\x00' * 0x60000), (0x20001000, b'\x00' * 0x100)]
+    assert loader.plan_erase(image) == [(PAGES, list(range(256, 448)))]
+    assert loader.plan_erase(image, whole_banks=True) == [(BANK, 1)]
+    loader, _ = connect(0x415, extended_erase=False)
+    image = [(0x08080000, b'\x00' * 0x80000)]
+    assert loader.plan_erase(image, whole_banks=True) == [(PAGES, list(range(256, 511))), (PAGES, [511])]
+
+
+def test_erase_planned(connect):
+    """
+    the planned operations erase the image pages only, or the whole bank
+    """
+    loader, target = connect(0x415)
+    target.flash.data[:] = b'\x00' * len(target.flash.data)
+    loader.erase_planned(loader.plan_erase([(0x08001800, b'\x00' * 0x801)]))
+    assert target.read(0x08001000, 0x2000) == b'\x00' * 0x800 + b'\xff' * 0x1000 + b'\x00' * 0x800
+    loader.erase_planned([(BANK, 1)])
+    assert target.read(0x08080000, 0x80000) == b'\xff' * 0x80000
+    assert target.read(0x0807FC00, 0x400) == b'\x00' * 0x400
+    loader.erase_planned([(MASS, None)])
+    assert target.read(0x08000000, 0x400) == b'\xff' * 0x400
+
+
+def test_plan_erase_sectors(connect):
+    """
+    no page is planned on a flash memory made of sectors
+    """
+    loader, _ = connect(0x451)
+    assert not loader.plan_erase([(0x20004000, b'\x00' * 0x100)])
+    with pytest.raises(PageIndexError, match="sectors"):
+        loader.plan_erase([(0x08000000, b'\x00' * 0x100)])
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# cli
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_write_command_erase(cli_target, tmp_path):
+    """
+    write erases the pages touched by the image first when told to
+    """
+    target = cli_target(0x460)
+    target.flash.data[:] = b'\x00' * len(target.flash.data)
+    image = tmp_path / "image.bin"
+    image.write_bytes(bytes(range(256)) * 5)
+    result = runner.invoke(boot_app, ["-v", "0", "reset", "-t", "0", "write", "-a", "0x08000800", str(image)])
+    assert result.exit_code == 0
+    assert target.read(0x08000800, 0x500) == b'\x00' * 0x500
+    result = runner.invoke(boot_app, ["-v", "0", "reset", "-t", "0", "write", "-e", "pages", "-a", "0x08000800",
+                                      "-v", str(image)])
+    assert result.exit_code == 0
+    assert "Verification successfully" in result.output
+    assert target.read(0x08000000, 0x800) == b'\x00' * 0x800
+    assert target.read(0x08000D00, 0x300) == b'\xff' * 0x300
+    assert target.read(0x08001000, 0x800) == b'\x00' * 0x800
+    assert target.command_counts[STM32.Command.EXTENDED_ERASE] == 1
+
+
+def test_erase_command_range(cli_target):
+    """
+    erase command on a range of pages
+    """
+    target = cli_target(0x460)
+    target.flash.data[:] = b'\x00' * len(target.flash.data)
+    result = runner.invoke(boot_app, ["-v", "0", "reset", "-t", "0", "erase", "-a", "0x08001000", "-l", "2048"])
+    assert result.exit_code == 0
+    assert target.read(0x08000800, 0x1800) == b'\x00' * 0x800 + b'\xff' * 0x800 + b'\x00' * 0x800
+
+
+def test_write_command_erase_sectors(cli_target, tmp_path):
+    """
+    write refuses to erase pages on a flash memory made of sectors
+    """
+    target = cli_target(0x451)
+    image = tmp_path / "image.bin"
+    image.write_bytes(b'\x00' * 256)
+    result = runner.invoke(boot_app, ["-v", "0", "reset", "-t", "0", "write", "-e", "pages", str(image)])
+    assert result.exit_code == 1
+    assert "made of sectors" in result.output
+    assert target.command_counts[STM32.Command.WRITE_MEMORY] == 0
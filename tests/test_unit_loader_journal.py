@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test the write journal, and the write continued with --resume
+"""
+import os
+import pytest
+from typer.testing import CliRunner
+from stmloader.boot import boot_app
+from stmloader.bootloader import STM32, PageIndexError
+from stmloader.journal import Journal, image_hash
+from stmloader.simulator import Fault
+
+runner = CliRunner()
+IMAGE = bytes(range(1, 256)) * 16 + b'\x01' * 16
+
+
+def test_journal(tmp_path):
+    """
+    entries appended, read back, a cut line ignored
+    """
+    journal = Journal(b'\x01' * 12, image_hash([(0x08000000, IMAGE)]), str(tmp_path))
+    journal.record_erase()
+    journal.confirm(0x08000000)
+    journal.confirm(0x08000100)
+    journal.close()
+    with open(journal.file, 'a', encoding='ascii') as f:
+        f.write('0x0800')
+    journal = Journal(b'\x01' * 12, image_hash([(0x08000000, IMAGE)]), str(tmp_path))
+    assert journal.erased
+    assert journal.written == [0x08000000, 0x08000100]
+    journal.drop([0x08000000])
+    assert Journal(b'\x01' * 12, image_hash([(0x08000000, IMAGE)]), str(tmp_path)).written == [0x08000100]
+    journal.remove()
+    assert not os.path.exists(journal.file)
+    # another device, another image
+    assert not Journal(b'\x02' * 12, image_hash([(0x08000000, IMAGE)]), str(tmp_path)).erased
+    assert image_hash([(0x08000000, IMAGE)]) != image_hash([(0x08000100, IMAGE)])
+
+
+def test_check_journal(connect, tmp_path):
+    """
+    a chunk cut while programmed makes its page erased and written again
+    """
+    loader, target = connect(0x460)
+    journal = Journal(target.uid, image_hash([(0x08000000, IMAGE)]), str(tmp_path))
+    loader.write_memory_segments([(0x08000000, IMAGE[:0x300])], journal=journal)
+    assert journal.written == [0x08000000, 0x08000100, 0x08000200]
+    # fourth chunk half programmed
+    target.flash.data[0x300:0x380] = IMAGE[0x300:0x380]
+    loader.check_journal(journal, [(0x08000000, IMAGE)], 2)
+    assert not journal.written
+    assert target.read(0x08000000, 0x400) == b'\xff' * 0x400
+    loader.write_memory_segments([(0x08000000, IMAGE)], journal=journal)
+    assert target.read(0x08000000, len(IMAGE)) == IMAGE
+
+
+def test_check_journal_skip_blank(connect, tmp_path):
+    """
+    the chunk checked is the next one sent, not a blank one left out
+    """
+    loader, target = connect(0x460)
+    image = IMAGE[:0x100] + b'\xff' * 0x100 + IMAGE[0x200:0x400]
+    journal = Journal(target.uid, image_hash([(0x08000000, image)]), str(tmp_path))
+    loader.write_memory_segments([(0x08000000, image[:0x100])], skip_blank=True, journal=journal)
+    # third chunk half programmed, the second one is blank and never sent
+    target.flash.data[0x200:0x280] = image[0x200:0x280]
+    loader.check_journal(journal, [(0x08000000, image)], 2, skip_blank=True)
+    assert not journal.written
+    assert target.read(0x08000000, 0x400) == b'\xff' * 0x400
+    loader.write_memory_segments([(0x08000000, image)], skip_blank=True, journal=journal)
+    assert target.read(0x08000000, len(image)) == image
+
+
+def test_check_journal_sectors(connect, tmp_path):
+    """
+    a flash memory made of sectors is not erased by pages
+    """
+    loader, target = connect(0x451)
+    journal = Journal(target.uid, image_hash([(0x08000000, IMAGE)]), str(tmp_path))
+    loader.write_memory_segments([(0x08000000, IMAGE[:0x200])], journal=journal)
+    target.flash.data[0x100:0x200] = b'\x00' * 0x100
+    with pytest.raises(PageIndexError, match="sectors"):
+        loader.check_journal(journal, [(0x08000000, IMAGE)], 2)
+    assert target.command_counts[STM32.Command.EXTENDED_ERASE] == 0
+    assert journal.written == [0x08000000, 0x08000100]
+
+def test_resume(cli_target, tmp_path):
+    """
+    the write stopped by a NACK continues from the last chunk acknowledged
+    """
+    target = cli_target(0x460)
+    image = tmp_path / "image.bin"
+    image.write_bytes(IMAGE)
+    args = ["-v", "0", "reset", "-t", "0", "write", "--resume", "--journal", str(tmp_path / "journal"), "-v",
+            str(image)]
+    target.inject(Fault.NACK, STM32.Command.WRITE_MEMORY, skip=5)
+    result = runner.invoke(boot_app, args)
+    assert result.exit_code != 0
+    journals = os.listdir(tmp_path / "journal")
+    assert len(journals) == 1
+    writes = target.command_counts[STM32.Command.WRITE_MEMORY]
+    erases = target.command_counts[STM32.Command.EXTENDED_ERASE]
+    result = runner.invoke(boot_app, args)
+    assert result.exit_code == 0
+    assert "Verification successfully" in result.output
+    assert target.command_counts[STM32.Command.WRITE_MEMORY] - writes == 16 - 5
+    assert target.command_counts[STM32.Command.EXTENDED_ERASE] == erases
+    assert target.read(0x08000000, len(IMAGE)) == IMAGE
+    assert not os.listdir(tmp_path / "journal")
+
+
+def test_resume_erase(cli_target, tmp_path):
+    """
+    the pages erased when continuing a write are written again
+    """
+    target = cli_target(0x460)
+    image = tmp_path / "image.bin"
+    image.write_bytes(IMAGE)
+    args = ["-v", "0", "reset", "-t", "0", "write", "--resume", "--journal", str(tmp_path / "journal"), "-v",
+            str(image)]
+    target.inject(Fault.NACK, STM32.Command.WRITE_MEMORY, skip=5)
+    assert runner.invoke(boot_app, args).exit_code != 0
+    writes = target.command_counts[STM32.Command.WRITE_MEMORY]
+    result = runner.invoke(boot_app, args[:-1] + ["-e", "pages", str(image)])
+    assert result.exit_code == 0
+    assert "Verification successfully" in result.output
+    assert target.command_counts[STM32.Command.EXTENDED_ERASE] == 1
+    assert target.command_counts[STM32.Command.WRITE_MEMORY] - writes == 16
+    assert target.read(0x08000000, len(IMAGE)) == IMAGE
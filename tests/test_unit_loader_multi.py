@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test multi-board jobs against simulated bootloaders
+"""
+import os
+from typer.testing import CliRunner
+from stmloader.boot import boot_app, expand_ports
+from stmloader.bootloader import STM32
+from stmloader.simulator import Fault
+
+runner = CliRunner()
+
+
+def test_expand_ports(tmp_path):
+    """
+    glob patterns are expanded and sorted, duplicates removed
+    """
+    for name in ("ttyUSB1", "ttyUSB0", "ttyACM0"):
+        (tmp_path / name).touch()
+    assert expand_ports(f"{tmp_path}/ttyUSB*,COM3") == [f"{tmp_path}/ttyUSB0", f"{tmp_path}/ttyUSB1", "COM3"]
+    assert expand_ports(f"COM3, COM4,COM3,{tmp_path}/none*") == ["COM3", "COM4"]
+
+
+def test_write_boards(cli_boards, tmp_path):
+    """
+    the image is written on every board, each result reported
+    """
+    targets = cli_boards("A", "B", "C")
+    data = os.urandom(0x800)
+    image = tmp_path / "image.bin"
+    image.write_bytes(data)
+    result = runner.invoke(boot_app, ["-v", "0", "--ports", "A,B,C", "reset", "-t", "0", "write", "-v", str(image)])
+    assert result.exit_code == 0
+    for port, target in targets.items():
+        assert target.read(0x08000000, len(data)) == data
+        assert f"{port}: OK" in result.output
+
+
+def test_board_failure(cli_boards, tmp_path):
+    """
+    a failed board stops there, others go on, and the exit code is 1
+    """
+    targets = cli_boards("A", "B")
+    targets["B"].inject(Fault.NACK, STM32.Command.WRITE_MEMORY, count=10)
+    image = tmp_path / "image.bin"
+    image.write_bytes(b'\x55' * 0x400)
+    result = runner.invoke(boot_app, ["-v", "0", "--ports", "A,B", "reset", "-t", "0", "write", str(image),
+                                      "get", "-i", "protocol"])
+    assert result.exit_code == 1
+    assert "A: OK" in result.output
+    assert "B: FAILED" in result.output
+    assert targets["A"].command_counts[STM32.Command.GET_VERSION] == 1
+    assert targets["B"].command_counts[STM32.Command.GET_VERSION] == 0
+
+
+def test_unknown_port(cli_boards):
+    """
+    a port that cannot be opened fails its board only
+    """
+    cli_boards("A")
+    result = runner.invoke(boot_app, ["-v", "0", "--ports", "A,Z", "reset", "-t", "0"])
+    assert result.exit_code == 1
+    assert "A: OK" in result.output
+    assert "Z: FAILED could not open port Z" in result.output
+
+
+def test_read_boards(cli_boards, tmp_path):
+    """
+    each board is read in its own file, named after the port
+    """
+    targets = cli_boards("A", "B")
+    targets["A"].flash.data[:4] = b'\x01\x02\x03\x04'
+    targets["B"].flash.data[:4] = b'\x05\x06\x07\x08'
+    output = tmp_path / "flash.bin"
+    result = runner.invoke(boot_app, ["-v", "0", "--ports", "A,B", "reset", "-t", "0",
+                                      "read", "-l", "4", str(output)])
+    assert result.exit_code == 0
+    assert (tmp_path / "flash_A.bin").read_bytes() == b'\x01\x02\x03\x04'
+    assert (tmp_path / "flash_B.bin").read_bytes() == b'\x05\x06\x07\x08'
+
+
+def test_single_board_failure(cli_boards):
+    """
+    the exit code is 1 when the only board fails, its error kept
+    """
+    targets = cli_boards("A", startup_time=5)
+    result = runner.invoke(boot_app, ["-v", "0", "--ports", "A", "reset", "-t", "0.1", "get", "-i", "protocol"])
+    assert result.exit_code == 1
+    assert "A: FAILED reset timeout" in result.output
+    assert targets["A"].command_counts[STM32.Command.GET_VERSION] == 0
+
+
+def test_single_port_failure(cli_boards):
+    """
+    out of a multi-board job, a failed command also gives exit code 1
+    """
+    cli_boards("A", startup_time=5)
+    result = runner.invoke(boot_app, ["-v", "0", "--port", "A", "reset", "-t", "0.1", "get", "-i", "protocol"])
+    assert result.exit_code == 1
+    assert "Consider" in result.output
+    result = runner.invoke(boot_app, ["-v", "0", "--port", "A", "reset", "-t", "0.1"])
+    assert result.exit_code == 1
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test the read functions against the simulated bootloader
+"""
+import io
+import pytest
+from intelhex import IntelHex
+from typer.testing import CliRunner
+from stmloader.boot import boot_app
+from stmloader.bootloader import STM32, CommandError
+from stmloader.image import HexWriter, SRecWriter, DumpWriter
+from stmloader.simulator import Fault
+
+runner = CliRunner()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# memory read
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_read_memory_data(connect):
+    """
+    read of several chunks, last one partial
+    """
+    loader, target = connect()
+    data = bytes(range(256)) * 8 + b'\x01\x02\x03'
+    loader.write_memory_data(0x08000000, data)
+    result = loader.read_memory_data(0x08000000, len(data))
+    assert isinstance(result, bytearray)
+    assert result == target.read(0x08000000, len(data)) == data
+
+
+def test_read_memory_transactions(connect):
+    """
+    one transmit per frame, the data is received with the last ACK
+    """
+    loader, target = connect()
+    target.flash.data[:4] = b'\x01\x02\x03\x04'
+    uart = loader.uart
+    transactions = uart.transactions
+    assert loader.read_memory(0x08000000, 4) == b'\x01\x02\x03\x04'
+    assert uart.transactions - transactions == 3 * 2
+    transactions = uart.transactions
+    assert loader.get_id() == 0x415
+    assert uart.transactions - transactions == 3
+
+
+def test_read_memory_nack(connect):
+    """
+    a NACK in place of the data is reported as a command error
+    """
+    loader, target = connect()
+    target.inject(Fault.NACK, STM32.Command.READ_MEMORY, count=1)
+    with pytest.raises(CommandError):
+        loader.read_memory(0x08000000, 4)
+    loader.synchronize()
+    with pytest.raises(CommandError):
+        loader.read_memory(0x08100000 - 2, 4)
+
+
+def test_iter_memory(connect):
+    """
+    chunks are yielded with their address
+    """
+    loader, _ = connect()
+    loader.write_memory_data(0x08000000, b'\x00' * 600)
+    chunks = list(loader.iter_memory(0x08000000, 600))
+    assert [address for address, _ in chunks] == [0x08000000, 0x08000100, 0x08000200]
+    assert [len(data) for _, data in chunks] == [256, 256, 88]
+
+
+def test_iter_memory_stop(connect):
+    """
+    stop reading as soon as the caller is done
+    """
+    loader, target = connect()
+    reads = target.command_counts[STM32.Command.READ_MEMORY]
+    for address, _ in loader.iter_memory(0x08000000, 0x10000):
+        if address == 0x08000100:
+            break
+    assert target.command_counts[STM32.Command.READ_MEMORY] - reads == 2
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# output writers
+# ----------------------------------------------------------------------------------------------------------------------
+
+def write_chunks(writer, address, data):
+    """
+    Feed a writer by 256 bytes chunks, as iter_memory does
+    """
+    for offset in range(0, len(data), 256):
+        writer.write(address + offset, data[offset: offset + 256])
+    writer.close()
+
+
+def test_hex_writer():
+    """
+    Intel hex output read back by IntelHex, across a 64KB boundary
+    """
+    data = bytes(range(256)) * 20
+    stream = io.StringIO()
+    write_chunks(HexWriter(stream), 0x0800FF04, data)
+    stream.seek(0)
+    ih = IntelHex(stream)
+    assert ih.minaddr() == 0x0800FF04
+    assert ih.tobinstr() == data
+    assert stream.getvalue().endswith(":00000001FF\n")
+
+
+def test_srec_writer():
+    """
+    S-record output, S0 header, S3 data records and S7 termination
+    """
+    stream = io.StringIO()
+    write_chunks(SRecWriter(stream), 0x08000000, bytes(range(4)))
+    assert stream.getvalue().splitlines() == ["S0030000FC", "S3090800000000010203E8", "S70500000000FA"]
+
+
+def test_dump_writer():
+    """
+    dump lines are the ones of IntelHex.dump
+    """
+    data = bytes(range(256)) * 3
+    ih = IntelHex()
+    ih.frombytes(data, 0x08000004)
+    expected = io.StringIO()
+    ih.dump(expected)
+    stream = io.StringIO()
+    write_chunks(DumpWriter(stream, 0x08000004, len(data)), 0x08000004, data)
+    assert stream.getvalue() == expected.getvalue()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# read command
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_read_command_dump(cli_target):
+    """
+    without file the memory is dumped on the console
+    """
+    cli_target()
+    result = runner.invoke(boot_app, ["reset", "-t", "0", "read", "-l", "32"])
+    assert result.exit_code == 0
+    assert "8000010  FF FF FF FF" in result.stdout
+
+
+def test_read_command_file(cli_target, tmp_path):
+    """
+    output format from the file suffix, no dump with a file
+    """
+    target = cli_target()
+    target.flash.data[:4] = b'\x01\x02\x03\x04'
+    result = runner.invoke(boot_app, ["reset", "-t", "0", "read", "-l", "300", str(tmp_path / "out.bin"),
+                                      "read", "-l", "300", "-f", "hex", str(tmp_path / "out.txt")])
+    assert result.exit_code == 0
+    assert "8000000" not in result.stdout
+    assert (tmp_path / "out.bin").read_bytes() == target.read(0x08000000, 300)
+    assert IntelHex(str(tmp_path / "out.txt")).tobinstr() == target.read(0x08000000, 300)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test the flash loader stub protocol against the simulated bootloader
+"""
+import os
+import struct
+import pytest
+from typer.testing import CliRunner
+from stmloader.boot import boot_app
+from stmloader.bootloader import STM32, CommandError
+from stmloader.stubs import FLASH_LOADER_CODE, FlashLoaderStub
+
+runner = CliRunner()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# stub image
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_flash_loader_image():
+    """
+    vector words, code and parameter table, ring buffer sized to a power of two
+    """
+    stub = FlashLoaderStub('STM32G0', 0x20002700, 0x20009000, 0x40013800, 115200)
+    image = stub.image()
+    assert struct.unpack_from("<II", image) == (0x20009000, 0x20002709)
+    assert image[8: 8 + len(FLASH_LOADER_CODE)] == FLASH_LOADER_CODE
+    assert struct.unpack_from("<IIIII", image, 8 + len(FLASH_LOADER_CODE)) == \
+        (0x40013800, 0x40022000, stub.ring_address, stub.ring_size - 1, len(stub.registers))
+    assert image[8 + len(FLASH_LOADER_CODE) + stub.TABLE_SIZE:] == \
+        b''.join(struct.pack("<III", *write) for write in stub.registers)
+    assert stub.ring_size == 0x4000
+    assert stub.ring_address % 8 == 0
+    assert stub.ring_address + stub.ring_size <= stub.stack - stub.STACK_SIZE
+
+
+def test_flash_loader_usart_setup():
+    """
+    the USART is configured again: clocks, pins, baud rate and 8E1 format
+    """
+    stub = FlashLoaderStub('STM32G0', 0x20002700, 0x20009000, 0x40013800, 115200)
+    registers = dict((register, value) for register, _, value in stub.registers)
+    assert registers[0x40021040] == 1 << 14
+    assert registers[0x50000024] == 0x110
+    assert registers[0x4001380C] == 139
+    assert stub.registers[-1] == (0x40013800, 0, 0x140D)
+    assert FlashLoaderStub.brr(921600) == 17
+    with pytest.raises(ValueError, match="USART1"):
+        FlashLoaderStub('STM32G0', 0x20002700, 0x20009000, 0x40004400, 115200)
+
+
+def test_flash_loader_window_too_small():
+    """
+    the ring buffer must hold one block at least
+    """
+    with pytest.raises(ValueError):
+        FlashLoaderStub('STM32L4', 0x20003100, 0x20003800, 0x40013800, 115200)
+
+
+def test_flash_loader_blocks():
+    """
+    segments split into blocks, blank blocks left out on request
+    """
+    stub = FlashLoaderStub('STM32L4', 0x20003100, 0x20017FFF, 0x40013800, 115200)
+    segments = [(0x08000000, b'\x00' * 1500), (0x08001000, b'\xff' * 1024)]
+    assert [(address, len(data)) for address, data in stub.blocks(segments)] == \
+        [(0x08000000, 1024), (0x08000400, 476), (0x08001000, 1024)]
+    assert len(list(stub.blocks(segments, skip_blank=True))) == 2
+    assert not FlashLoaderStub.supports('STM32F7')
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# bulk write
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_write_memory_stub(connect):
+    """
+    flash written through the flash loader, faster than with Write Memory when
+    the line is fast enough for programming to matter
+    """
+    data = os.urandom(0x5000) + b'\x01\x02\x03'
+    loader, target = connect(0x460, baudrate=921600, max_baudrate=921600)
+    start = target.clock
+    loader.write_memory_stub([(0x08000000, data)])
+    stub_time = target.clock - start
+    assert target.read(0x08000000, len(data)) == data
+    assert target.read(0x08005003, 5) == b'\xff' * 5
+    assert target.command_counts[STM32.Command.GO] == 1
+    assert target.command_counts[STM32.Command.WRITE_MEMORY] == 3
+    # the bootloader is back
+    assert loader.read_memory(0x08000000, 4) == data[:4]
+
+    loader, target = connect(0x460, baudrate=921600, max_baudrate=921600)
+    start = target.clock
+    loader.write_memory_segments([(0x08000000, data)])
+    assert stub_time < (target.clock - start) * 2 / 3
+
+
+def test_write_memory_stub_window(connect):
+    """
+    blocks are sent ahead while the ring buffer can hold them
+    """
+    loader, _ = connect(0x460)
+    stub = FlashLoaderStub('STM32G0', *loader.ram_window, loader.usart_address, loader.uart.baudrate)
+    events = []
+    transmit, receive = loader.uart.transmit, loader.uart.receive
+
+    def record_transmit(data, trigger=False):
+        events.append(len(data))
+        transmit(data, trigger)
+
+    def record_receive(n=1):
+        events.append(-n)
+        return receive(n)
+
+    loader.uart.transmit, loader.uart.receive = record_transmit, record_receive
+    loader.write_memory_stub([(0x08000000, b'\x00' * 0x8000)])
+    frames = [index for index, size in enumerate(events) if size == 1024 + 16]
+    # first blocks sent back to back
+    ahead = events[frames[0]:].index(-1)
+    assert ahead == stub.ring_size // (1024 + 16)
+    outstanding = peak = 0
+    for size in events[frames[0]: frames[-1] + 1]:
+        outstanding += size if size > 0 else -(1024 + 16)
+        peak = max(peak, outstanding)
+    assert peak <= stub.ring_size
+
+
+def test_write_memory_stub_usart_reset(connect, monkeypatch):
+    """
+    the USART reset by the Go command must be configured again by the stub
+    """
+    loader, target = connect(0x460)
+    monkeypatch.setattr(FlashLoaderStub, 'usart_setup', classmethod(lambda cls, *args: []))
+    with pytest.raises(CommandError, match="timeout"):
+        loader.write_memory_stub([(0x08000000, b'\x00' * 0x100)])
+    assert target.read(0x08000000, 4) == b'\xff' * 4
+
+
+def test_write_memory_stub_refused(connect):
+    """
+    a block the flash loader refuses is reported, the bootloader is back
+    """
+    loader, target = connect(0x460)
+    loader.write_memory_data(0x08000400, b'\x00' * 8)
+    with pytest.raises(CommandError, match="0x08000400"):
+        loader.write_memory_stub([(0x08000000, b'\x11' * 0x1000)])
+    assert target.read(0x08000000, 4) == b'\x11' * 4
+    assert loader.read_memory(0x08000800, 4) == b'\x11' * 4
+
+
+def test_write_memory_stub_fallback(connect):
+    """
+    Write Memory is used on series without flash loader, and for RAM
+    """
+    loader, target = connect(0x451)
+    loader.write_memory_stub([(0x08000000, b'\x22' * 0x200), (0x20010000, b'\x33' * 4)])
+    assert target.command_counts[STM32.Command.GO] == 0
+    assert target.command_counts[STM32.Command.WRITE_MEMORY] == 3
+    loader, target = connect(0x462)
+    loader.write_memory_stub([(0x08000000, b'\x22' * 0x200), (0x20010000, b'\x33' * 4)])
+    assert target.command_counts[STM32.Command.GO] == 1
+    assert target.read(0x20010000, 4) == b'\x33' * 4
+    assert target.read(0x08000000, 0x200) == b'\x22' * 0x200
+
+
+def test_write_command_stub(cli_target, tmp_path):
+    """
+    write through the flash loader from the cli
+    """
+    target = cli_target(0x460)
+    image = tmp_path / "image.bin"
+    image.write_bytes(bytes(range(256)) * 8)
+    result = runner.invoke(boot_app, ["-v", "0", "reset", "-t", "0", "write", "--stub", "--verify", str(image)])
+    assert result.exit_code == 0
+    assert "Verification successfully" in result.output
+    assert target.command_counts[STM32.Command.GO] == 1
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test the write engine against the simulated bootloader
+"""
+import pytest
+from intelhex import IntelHex
+from typer.testing import CliRunner
+from stmloader.boot import boot_app
+from stmloader.bootloader import STM32, CommandError, PageIndexError
+from stmloader.image import align_segments, segments_from_intelhex
+from stmloader.simulator import Fault
+
+runner = CliRunner()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# pre-encoded write stream
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_encode_write_stream(connect):
+    """
+    frames are encoded back to back with padded data and checksums
+    """
+    # pylint: disable=protected-access
+    loader, _ = connect()
+    stream, frames = loader._encode_write_stream([(0x08000000, bytes(range(256)) + b'\x01')])
+    assert [frame[0] for frame in frames] == [0x08000000, 0x08000100]
+    assert frames[-1][2] == len(stream)
+    last = stream[frames[1][1]: frames[1][2]]
+    assert last[:2] == bytes([STM32.Command.WRITE_MEMORY, STM32.Command.WRITE_MEMORY ^ 0xFF])
+    assert last[2:7] == STM32._encode_address(0x08000100)
+    # 4 bytes: one data byte and three padding bytes
+    assert last[7:] == bytes([3, 0x01, 0xFF, 0xFF, 0xFF, 3 ^ 0x01 ^ 0xFF])
+
+
+def test_write_ack_per_frame(connect):
+    """
+    by default each frame of a chunk is sent after the ACK of the previous one
+    """
+    loader, target = connect()
+    data = bytes(range(256)) * 4
+    uart = loader.uart
+    transactions = uart.transactions
+    loader.write_memory_data(0x08000000, data)
+    assert uart.transactions - transactions == 2 * 3 * 4
+    assert target.read(0x08000000, len(data)) == data
+
+
+def test_write_one_transmit_per_chunk(connect):
+    """
+    pipelined, each chunk costs one transmit and one receive
+    """
+    loader, target = connect()
+    data = bytes(range(256)) * 4
+    uart = loader.uart
+    transactions = uart.transactions
+    loader.write_memory_data(0x08000000, data, pipeline=True)
+    assert uart.transactions - transactions == 2 * 4
+    assert target.read(0x08000000, len(data)) == data
+
+
+def test_write_nack_reported(connect):
+    """
+    a refused chunk stops the write with a command error
+    """
+    loader, target = connect()
+    target.inject(Fault.NACK, STM32.Command.WRITE_MEMORY, skip=2)
+    with pytest.raises(CommandError, match="0x08000200"):
+        loader.write_memory_data(0x08000000, b'\x00' * 1024)
+    assert target.read(0x080001FC, 8) == b'\x00' * 4 + b'\xff' * 4
+
+
+def test_write_command_pipeline(cli_target, tmp_path):
+    """
+    pipelined write from the cli
+    """
+    target = cli_target(0x460)
+    image = tmp_path / "image.bin"
+    image.write_bytes(bytes(range(256)) * 4)
+    result = runner.invoke(boot_app, ["-v", "0", "reset", "-t", "0", "write", "--pipeline", str(image)])
+    assert result.exit_code == 0
+    assert target.read(0x08000000, 1024) == bytes(range(256)) * 4
+
+
+@pytest.mark.parametrize("pipeline", [False, True])
+@pytest.mark.parametrize("fault", [Fault.NACK, Fault.TIMEOUT])
+def test_write_failure_resynchronized(connect, fault, pipeline):
+    """
+    the bytes left of a failed chunk are not taken as the next commands
+    """
+    loader, target = connect()
+    target.inject(fault, STM32.Command.WRITE_MEMORY, skip=1)
+    with pytest.raises(CommandError):
+        loader.write_memory_data(0x08000000, bytes(range(256)) * 2, pipeline=pipeline)
+    assert loader.read_memory(0x08000000, 16) == bytes(range(16))
+    loader.write_memory_data(0x08000100, bytes(range(256)), pipeline=pipeline)
+    assert target.read(0x08000100, 256) == bytes(range(256))
+
+
+def test_write_dropped_byte_reported(connect):
+    """
+    a byte lost in a chunk desynchronises the frames and is reported
+    """
+    loader, target = connect()
+    target.inject(Fault.DROP, STM32.Command.WRITE_MEMORY)
+    with pytest.raises(CommandError):
+        loader.write_memory_data(0x08000000, b'\x00' * 16)
+
+
+def test_write_timeout_reported(connect):
+    """
+    a chunk that never completes is reported as a command error
+    """
+    loader, target = connect()
+    target.inject(Fault.TIMEOUT, STM32.Command.WRITE_MEMORY)
+    with pytest.raises(CommandError, match="timeout"):
+        loader.write_memory_data(0x08000000, b'\x00' * 16)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# blank chunks elision
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_write_skip_blank_chunks(connect):
+    """
+    chunks made of 0xFF are not sent, flash content is unchanged
+    """
+    loader, target = connect()
+    data = b'\x00' * 256 + b'\xff' * 512 + b'\x00' * 16
+    loader.write_memory_data(0x08000000, data, skip_blank=True)
+    assert target.command_counts[STM32.Command.WRITE_MEMORY] == 2
+    assert target.read(0x08000000, len(data)) == data
+
+
+def test_write_blank_chunks_forced(connect):
+    """
+    blank chunks are sent by default
+    """
+    loader, target = connect()
+    loader.write_memory_data(0x08000000, b'\xff' * 512)
+    assert target.command_counts[STM32.Command.WRITE_MEMORY] == 2
+
+
+def test_write_blank_chunks_ram(connect):
+    """
+    blank chunks are always written outside flash memory
+    """
+    loader, target = connect()
+    loader.write_memory_data(0x20004000, b'\x00' * 256)
+    loader.write_memory_data(0x20004000, b'\xff' * 256, skip_blank=True)
+    assert target.read(0x20004000, 256) == b'\xff' * 256
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# sparse images
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_align_segments():
+    """
+    segments are padded to words, segments sharing a word are merged
+    """
+    segments = align_segments([(0x08000102, b'\x01\x02'), (0x08000100, b'\x00'), (0x08000200, b'\x03' * 4)])
+    assert segments == [(0x08000100, b'\x00\xff\x01\x02'), (0x08000200, b'\x03' * 4)]
+
+
+def test_write_segments(connect):
+    """
+    only the populated ranges are sent, chunks stop at 256 bytes boundaries
+    """
+    loader, target = connect()
+    ih = IntelHex()
+    ih.frombytes(b'\x00' * 300, 0x08000010)
+    ih.frombytes(b'\x01\x02\x03', 0x080FF001)
+    loader.write_memory_segments(segments_from_intelhex(ih))
+    assert target.command_counts[STM32.Command.WRITE_MEMORY] == 3
+    assert target.read(0x08000010, 300) == b'\x00' * 300
+    assert target.read(0x080FF000, 4) == b'\xff\x01\x02\x03'
+    assert target.read(0x08000200, 256) == b'\xff' * 256
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# differential write
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_write_diff_changed_pages(connect):
+    """
+    only the pages that differ are erased and written again
+    """
+    loader, target = connect()
+    image = bytearray(range(256)) * 32
+    loader.write_memory_data(0x08000000, image)
+    image[0x1200] ^= 0xFF
+    writes = target.command_counts[STM32.Command.WRITE_MEMORY]
+    assert loader.write_memory_diff([(0x08000000, image)]) == [2]
+    assert target.command_counts[STM32.Command.EXTENDED_ERASE] == 1
+    assert target.command_counts[STM32.Command.WRITE_MEMORY] - writes == 8
+    assert target.read(0x08000000, len(image)) == image
+
+
+def test_write_diff_preserves_page(connect):
+    """
+    page bytes outside the image are written back
+    """
+    loader, target = connect(extended_erase=False)
+    loader.write_memory_data(0x08000800, b'\x55' * 2048)
+    assert loader.write_memory_diff([(0x08000900, b'\x00' * 16)]) == [1]
+    assert target.command_counts[STM32.Command.ERASE] == 1
+    assert target.read(0x08000800, 0x100) == b'\x55' * 0x100
+    assert target.read(0x08000900, 0x20) == b'\x00' * 16 + b'\x55' * 16
+
+
+def test_write_diff_unchanged(connect):
+    """
+    nothing is erased nor written when the flash already holds the image
+    """
+    loader, target = connect()
+    loader.write_memory_data(0x08000000, b'\x12' * 64)
+    assert not loader.write_memory_diff([(0x08000000, b'\x12' * 64)])
+    assert target.command_counts[STM32.Command.WRITE_MEMORY] == 1
+
+
+def test_write_diff_sectors(connect):
+    """
+    a flash memory made of sectors is not rewritten by pages
+    """
+    loader, target = connect(0x451)
+    loader.write_memory_data(0x08000000, b'\x12' * 64)
+    with pytest.raises(PageIndexError, match="sectors"):
+        loader.write_memory_diff([(0x08000000, b'\x34' * 64)])
+    assert target.command_counts[STM32.Command.EXTENDED_ERASE] == 0
+    assert target.read(0x08000000, 64) == b'\x12' * 64
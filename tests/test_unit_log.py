@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test the loggers
+"""
+import json
+import logging
+import pytest
+from typer.testing import CliRunner
+from stmloader import log
+from stmloader.boot import boot_app
+
+runner = CliRunner()
+
+
+class Records(logging.Handler):
+    """Handler keeping the records."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_levels():
+    """
+    verbosity mapping and subsystem levels
+    """
+    assert [log.verbosity_level(verbosity) for verbosity in (-1, 0, 5, 10)] == [
+        logging.WARNING, log.NOTICE, logging.INFO, logging.DEBUG]
+    assert log.parse_level('protocol=debug') == ('protocol', logging.DEBUG)
+    assert log.parse_level('Transport=notice') == ('transport', log.NOTICE)
+    with pytest.raises(ValueError):
+        log.parse_level('uart=debug')
+    with pytest.raises(ValueError):
+        log.parse_level('devices=loud')
+
+
+def test_lazy(connect):
+    """
+    disabled messages make no record, enabled ones are formatted by handlers
+    """
+    loader, _ = connect(0x460)
+    records = Records()
+    logger = logging.getLogger(log.ROOT)
+    log.setup(0)
+    logger.addHandler(records)
+    try:
+        loader.write_memory_data(0x08000000, b'\x00' * 1024)
+        assert not records.records
+        log.setup(0, [log.parse_level('protocol=debug')])
+        logger.addHandler(records)
+        loader.write_memory_data(0x08000000, b'\x00' * 1024)
+    finally:
+        logger.removeHandler(records)
+    writes = [record for record in records.records if record.msg == "Write %d bytes at 0x%X"]
+    assert [record.args for record in writes] == [(256, 0x08000000 + offset) for offset in range(0, 1024, 256)]
+    assert all(record.name == 'stmloader.protocol' for record in records.records)
+
+
+def test_json_formatter():
+    """
+    one JSON object per record, with the extra fields
+    """
+    record = logging.getLogger('stmloader.protocol').makeRecord(
+        'stmloader.protocol', log.NOTICE, __file__, 1, "Chip id: 0x%X", (0x415,), None, extra={'port': 'A'})
+    event = json.loads(log.JsonFormatter().format(record))
+    assert event['level'] == 'NOTICE'
+    assert event['logger'] == 'stmloader.protocol'
+    assert event['message'] == "Chip id: 0x415"
+    assert event['port'] == 'A'
+    assert 'time' in event
+
+
+def test_cli_log(cli_target):
+    """
+    subsystem levels and JSON output from the cli
+    """
+    cli_target(0x415)
+    result = runner.invoke(boot_app, ["-v", "0", "--log", "protocol=info", "--log-format", "json",
+                                      "reset", "-t", "0"])
+    assert result.exit_code == 0
+    events = [json.loads(line) for line in result.output.splitlines() if line.startswith('{"')]
+    assert {'level': 'INFO', 'logger': 'stmloader.protocol', 'message': "Chip id: 0x415"}.items() <= \
+        next(event for event in events if event['message'].startswith('Chip id')).items()
+    # the verbosity still applies to the other subsystems
+    assert all(event['logger'] == 'stmloader.protocol' for event in events)
+    result = runner.invoke(boot_app, ["--log", "uart=debug", "reset"])
+    assert result.exit_code == 1
+    assert "Unknown log subsystem" in result.output
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test the job metrics
+"""
+import json
+import types
+from typer.testing import CliRunner
+from stmloader.boot import boot_app
+from stmloader.metrics import Histogram, Metrics, to_prometheus
+
+runner = CliRunner()
+
+
+def test_histogram():
+    """
+    durations counted in cumulative buckets
+    """
+    histogram = Histogram((0.01, 0.1, 1.0))
+    for value in (0.005, 0.05, 0.07, 5.0):
+        histogram.observe(value)
+    assert histogram.cumulative() == [(0.01, 1), (0.1, 3), (1.0, 3)]
+    assert histogram.count == 4
+    assert histogram.as_dict()['buckets'] == {'0.01': 1, '0.1': 3, '1.0': 3}
+
+
+def test_prometheus():
+    """
+    text format, one type line per metric family
+    """
+    metrics = Metrics()
+    metrics.count('GET_ID')
+    metrics.observe('command_ack', 0.003, 'GET_ID')
+    metrics.bytes_sent = 2
+    text = to_prometheus({'/dev/ttyUSB0': metrics, '/dev/ttyUSB1': metrics})
+    lines = text.splitlines()
+    assert lines.count('# TYPE stmloader_commands_total counter') == 1
+    assert 'stmloader_commands_total{port="/dev/ttyUSB1",command="GET_ID"} 1' in lines
+    assert 'stmloader_command_ack_seconds_bucket{port="/dev/ttyUSB0",command="GET_ID",le="0.002"} 0' in lines
+    assert 'stmloader_command_ack_seconds_bucket{port="/dev/ttyUSB0",command="GET_ID",le="0.005"} 1' in lines
+    assert 'stmloader_command_ack_seconds_count{port="/dev/ttyUSB0",command="GET_ID"} 1' in lines
+    assert 'stmloader_wire_bytes_total{port="/dev/ttyUSB0",direction="sent"} 2' in lines
+
+
+def test_prometheus_escape():
+    """
+    backslashes, quotes and newlines of the label values escaped
+    """
+    metrics = Metrics()
+    metrics.count('GET_ID')
+    text = to_prometheus({'COM3\\"a"\nb': metrics})
+    assert 'stmloader_commands_total{port="COM3\\\\\\"a\\"\\nb",command="GET_ID"} 1' in text.splitlines()
+
+
+def test_loader_metrics(connect):
+    """
+    commands, waits and bytes recorded by the loader
+    """
+    loader, _ = connect(0x460)
+    assert loader.metrics.commands == {'GET_ID': 1, 'SYNCHRONIZE': 1}
+    loader.write_memory_data(0x08000000, b'\x00' * 512)
+    loader.erase_pages([0])
+    assert loader.read_memory_data(0x08000000, 512) == b'\xff' * 512
+    stats = loader.metrics.as_dict()
+    assert stats['commands']['WRITE_MEMORY'] == 2
+    assert stats['commands']['READ_MEMORY'] == 2
+    assert stats['latency']['command_ack']['READ_MEMORY']['count'] == 2
+    assert stats['latency']['erase']['EXTENDED_ERASE']['count'] == 1
+    assert stats['latency']['reset_sync']['all']['count'] == 1
+    assert stats['transfers']['read']['bytes'] == 512
+    assert stats['transfers']['write']['bytes'] == 512
+    # read: command, address and length frames, then ACK and data
+    assert stats['wire']['sent'] > 2 * (2 + 5 + 2) + 2 * (2 + 5 + 1 + 256 + 1)
+    assert stats['wire']['received'] > 2 * (3 + 256)
+
+
+def test_read_transfer_time(connect, monkeypatch):
+    """
+    time spent by the consumer of the chunks left out of the read transfer
+    """
+    loader, _ = connect(0x460)
+    clock = types.SimpleNamespace(now=0.0)
+    monkeypatch.setattr('stmloader.metrics.time', types.SimpleNamespace(perf_counter=lambda: clock.now))
+    for _ in loader.iter_memory(0x08000000, 512):
+        clock.now += 10.0
+    assert loader.metrics.as_dict()['transfers']['read'] == {'bytes': 512, 'seconds': 0.0, 'rate': 0.0}
+
+
+def test_verify_transfer(connect):
+    """
+    bytes read back by verify counted once, in the verify transfer
+    """
+    loader, _ = connect(0x460)
+    loader.write_memory_data(0x08000000, b'\x00' * 6)
+    assert loader.verify_memory_segments([(0x08000000, b'\x00' * 6)])
+    transfers = loader.metrics.as_dict()['transfers']
+    assert 'read' not in transfers
+    assert transfers['verify']['bytes'] == 6
+
+
+def test_cli_stats(cli_target, tmp_path):
+    """
+    metrics of the job on the standard output, or in a file
+    """
+    cli_target(0x460)
+    result = runner.invoke(boot_app, ["-v", "0", "--stats", "json", "reset", "-t", "0", "get", "-i", "protocol"])
+    assert result.exit_code == 0
+    stats = json.loads(result.stdout[result.stdout.index('{'):])
+    assert stats['/dev/ttyUSB0']['commands']['GET_VERSION'] == 1
+    file = tmp_path / "stmloader.prom"
+    result = runner.invoke(boot_app, ["-v", "0", "--stats", "prometheus-textfile", "--stats-file", str(file),
+                                      "reset", "-t", "0", "read", "-l", "16", "--no-dump"])
+    assert result.exit_code == 0
+    text = file.read_text()
+    assert 'stmloader_commands_total{port="/dev/ttyUSB0",command="READ_MEMORY"} 1' in text
+    assert 'stmloader_transfer_bytes_total{port="/dev/ttyUSB0",operation="read"} 16' in text
+
+
+def test_cli_stats_boards(cli_boards):
+    """
+    metrics of each board of a multi-board job
+    """
+    cli_boards("b1", "b2")
+    result = runner.invoke(boot_app, ["-v", "0", "--ports", "b1,b2,b3", "--stats", "json", "reset", "-t", "0"])
+    assert result.exit_code == 1
+    stats = json.loads(result.stdout[result.stdout.index('{'):])
+    assert sorted(stats) == ['b1', 'b2']
+    assert stats['b2']['commands']['GET_ID'] == 1
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test the transfer progress reports
+"""
+import json
+from typer.testing import CliRunner
+from stmloader.boot import boot_app
+from stmloader.progress import Progress
+
+runner = CliRunner()
+
+
+def test_throttle():
+    """
+    first and last reports only, within the interval
+    """
+    calls = []
+    with Progress(lambda *args: calls.append(args), 1000, interval=60) as progress:
+        for _ in range(10):
+            progress.update(100)
+    assert [call[:2] for call in calls] == [(0, 1000), (1000, 1000)]
+    calls.clear()
+    with Progress(lambda *args: calls.append(args), 1000, interval=0) as progress:
+        for _ in range(10):
+            progress.update(100)
+    assert [call[0] for call in calls] == list(range(0, 1001, 100))
+    # no callback, nothing to do
+    with Progress(None, 1000) as progress:
+        progress.update(1000)
+
+
+def test_loader_progress(connect):
+    """
+    bytes done reported by reads and writes
+    """
+    loader, _ = connect(0x460)
+    calls = []
+    loader.progress = lambda *args: calls.append(args)
+    loader.write_memory_data(0x08000000, b'\x00' * 1000)
+    assert calls[0][:2] == (0, 1000)
+    assert calls[-1][:2] == (1000, 1000)
+    calls.clear()
+    loader.read_memory_data(0x08000000, 600)
+    assert calls[-1][:2] == (600, 600)
+    assert all(rate >= 0 for _, _, rate in calls)
+
+
+def json_events(output):
+    """Return the JSON lines of an output."""
+    return [json.loads(line) for line in output.splitlines() if line.startswith('{"')]
+
+
+def test_cli_progress_json(cli_target):
+    """
+    progress as JSON lines
+    """
+    cli_target(0x460)
+    result = runner.invoke(boot_app, ["-v", "0", "--progress", "json", "reset", "-t", "0", "read", "-l", "1024",
+                                      "--no-dump"])
+    assert result.exit_code == 0
+    events = json_events(result.output)
+    assert events[0] == {'event': 'progress', 'done': 0, 'total': 1024, 'rate': 0.0}
+    assert events[-1]['done'] == 1024
+
+
+def test_cli_progress_boards(cli_boards):
+    """
+    JSON lines tell the board
+    """
+    cli_boards("b1", "b2")
+    result = runner.invoke(boot_app, ["-v", "0", "--ports", "b1,b2", "--progress", "json", "reset", "-t", "0",
+                                      "read", "-l", "512", "--no-dump"])
+    assert result.exit_code == 0
+    events = json_events(result.output)
+    assert sorted(event['port'] for event in events if event['done'] == 512) == ['b1', 'b2']
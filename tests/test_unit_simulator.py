@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test the STM32 class against the simulated bootloader
+"""
+import pytest
+import scaffold
+from typer.testing import CliRunner
+from stmloader import bootloader
+from stmloader.boot import boot_app
+from stmloader.bootloader import STM32, CommandError
+from stmloader.simulator import Fault, SimulatedScaffold, SimulatedTarget
+
+runner = CliRunner()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# identification commands
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_reset_device_description(connect):
+    """
+    reset finds the device description from the chip id
+    """
+    loader, _ = connect(0x462)
+    assert loader.flash_page_size == 2048
+    assert loader.uid_address == 0x1FFF7590
+
+
+def test_get_commands(connect):
+    """
+    get returns the supported commands
+    """
+    loader, _ = connect(extended_erase=False)
+    commands = loader.get()
+    assert STM32.Command.ERASE in commands
+    assert loader.extended_erase is False
+
+
+def test_get_information(connect):
+    """
+    identification read from the memory map
+    """
+    loader, target = connect(uid=bytes(range(12)))
+    assert loader.get_protocol_version() == 0
+    assert loader.get_uid() == bytearray(range(12))
+    assert loader.get_flash_size() == 1024
+    assert loader.get_bootloader_id() == hex(target.version)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# memory commands
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_write_read_memory(connect):
+    """
+    data written is read back, odd lengths are padded with 0xFF
+    """
+    loader, target = connect()
+    data = bytes(range(256)) * 2 + b'\x01\x02'
+    loader.write_memory_data(0x08000000, data)
+    assert loader.read_memory_data(0x08000000, len(data)) == data
+    assert target.read(0x08000202, 2) == b'\xff\xff'
+
+
+def test_erase_pages(connect):
+    """
+    erase restores the page to 0xFF
+    """
+    loader, target = connect(extended_erase=False)
+    loader.write_memory_data(0x08000800, b'\x00' * 8)
+    loader.erase_memory([1])
+    assert target.read(0x08000800, 8) == b'\xff' * 8
+
+
+def test_readout_protection(connect):
+    """
+    read memory is refused while the device is protected
+    """
+    loader, target = connect()
+    loader.readout_protect()
+    loader.reset_from_system_memory(0)
+    with pytest.raises(CommandError):
+        loader.read_memory(0x08000000, 4)
+    assert target.readout_protected
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# timing and faults
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_clock_wire_time(connect):
+    """
+    modelled time depends on the line rate
+    """
+    loader, target = connect()
+    start = target.clock
+    loader.read_memory(0x08000000, 256)
+    # 256 bytes at 115200 bauds, 10 bits per byte
+    assert target.clock - start > 256 * 10 / 115200
+
+
+def test_fault_nack(connect):
+    """
+    injected NACK is reported as a command error, once
+    """
+    loader, target = connect()
+    target.inject(Fault.NACK, STM32.Command.READ_MEMORY)
+    with pytest.raises(CommandError):
+        loader.read_memory(0x08000000, 4)
+    assert loader.read_memory(0x08000000, 4) == b'\xff' * 4
+
+
+def test_fault_timeout(connect):
+    """
+    target stays silent, scaffold raises a timeout
+    """
+    loader, target = connect()
+    target.inject(Fault.TIMEOUT, skip=1)
+    loader.get_protocol_version()
+    with pytest.raises(scaffold.TimeoutError):
+        loader.get_protocol_version()
+    assert loader.get_protocol_version() == 0
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# baud rate
+# ----------------------------------------------------------------------------------------------------------------------
+
+def test_baudrate_auto(connect):
+    """
+    automatic mode steps down to the fastest rate the bootloader accepts
+    """
+    loader, target = connect(max_baudrate=460800, baudrate=STM32.BAUDRATE_AUTO)
+    assert loader.uart.baudrate == 460800
+    assert loader.get_id() == target.device_id
+
+
+def test_baudrate_too_high(connect):
+    """
+    a fixed rate is not stepped down
+    """
+    with pytest.raises(scaffold.TimeoutError):
+        connect(baudrate=921600)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# adaptive reset
+# ----------------------------------------------------------------------------------------------------------------------
+
+def reset_board(monkeypatch, startup_time):
+    """
+    Return a loader connected to a target whose bootloader starts late, not reset
+    """
+    board = SimulatedScaffold(SimulatedTarget.from_device_id(0x415, startup_time=startup_time))
+    monkeypatch.setattr(bootloader, "sleep", board.sleep)
+    return STM32(board, verbosity=0), board
+
+
+def test_reset_polling(monkeypatch):
+    """
+    the 0x7f byte is sent until the bootloader replies, well before the timeout
+    """
+    loader, board = reset_board(monkeypatch, 0.05)
+    loader.reset_from_system_memory(2.7)
+    # power cycle, bootloader startup, at most one polling interval and the Get ID command
+    assert 0.25 < board.clock < 0.35
+    assert loader.get_id() == 0x415
+    assert board.timeout == 1
+
+
+def test_reset_startup_delay(monkeypatch):
+    """
+    the first 0x7f byte waits for the startup delay, even for a bootloader ready at once
+    """
+    loader, board = reset_board(monkeypatch, 0.0)
+    loader.reset_from_system_memory(2.7)
+    assert loader.metrics.commands['SYNCHRONIZE'] == 1
+    assert board.clock > 0.2 + STM32.STARTUP_DELAY_DEFAULT > 0.2
+
+
+def test_reset_polling_timeout(monkeypatch):
+    """
+    the startup time bounds the polling
+    """
+    loader, board = reset_board(monkeypatch, 1.0)
+    with pytest.raises(scaffold.TimeoutError):
+        loader.reset_from_system_memory(0.3)
+    assert board.clock < 0.2 + 0.3 + 0.1
+    assert board.timeout == 1
+
+
+def test_reset_polling_late_reply(monkeypatch):
+    """
+    a late reply to an earlier 0x7f byte does not leave the next one pending
+    """
+    loader, board = reset_board(monkeypatch, 0.0)
+    receive = board.uart0.receive
+    calls = []
+
+    def late_receive(n=1):
+        calls.append(n)
+        if len(calls) == 1:
+            # the ACK is still on its way
+            raise scaffold.TimeoutError(data=b'')
+        return receive(n)
+
+    monkeypatch.setattr(board.uart0, "receive", late_receive)
+    loader.reset_from_system_memory(2.7)
+    assert loader.metrics.commands['SYNCHRONIZE'] == 2
+    assert loader.get_id() == 0x415
+    assert loader.read_memory(0x08000000, 4) == b'\xff' * 4
+
+
+def test_reset_command_timeout(cli_target):
+    """
+    without --timeout, the reset waits for the device startup time
+    """
+    target = cli_target(0x415, startup_time=0.5)
+    result = runner.invoke(boot_app, ["-v", "0", "reset"])
+    assert result.exit_code == 0
+    assert "Consider" not in result.output
+    assert target.command_counts[STM32.Command.GET_ID] == 1
+    result = runner.invoke(boot_app, ["-v", "0", "reset", "-m", "flash"])
+    assert result.exit_code == 0
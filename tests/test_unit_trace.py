@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Laurent Bonnet
+#
+# License: MIT
+
+"""
+Test the recording and the replay of UART traces
+"""
+import io
+import pytest
+import scaffold
+from typer.testing import CliRunner
+from stmloader import bootloader
+from stmloader.boot import boot_app
+from stmloader.bootloader import STM32
+from stmloader.trace import RECEIVE, TIMEOUT, TRANSMIT, ReplayScaffold, TraceError, breakdown, read_trace
+
+runner = CliRunner()
+
+
+def replay_loader(records):
+    """Return a loader replaying the records."""
+    board = ReplayScaffold(records)
+    return STM32(board, verbosity=0), board
+
+
+def test_record(recorded):
+    """
+    every exchange recorded in order, with its time
+    """
+    records, _ = recorded
+    kinds = [kind for kind, _, _ in records]
+    # bootloader silent while starting
+    assert kinds.count(TIMEOUT) > 1
+    assert records[kinds.index(RECEIVE)][2] == b'\x79'
+    assert [clock for _, clock, _ in records] == sorted(clock for _, clock, _ in records)
+    waits = breakdown(records)
+    assert waits['SYNCHRONIZE'][0] == kinds.count(TIMEOUT) + 1
+    assert waits['READ_MEMORY'][0] == 2 * 3
+    assert waits['EXTENDED_ERASE'][0] == 2
+
+
+def test_replay(recorded, monkeypatch):
+    """
+    the replayed session gives the recorded results, transmissions
+    gathered
+    """
+    records, _ = recorded
+    monkeypatch.setattr(bootloader, "sleep", lambda seconds: None)
+    loader, board = replay_loader(records)
+    loader.reset_from_system_memory(1)
+    assert loader.flash_page_size == 2048
+    loader.erase_pages([0])
+    # whole Write Memory frames, acknowledged at once
+    loader.write_memory_segments([(0x08000000, bytes(range(256)) * 2)])
+    assert loader.read_memory_data(0x08000000, 512) == bytes(range(256)) * 2
+    assert board.uart0.done
+    assert board.clock == records[-1][1]
+
+
+def test_replay_divergence(recorded, monkeypatch):
+    """
+    bytes sent differing from the trace, or a device silent in the trace
+    """
+    records, _ = recorded
+    monkeypatch.setattr(bootloader, "sleep", lambda seconds: None)
+    loader, _ = replay_loader(records)
+    loader.reset_from_system_memory(1)
+    with pytest.raises(TraceError):
+        loader.erase_pages([1])
+    # the device replies to the first 0x7f byte only
+    loader, _ = replay_loader(records)
+    with pytest.raises(scaffold.TimeoutError):
+        loader.uart.receive(1)
+
+
+def test_read_trace_errors():
+    """
+    not a trace, truncated trace
+    """
+    with pytest.raises(TraceError):
+        read_trace(io.BytesIO(b'STMTRAC\x01'))
+    with pytest.raises(TraceError):
+        read_trace(io.BytesIO(b'STMTRACE\x01' + bytes([TRANSMIT, 0, 0, 0, 0, 2, 0, 0, 0]) + b'\x7f'))
+
+
+def test_cli_trace(cli_target, tmp_path, monkeypatch):
+    """
+    job recorded, then replayed without the board
+    """
+    target = cli_target(0x460)
+    target.flash.data[:16] = bytes(range(16))
+    trace = tmp_path / "job.trace"
+    result = runner.invoke(boot_app, ["-v", "0", "--trace", str(trace), "reset", "-t", "0", "read", "-l", "16"])
+    assert result.exit_code == 0
+    assert "00 01 02 03" in result.output
+    monkeypatch.setattr(bootloader, "sleep", lambda seconds: None)
+    monkeypatch.setattr(scaffold, "Scaffold", None)
+    result = runner.invoke(boot_app, ["-v", "0", "--replay", str(trace), "reset", "-t", "0", "read", "-l", "16"])
+    assert result.exit_code == 0
+    assert "00 01 02 03" in result.output